@@ -1,9 +1,17 @@
 # Import libraries
 from flask import Flask, jsonify, request, Response, make_response, render_template
-from recsys.inference import load_output, rec_top_n_items, get_game_info
+from recsys.inference import (
+    OUTPUT_DIR, rec_top_n_items, predict_pairs, predict_rating, similar_items)
+from recsys.catalog import get_catalog
+from recsys.registry import ModelRegistry
 from recsys.dashboard_data_validate import get_data
+from recsys.dashboard_filter import FilterEngine
+from recsys.dashboard_scatter import scatter_points, payload_size
+from recsys.metrics import ServingMetrics, CONTENT_TYPE, mark_error
 import logging
 import json
+import os
+import gzip
 # import pre-create components for dashapp, easy to layout
 from recsys.dashboard_components import *
 import pandas as pd
@@ -18,12 +26,20 @@ import plotly.graph_objs as go
 # Example
 # curl -X POST -H 'content-type: application/json' --data '{"uid":"76561198107703934","iid":"12210"}' http://127.0.0.1:8080/predict
 # curl -X POST -H 'content-type: application/json' --data '{"rec_uid":"76561198107703934"}' http://127.0.0.1:8080/rec
+# curl -X POST -H 'content-type: application/json' --data '{"pairs":[{"uid":"76561198107703934","iid":"12210"}]}' http://127.0.0.1:8080/predict/batch
+# curl -X POST -H 'content-type: application/json' --data '{"iid":"12210","n":10}' http://127.0.0.1:8080/similar
+# curl http://127.0.0.1:8080/metrics
 
 server = Flask(__name__)
 print(__name__)
 
-output = load_output()
-pred, algo = output["predictions"], output["algo"]
+# loaded once, reloaded in the background when a new model is trained;
+# RECSYS_MODEL_DIR serves another model, e.g. the implicit one
+registry = ModelRegistry(os.environ.get("RECSYS_MODEL_DIR", OUTPUT_DIR)).start()
+catalog = get_catalog()
+metrics = ServingMetrics(registry)
+metrics.instrument(server, ["/predict", "/predict/batch", "/rec",
+                            "/similar", "/"])
 
 
 def precondition(data, accpetable_keys):
@@ -35,10 +51,16 @@ def precondition(data, accpetable_keys):
     return False
 
 
+def error_result(error):
+    # answered with 200, counted as an error by the metrics
+    mark_error()
+    return {"error": error}
+
+
 @server.route('/ping', methods=["GET"])
 def ping():
     logging.info("checking health status of recsys api")
-    content = {"status", "OK"}
+    content = json.dumps({"status": "OK"})
     try:
         return Response(content, status=200,
                         mimetype="application/json"
@@ -47,6 +69,11 @@ def ping():
         logging.critical("RecSys API is not working")
 
 
+@server.route('/metrics', methods=["GET"])
+def prometheus_metrics():
+    return Response(metrics.render(), status=200, content_type=CONTENT_TYPE)
+
+
 @server.route('/predict', methods=['POST'])
 def predict():
     if request.content_type != 'application/json':
@@ -69,14 +96,47 @@ def predict():
             try:
                 uid = data["uid"]
                 iid = data["iid"]
-                _, _, _, est, _ = algo.predict(uid, iid)
+                model = registry.current()
+                est = predict_rating(model.algo, uid, iid, model.encoders)
                 result = {"est": est}
             except Exception as e:
-                result = {"error": e.args}
+                result = error_result(e.args)
         else:
-            result = {"error": "Inference failed"}
+            result = error_result("Inference failed")
     except Exception as e:
-        result = {"error": e.args}
+        result = error_result(e.args)
+    return jsonify(result)
+
+
+@server.route('/predict/batch', methods=['POST'])
+def predict_batch():
+    if request.content_type != 'application/json':
+        logging.warning("Response data type is not json")
+        return make_response(
+            jsonify({
+                "errors": ["only supports JSON data"]}),
+            400)  # bad request
+
+    # Get the data from the POST request, optionally gzip compressed.
+    try:
+        encoding = request.headers.get('content-encoding', '')
+        data = request.get_data()
+        if encoding == "gzip":
+            data = gzip.decompress(data)
+        data = json.loads(data)
+
+        if precondition(data, accpetable_keys=["pairs"]) and isinstance(
+                data["pairs"], list):
+            # unknown ids get an error in their own result only
+            model = registry.current()
+            result = {"results": predict_pairs(model.algo, data["pairs"],
+                                               model.factors, model.encoders)}
+        else:
+            logging.warning("precondition not satisfied")
+            result = error_result("precondition not satisfied")
+    except Exception as e:
+        logging.critical("Inference failed")
+        result = error_result(e.args)
     return jsonify(result)
 
 
@@ -100,25 +160,68 @@ def rec():
         if precondition(data, accpetable_keys=["rec_uid"]):
             try:
                 rec_uid = data["rec_uid"]
-                rec = rec_top_n_items(rec_uid, pred)
+                model = registry.current()
+                rec = rec_top_n_items(rec_uid, model.top_n_index,
+                                      encoders=model.encoders)
                 result = {"rec": rec}
             except Exception as e:
-                result = {"error": e.args}
+                result = error_result(e.args)
         else:
             logging.warning("precondition not satisfied")
-            result = {"error": "precondition not satisfied"}
+            result = error_result("precondition not satisfied")
     except Exception as e:
         logging.critical("Inference failed")
-        result = {"error": e.args}
+        result = error_result(e.args)
+    return jsonify(result)
+
+
+@server.route('/similar', methods=['POST'])
+def similar():
+    if request.content_type != 'application/json':
+        logging.warning("Response data type is not json")
+        return make_response(
+            jsonify({
+                "errors": ["only supports JSON data"]}),
+            400)  # bad request
+
+    # Get the data from the POST request.
+    try:
+        encoding = request.headers.get('content-encoding', '')
+        data = request.get_data()
+        if encoding == "gzip":
+            data = gzip.decompress(data)
+        data = json.loads(data)
+        if precondition(data, accpetable_keys=["iid"]):
+            model = registry.current()
+            if model.item_index is None:
+                result = error_result("current model has no item factors")
+            else:
+                try:
+                    neighbours = similar_items(model.item_index, data["iid"],
+                                               int(data.get("n", 10)),
+                                               model.encoders)
+                    names = catalog.lookup([i for i, _ in neighbours],
+                                           ["id", "app_name"])
+                    names = dict(zip(names["id"], names["app_name"]))
+                    result = {"similar": [{"iid": i,
+                                           "app_name": names.get(i),
+                                           "score": score}
+                                          for i, score in neighbours]}
+                except Exception as e:
+                    result = error_result(e.args)
+        else:
+            logging.warning("precondition not satisfied")
+            result = error_result("precondition not satisfied")
+    except Exception as e:
+        logging.critical("Inference failed")
+        result = error_result(e.args)
     return jsonify(result)
 
 
 @server.route('/', methods=["GET", "POST"])
 def index():
 
-    output = load_output()
-    pred, algo = output["predictions"], output["algo"]
-    df_pred = pd.DataFrame(pred)
+    model = registry.current()
     sample_uid = [
         '76561198044716809',
         '76561198056863768',
@@ -133,14 +236,12 @@ def index():
         iid = data["iid"]
         rec_uid = data["recuid"]
         num = int(data["n"])
-        _, _, _, est, _ = algo.predict(uid, iid)
-        rec_ls = rec_top_n_items(rec_uid, pred, num)
+        est = predict_rating(model.algo, uid, iid, model.encoders)
+        rec_ls = rec_top_n_items(rec_uid, model.top_n_index, num,
+                                 model.encoders)
         col = ['id', 'app_name', 'publisher', 'developer',
                'price']
-        info_dict = {}
-        for i in col:
-            info_dict[i] = get_game_info(rec_ls, i)
-        df_info = pd.DataFrame(info_dict)
+        df_info = catalog.lookup(rec_ls, col)
         return render_template('./index.html', uid=uid, iid=iid,
                                rec_uid=rec_uid, n=num,
                                est=est, rec_ls=rec_ls,
@@ -165,6 +266,9 @@ external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
 app = dash.Dash(__name__, server=server,
                 external_stylesheets=external_stylesheets)
 
+# both callbacks filter the same rows, the engine computes them once
+filter_engine = FilterEngine(df, text_indexes)
+
 
 # Set app layout
 app.layout = html.Div([
@@ -208,77 +312,79 @@ app.layout = html.Div([
         dash.dependencies.Input('developer-input', 'value'),
         dash.dependencies.Input('year-released-range-slider', 'value'),
         dash.dependencies.Input('x-axis-dropdown', 'value'),
-        dash.dependencies.Input('y-axis-dropdown', 'value')
+        dash.dependencies.Input('y-axis-dropdown', 'value'),
+        dash.dependencies.Input('scatter-plot-graph', 'relayoutData')
     ]
 )
+@metrics.track_callback
 def update_scatter_plot(selected_nb_reviews, selected_nb_recommend,
                         input_min_price, input_max_price, selected_genre,
                         input_more_genre, input_publisher, input_developer,
-                        selected_years_released, x_axis_var, y_axis_var):
-
-    nb_reviews = selected_nb_reviews or df.n_review.min()
-    year_released_start, year_released_end = selected_years_released or (
-        df.release_year.min(), df.release_year.max())
-    nb_recommend = selected_nb_recommend or df.n_recommend.min()
-    price_min = input_min_price or 0
-    price_max = input_max_price or df.price.max()
-    game_genre = selected_genre or None
-    more_genre = input_more_genre.strip() or None
-    publisher = input_publisher.strip() or None
-    developer = input_developer.strip() or None
+                        selected_years_released, x_axis_var, y_axis_var,
+                        relayout_data):
+
+    filters = (selected_nb_reviews, selected_nb_recommend, input_min_price,
+               input_max_price, selected_genre, input_more_genre,
+               input_publisher, input_developer, selected_years_released)
     x_axis = x_axis_var or "price"
     y_axis = y_axis_var or "n_review"
-
-    filtered_df = (
-        df.pipe(lambda df: df[df['n_review'] >= nb_reviews])
-        .pipe(lambda df: df[(df['release_year'] >= year_released_start) & (df['release_year'] <= year_released_end)])
-        .pipe(lambda df: df[df['n_recommend'] >= nb_recommend])
-        .pipe(lambda df: df[(df['price'] >= price_min) & (df['price'] <= price_max)])
-        .pipe(lambda df: df[df['genres'].str.contains(game_genre, case=False, na=False)] if game_genre else df)
-        .pipe(lambda df: df[df['genres'].str.contains(more_genre, case=False, na=False)] if more_genre else df)
-        .pipe(lambda df: df[df['publisher'].str.contains(publisher, case=False, na=False)] if publisher else df)
-        .pipe(lambda df: df[df['developer'].str.contains(developer, case=False, na=False)] if developer else df)
-    )
-
-    return {
+    # the zoom of the previous axes does not apply to the new ones
+    triggered = [t["prop_id"] for t in dash.callback_context.triggered]
+    if any(prop.split(".")[0] in ("x-axis-dropdown", "y-axis-dropdown")
+           for prop in triggered):
+        relayout_data = None
+    cols = [x_axis, y_axis, "app_name"]
+    early_df = filter_engine.select(*filters, early_access=True, cols=cols)
+    no_early_df = filter_engine.select(*filters, early_access=False,
+                                       cols=cols)
+    # past MAX_POINTS visible games, cells of a grid are sent instead
+    early, no_early = scatter_points([early_df, no_early_df], x_axis, y_axis,
+                                     relayout_data)
+
+    figure = {
         'data':
 
         [
             go.Scatter(
-                x=filtered_df[filtered_df.early_access == True][x_axis],
-                y=filtered_df[filtered_df.early_access == True][y_axis],
-                text=filtered_df[filtered_df.early_access ==
-                                 True]['app_name'],
+                x=early["x"],
+                y=early["y"],
+                text=early["text"],
                 mode='markers',
                 opacity=0.8,
                 marker={
                     'color': 'orange',
-                    'size': 10,
+                    'size': 10 if early["size"] is None else early["size"],
                     'line': {'width': 1, 'color': 'black'}
                 },
                 name="early_access"
             ),
             go.Scatter(
-                x=filtered_df[filtered_df.early_access == False][x_axis],
-                y=filtered_df[filtered_df.early_access == False][y_axis],
-                text=filtered_df[filtered_df.early_access ==
-                                 False]['app_name'],
+                x=no_early["x"],
+                y=no_early["y"],
+                text=no_early["text"],
                 mode='markers',
                 opacity=0.5,
                 marker={
                     'color': 'blue',
-                    'size': 10,
+                    'size': 10 if no_early["size"] is None else no_early["size"],
                     'line': {'width': 1, 'color': 'black'}
                 },
                 name="no early_access"
             )
         ],
 
+        # keep the user's zoom when the figure is replaced, until the axes
+        # change
         'layout': {"autosize": True,
                    "automargin": True,
                    "margin": dict(l=30, r=30, b=20, t=40),
-                   "hovermode": "closest"}
+                   "hovermode": "closest",
+                   "uirevision": f"{x_axis} {y_axis}"}
     }
+    logging.info(f"scatter plot: {early['n_rows'] + no_early['n_rows']} "
+                 f"games as {len(early['x']) + len(no_early['x'])} points, "
+                 f"{payload_size(figure)} bytes")
+    return figure
 
 
 @app.callback(
@@ -297,33 +403,16 @@ def update_scatter_plot(selected_nb_reviews, selected_nb_recommend,
         dash.dependencies.Input('y-axis-dropdown', 'value')
     ]
 )
+@metrics.track_callback
 def update_nb_rows_selected(selected_nb_reviews, selected_nb_recommend,
                             input_min_price, input_max_price, selected_genre, input_more_genre, input_publisher, input_developer,
                             selected_years_released, x_axis_var, y_axis_var):
-    nb_reviews = selected_nb_reviews or df.n_review.min()
-    year_released_start, year_released_end = selected_years_released or (
-        df.release_year.min(), df.release_year.max())
-    nb_recommend = selected_nb_recommend or df.n_recommend.min()
-    price_min = input_min_price or 0
-    price_max = input_max_price or df.price.max()
-    game_genre = selected_genre or None
-    more_genre = input_more_genre.strip() or None
-    publisher = input_publisher.strip() or None
-    developer = input_developer.strip() or None
-    x_axis = x_axis_var or "price"
-    y_axis = y_axis_var or "n_review"
-
-    filtered_df = (
-        df.pipe(lambda df: df[df['n_review'] >= nb_reviews])
-        .pipe(lambda df: df[(df['release_year'] >= year_released_start) & (df['release_year'] <= year_released_end)])
-        .pipe(lambda df: df[df['n_recommend'] >= nb_recommend])
-        .pipe(lambda df: df[(df['price'] >= price_min) & (df['price'] <= price_max)])
-        .pipe(lambda df: df[df['genres'].str.contains(game_genre, case=False, na=False)] if game_genre else df)
-        .pipe(lambda df: df[df['genres'].str.contains(more_genre, case=False, na=False)] if more_genre else df)
-        .pipe(lambda df: df[df['publisher'].str.contains(publisher, case=False, na=False)] if publisher else df)
-        .pipe(lambda df: df[df['developer'].str.contains(developer, case=False, na=False)] if developer else df)
-    )
-    return 'Number of rows selected: {}'.format(len(filtered_df.index))
+    # same filters as update_scatter_plot, served from the engine cache
+    nb_rows = filter_engine.count(
+        selected_nb_reviews, selected_nb_recommend, input_min_price,
+        input_max_price, selected_genre, input_more_genre, input_publisher,
+        input_developer, selected_years_released)
+    return 'Number of rows selected: {}'.format(nb_rows)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,484 @@
+"""
+Columnar, memory-mappable artifact store shared by every pipeline stage.
+
+Tables are written as Parquet, numeric model arrays as .npy (or one
+compressed .npz) next to a manifest.json. Both carry FORMAT_VERSION so
+readers can refuse artifacts written by a newer layout. Legacy pickle files
+are still read when the new artifact does not exist yet.
+
+resolve
+save_table
+load_table
+read_metadata
+save_arrays
+load_arrays
+save_encoders
+load_encoders
+save_top_k
+load_top_k
+save_model_output
+swapping
+load_model_output
+load_factors
+"""
+
+import json
+import numbers
+import pickle
+import time
+from os import makedirs, rename
+from shutil import rmtree
+from os.path import exists, join, splitext
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from scipy import sparse
+from surprise.prediction_algorithms.predictions import Prediction
+
+from recsys.encoding import IdEncoder
+from recsys.scoring import is_factor_model, get_factors
+from recsys.topk import TopK
+
+FORMAT_VERSION = 3
+METADATA_KEY = b"recsys"
+MANIFEST = "manifest.json"
+ARCHIVE = "arrays.npz"
+ENCODER_FILES = {"user": "user_ids.parquet", "item": "item_ids.parquet"}
+
+
+def resolve(path):
+    """path itself, or the legacy .pkl written before the artifact store."""
+    legacy = splitext(path)[0] + ".pkl"
+    if not exists(path) and exists(legacy):
+        return legacy
+    return path
+
+
+def _metadata(**extra):
+    return {"format_version": FORMAT_VERSION,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            **extra}
+
+
+def _check_version(metadata, path):
+    version = metadata.get("format_version", 0)
+    if version > FORMAT_VERSION:
+        raise ValueError(f"{path} has format version {version}, "
+                         f"this recsys reads up to {FORMAT_VERSION}")
+
+
+def _load_pickle(file):
+    f = open(file, "rb")
+    data = pickle.load(f)
+    f.close()
+    return data
+
+
+# python types of the values of mixed columns, stored as int8 codes
+MIXED_TYPES = (str, int, float, bool)
+
+
+def _type_column(col):
+    return f"__type__{col}"
+
+
+def _type_code(x):
+    if isinstance(x, (bool, np.bool_)):
+        return 3
+    if isinstance(x, numbers.Integral):
+        return 1
+    if isinstance(x, numbers.Real):
+        return 2
+    return 0
+
+
+def _to_arrow(df):
+    columns = {}
+    mixed = []
+    for col in df.columns:
+        try:
+            columns[col] = pa.array(df[col], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # mixed python types, e.g. price holds floats and "Free to Play",
+            # stored as strings next to the type of every value
+            mixed.append(col)
+            missing = df[col].isna().values
+            columns[col] = pa.array(
+                [None if m else str(x) for x, m in zip(df[col], missing)],
+                type=pa.string())
+            columns[_type_column(col)] = pa.array(
+                [None if m else _type_code(x)
+                 for x, m in zip(df[col], missing)], type=pa.int8())
+    return pa.table(columns), mixed
+
+
+def _parse(value, code):
+    if code == 3:
+        return value == "True"
+    return MIXED_TYPES[code](value)
+
+
+def _from_arrow(table, mixed=()):
+    types = {col: table.column(_type_column(col)).to_pylist()
+             for col in mixed if _type_column(col) in table.column_names}
+    table = table.drop_columns([_type_column(col) for col in types])
+    df = table.to_pandas()
+    for field in table.schema:
+        col = field.name
+        if pa.types.is_list(field.type) or pa.types.is_large_list(field.type):
+            # python lists rather than numpy arrays, so str() of a genres
+            # value reads "['Action', 'Indie']" as it did before parquet
+            df[col] = pd.Series(table.column(col).to_pylist(), dtype=object)
+        if col in types:
+            df[col] = pd.Series(
+                [np.nan if code is None else _parse(value, code)
+                 for value, code in zip(table.column(col).to_pylist(),
+                                        types[col])], dtype=object)
+        elif col in mixed:
+            # written before the types were stored, numbers come back as
+            # floats
+            numbers = pd.to_numeric(df[col], errors="coerce")
+            df[col] = df[col].where(numbers.isna(), numbers).astype(object)
+        if df[col].dtype == object:
+            # arrow reads missing values of object columns as None
+            df[col] = df[col].where(df[col].notna(), np.nan)
+    return df
+
+
+def save_table(df, file, **metadata):
+    """write a DataFrame as Parquet with version metadata.
+
+    load_table reads back the same values: lists stay python lists,
+    missing values NaN, and columns mixing strings, ints, floats and
+    booleans keep the type of every value. The index is not stored.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+    file : str
+    metadata : dict
+        extra json-serializable entries stored next to the version.
+
+    """
+    table, mixed = _to_arrow(df.reset_index(drop=True))
+    table = table.replace_schema_metadata(
+        {METADATA_KEY: json.dumps(_metadata(mixed_columns=mixed,
+                                            **metadata))})
+    pq.write_table(table, file)
+
+
+def read_metadata(file):
+    """version metadata of a table, without reading its data."""
+    schema_metadata = pq.read_schema(file).metadata or {}
+    return json.loads(schema_metadata.get(METADATA_KEY, b"{}"))
+
+
+def load_table(file, columns=None):
+    """read a table written by save_table, memory-mapped.
+
+    Parameters
+    ----------
+    file : str
+    columns : list, optional
+        only these columns are read from disk.
+
+    Returns
+    -------
+    type: pandas.DataFrame
+
+    """
+    file = resolve(file)
+    if file.endswith(".pkl"):
+        df = _load_pickle(file)
+        return df if columns is None else df[columns]
+
+    metadata = read_metadata(file)
+    _check_version(metadata, file)
+    mixed = metadata.get("mixed_columns", [])
+    if columns is not None:
+        # the types of mixed columns are read along with them
+        stored = pq.read_schema(file).names
+        columns = list(columns) + [
+            _type_column(col) for col in mixed
+            if col in columns and _type_column(col) in stored]
+    return _from_arrow(pq.read_table(file, columns=columns, memory_map=True),
+                       mixed)
+
+
+def save_arrays(arrays, directory, compress=False, **metadata):
+    """write numeric arrays as .npy files plus a versioned manifest.
+
+    Parameters
+    ----------
+    arrays : dict
+        keys: array name
+        items: numpy.ndarray.
+    directory : str
+    compress : bool
+        write all arrays to one compressed arrays.npz instead, smaller but
+        read into memory rather than memory-mapped.
+    metadata : dict
+        extra json-serializable manifest entries.
+
+    """
+    makedirs(directory, exist_ok=True)
+    if compress:
+        np.savez_compressed(join(directory, ARCHIVE), **{
+            name: np.asarray(array) for name, array in arrays.items()})
+    else:
+        for name, array in arrays.items():
+            np.save(join(directory, name + ".npy"), np.asarray(array),
+                    allow_pickle=False)
+    manifest = _metadata(arrays=sorted(arrays), compressed=compress,
+                         **metadata)
+    with open(join(directory, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def load_arrays(directory, names=None, mmap_mode="r"):
+    """read arrays written by save_arrays.
+
+    Returns
+    -------
+    type: turple
+        dict of name to (memory-mapped) numpy.ndarray, manifest dict.
+
+    """
+    with open(join(directory, MANIFEST)) as f:
+        manifest = json.load(f)
+    _check_version(manifest, directory)
+    names = manifest["arrays"] if names is None else names
+    if manifest.get("compressed"):
+        with np.load(join(directory, ARCHIVE), allow_pickle=False) as npz:
+            return {name: npz[name] for name in names}, manifest
+    arrays = {name: np.load(join(directory, name + ".npy"),
+                            mmap_mode=mmap_mode, allow_pickle=False)
+              for name in names}
+    return arrays, manifest
+
+
+def save_encoders(encoders, directory):
+    """write the user and item IdEncoder as id tables in directory."""
+    for kind, file in ENCODER_FILES.items():
+        save_table(pd.DataFrame({"id": encoders[kind].ids}),
+                   join(directory, file), kind=kind)
+
+
+def load_encoders(directory):
+    """user and item IdEncoder of directory, None when it has none.
+
+    Returns
+    -------
+    type: dict
+        keys: user, item
+        items: recsys.encoding.IdEncoder.
+
+    """
+    files = {kind: join(directory, file)
+             for kind, file in ENCODER_FILES.items()}
+    if not all(exists(file) for file in files.values()):
+        return None
+    return {kind: IdEncoder(load_table(file)["id"].values)
+            for kind, file in files.items()}
+
+
+def save_top_k(top_k, directory, scores=False):
+    """write a TopK as compressed arrays plus its user and item id tables.
+
+    Only the ranking is kept unless scores, serving needs no more.
+    """
+    arrays = {"items": top_k.items}
+    if scores and top_k.scores is not None:
+        arrays["scores"] = top_k.scores
+    save_arrays(arrays, directory, compress=True)
+    save_table(pd.DataFrame({"id": top_k.users}),
+               join(directory, "users.parquet"))
+    save_table(pd.DataFrame({"id": top_k.item_ids}),
+               join(directory, "items.parquet"))
+
+
+def _from_offsets(arrays):
+    # format version 1 kept the lists back to back with an offsets index
+    lengths = np.diff(arrays["offsets"])
+    filled = np.arange(lengths.max(initial=0)) < lengths[:, None]
+    items = np.full(filled.shape, -1, dtype=np.int32)
+    items[filled] = arrays["items"]
+    scores = np.full(filled.shape, np.nan, dtype=np.float32)
+    scores[filled] = arrays["scores"]
+    return {"items": items, "scores": scores}
+
+
+def load_top_k(directory, mmap_mode="r"):
+    """read a TopK written by save_top_k."""
+    arrays, _ = load_arrays(directory, mmap_mode=mmap_mode)
+    if "offsets" in arrays:
+        arrays = _from_offsets(arrays)
+    return TopK(load_table(join(directory, "users.parquet"))["id"].values,
+                arrays["items"],
+                load_table(join(directory, "items.parquet"))["id"].values,
+                arrays.get("scores"))
+
+
+def save_model_output(output, directory):
+    """write refit output as a model artifact directory.
+
+    algo.pkl holds the surprise model, top_k/ the ranked recommendations
+    of every user, predictions.parquet the predictions when there are any
+    and, for factor models, factors/ the biases and factors as .npy with
+    user and item ids as Parquet.
+
+    Parameters
+    ----------
+    output : dict
+        keys: algo, top_n (recsys.topk.TopK) and optionally predictions and
+        encoders, with encoders the model works on int codes and
+        predictions are stored as int32.
+    directory : str
+
+    """
+    # build the artifact next to the live one and swap it in at the end, so
+    # a watching server never reads a half-written model
+    final_directory = directory
+    directory = final_directory + ".tmp"
+    if exists(directory):
+        rmtree(directory)
+    makedirs(directory)
+    algo = output["algo"]
+    with open(join(directory, "algo.pkl"), "wb") as f:
+        pickle.dump(algo, f)
+
+    encoders = output.get("encoders")
+    if encoders is not None:
+        save_encoders(encoders, directory)
+    if output.get("top_n") is not None:
+        save_top_k(output["top_n"], join(directory, "top_k"))
+
+    if output.get("predictions"):
+        df_pred = pd.DataFrame(
+            [(uid, iid, r_ui, est, details.get("was_impossible", False))
+             for uid, iid, r_ui, est, details in output["predictions"]],
+            columns=["uid", "iid", "r_ui", "est", "was_impossible"])
+        if encoders is not None:
+            df_pred = df_pred.astype({"uid": np.int32, "iid": np.int32})
+        save_table(df_pred, join(directory, "predictions.parquet"))
+
+    if is_factor_model(algo):
+        factors = get_factors(algo)
+        factor_dir = join(directory, "factors")
+        seen = factors["seen"]
+        save_arrays({"bu": factors["bu"],
+                     "bi": factors["bi"],
+                     "pu": factors["pu"],
+                     "qi": factors["qi"],
+                     "seen_indptr": seen.indptr,
+                     "seen_indices": seen.indices},
+                    factor_dir,
+                    global_mean=factors["global_mean"],
+                    rating_scale=list(factors["rating_scale"]))
+        save_table(pd.DataFrame({"id": factors["raw_uids"]}),
+                   join(factor_dir, "users.parquet"))
+        save_table(pd.DataFrame({"id": factors["raw_iids"]}),
+                   join(factor_dir, "items.parquet"))
+
+    with open(join(directory, MANIFEST), "w") as f:
+        json.dump(_metadata(algo_name=type(algo).__name__,
+                            factors=is_factor_model(algo)), f, indent=2)
+
+    # readers treat the artifact as missing while the .old one exists, the
+    # directory is briefly gone between the two renames, see swapping
+    if exists(final_directory + ".old"):
+        rmtree(final_directory + ".old")
+    if exists(final_directory):
+        rename(final_directory, final_directory + ".old")
+        rename(directory, final_directory)
+        rmtree(final_directory + ".old")
+    else:
+        rename(directory, final_directory)
+
+
+def swapping(directory):
+    """whether save_model_output is swapping a new artifact in at directory.
+
+    directory may not exist then, or still hold the previous artifact; a
+    reader should keep what it has loaded until the swap is over rather
+    than fall back to a legacy pickle.
+    """
+    return exists(directory + ".old")
+
+
+def load_model_output(directory, predictions=True):
+    """read a model artifact directory, or a legacy pickle.
+
+    Parameters
+    ----------
+    directory : str
+    predictions : bool
+        rebuild the list of surprise Prediction, skip it when only the
+        model and its top-K lists are needed.
+
+    Returns
+    -------
+    type: dict
+        keys: predictions, algo, encoders, top_n
+        items: list of predictions (details only keep was_impossible, empty
+            when none were stored), trained model, user and item IdEncoder
+            or None when the model works on raw ids, recsys.topk.TopK or
+            None for artifacts written before it existed
+
+    """
+    directory = resolve(directory)
+    if directory.endswith(".pkl"):
+        output = _load_pickle(directory)
+        output.setdefault("encoders", None)
+        output.setdefault("top_n", None)
+        return output
+
+    with open(join(directory, MANIFEST)) as f:
+        _check_version(json.load(f), directory)
+    top_k_dir = join(directory, "top_k")
+    output = {"algo": _load_pickle(join(directory, "algo.pkl")),
+              "predictions": [],
+              "encoders": load_encoders(directory),
+              "top_n": load_top_k(top_k_dir) if exists(top_k_dir) else None}
+    if predictions and exists(join(directory, "predictions.parquet")):
+        df_pred = load_table(join(directory, "predictions.parquet"))
+        if output["encoders"] is not None:
+            # surprise knows the codes as python ints
+            df_pred = df_pred.astype({"uid": object, "iid": object})
+        output["predictions"] = [
+            Prediction(uid, iid, r_ui, est, {"was_impossible": impossible})
+            for uid, iid, r_ui, est, impossible in df_pred.itertuples(
+                index=False, name=None)]
+    return output
+
+
+def load_factors(directory, mmap_mode="r"):
+    """memory-map the factors of a model artifact for recsys.scoring.
+
+    Returns
+    -------
+    type: dict
+        same keys as recsys.scoring.get_factors.
+
+    """
+    factor_dir = join(directory, "factors")
+    arrays, manifest = load_arrays(factor_dir, mmap_mode=mmap_mode)
+    raw_uids = load_table(join(factor_dir, "users.parquet"))["id"].values
+    raw_iids = load_table(join(factor_dir, "items.parquet"))["id"].values
+    indices = arrays["seen_indices"]
+    seen = sparse.csr_matrix(
+        (np.ones(len(indices)), indices, arrays["seen_indptr"]),
+        shape=(len(raw_uids), len(raw_iids)))
+    return {"global_mean": manifest["global_mean"],
+            "bu": arrays["bu"],
+            "bi": arrays["bi"],
+            "pu": arrays["pu"],
+            "qi": arrays["qi"],
+            "seen": seen,
+            "rating_scale": tuple(manifest["rating_scale"]),
+            "raw_uids": raw_uids,
+            "raw_iids": raw_iids,
+            "uid_index": {uid: u for u, uid in enumerate(raw_uids)},
+            "iid_index": {iid: i for i, iid in enumerate(raw_iids)}}
@@ -0,0 +1,480 @@
+"""
+Benchmarks of the evaluation, training, preprocessing and serving hot paths.
+
+Every case runs on seeded synthetic data at one or more scales, so runs on
+the same machine are comparable without the UCSD files. Each case is set up
+once per scale, run once to warm up and then timed repeat times; the
+results are written as JSON. Given a baseline JSON of an earlier run, cases
+whose median time grew by more than tolerance are reported as regressions
+and the run exits with status 1.
+
+Cases follow asv's setup / time split: a case's setup builds its inputs
+and returns the callable that is timed.
+
+usage example:
+
+python benchmark.py --scales small medium --output bench.json
+python benchmark.py --baseline bench.json --tolerance 0.2
+python benchmark.py --cases evaluate --scales large
+
+The small scale cases also run under pytest-benchmark, which keeps its own
+saved runs to compare with:
+
+python -m pytest tests/test_benchmark.py --benchmark-autosave
+python -m pytest tests/test_benchmark.py --benchmark-compare
+
+SCALES
+CASES
+Skip
+synthetic_ratings
+synthetic_reviews
+time_case
+run_benchmarks
+compare
+main
+"""
+
+import argparse
+import atexit
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from itertools import cycle
+from os.path import abspath, dirname, join
+
+import numpy as np
+import pandas as pd
+from surprise import (Dataset, Reader, KNNWithMeans, SVD, SVDpp, SlopeOne,
+                      CoClustering)
+from surprise.prediction_algorithms.predictions import Prediction
+
+from recsys import evaluate, steam_preprocess, train
+from recsys.als import ImplicitALS
+from recsys.artifacts import save_model_output
+from recsys.topk import build_top_k
+
+ROOT_DIR = dirname(dirname(abspath(__file__)))
+
+# users, items and ratings of the synthetic explicit data
+SCALES = {"small": {"n_users": 300, "n_items": 100, "n_ratings": 5000},
+          "medium": {"n_users": 3000, "n_items": 500, "n_ratings": 50000},
+          "large": {"n_users": 20000, "n_items": 2000, "n_ratings": 300000}}
+
+Case = namedtuple("Case", ["name", "setup", "repeat", "scales"])
+
+
+class Skip(Exception):
+    """raised by a case setup that cannot run in this environment."""
+
+
+def synthetic_ratings(n_users, n_items, n_ratings, seed=0):
+    """binary recommend ratings with power-law item popularity.
+
+    Returns
+    -------
+    type: pandas.DataFrame
+        columns: user_id, item_id, recommend, ids are strings as in the raw
+        data, (user_id, item_id) pairs are unique.
+
+    """
+    rng = np.random.RandomState(seed)
+    popularity = 1. / np.arange(1, n_items + 1) ** 0.8
+    users = rng.randint(n_users, size=n_ratings)
+    items = rng.choice(n_items, size=n_ratings, p=popularity / popularity.sum())
+    # users and items lean towards recommending or not
+    logit = rng.normal(1., 1., n_users)[users] + rng.normal(0., 1., n_items)[
+        items]
+    recommend = (rng.rand(n_ratings) < 1. / (1. + np.exp(-logit))).astype(int)
+    df = pd.DataFrame({"user_id": users.astype(str),
+                       "item_id": items.astype(str),
+                       "recommend": recommend})
+    return df.drop_duplicates(["user_id", "item_id"]).reset_index(drop=True)
+
+
+def synthetic_reviews(ratings):
+    """ratings as raw review records, as streamed from the UCSD review file."""
+    review_info = []
+    for uid, group in ratings.groupby("user_id", sort=False):
+        review_info.append({
+            "user_id": uid,
+            "reviews": [{"item_id": iid, "recommend": bool(r),
+                         "review": "great game" if r else "refunded"}
+                        for iid, r in zip(group["item_id"],
+                                          group["recommend"])]})
+    return review_info
+
+
+def _predictions(ratings, seed=0):
+    rng = np.random.RandomState(seed)
+    est = np.clip(ratings["recommend"] * 0.5 + rng.rand(len(ratings)) * 0.5,
+                  0, 1)
+    return [Prediction(uid, iid, float(r), float(e), {})
+            for uid, iid, r, e in zip(ratings["user_id"], ratings["item_id"],
+                                      ratings["recommend"], est)]
+
+
+class ScaleData:
+    """inputs shared by every case of one scale, built on first use."""
+
+    def __init__(self, scale, seed=0):
+        self.scale = scale
+        self.seed = seed
+        self._cache = {}
+
+    def _get(self, key, build):
+        if key not in self._cache:
+            self._cache[key] = build()
+        return self._cache[key]
+
+    @property
+    def ratings(self):
+        return self._get("ratings", lambda: synthetic_ratings(
+            **SCALES[self.scale], seed=self.seed))
+
+    @property
+    def predictions(self):
+        return self._get("predictions",
+                         lambda: _predictions(self.ratings, self.seed))
+
+    @property
+    def reviews(self):
+        return self._get("reviews", lambda: synthetic_reviews(self.ratings))
+
+    @property
+    def dataset(self):
+        return Dataset.load_from_df(self.ratings,
+                                    reader=Reader(rating_scale=(0, 1)))
+
+
+# evaluation
+
+
+def _setup_get_top_n(data):
+    predictions = data.predictions
+    return lambda: evaluate.get_top_n(predictions, 10)
+
+
+def _setup_precision_recall(data):
+    predictions = data.predictions
+    return lambda: evaluate.precision_recall_at_k(predictions, 10, 0.7)
+
+
+def _setup_personalization(data):
+    predictions = data.predictions
+    return lambda: evaluate.personalization(predictions, 10)
+
+
+# training, one case per algorithm of recsys.train
+
+
+def _setup_iterate_algo(algo_class):
+    def setup(data):
+        dataset = data.dataset
+
+        def run():
+            train.set_seed()
+            # surprise prints the RMSE of every fold
+            with contextlib.redirect_stdout(io.StringIO()):
+                train.iterate_algo([algo_class()], 2, dataset, 10, 0.7,
+                                   [3, 5, 7, 10], seed=data.seed)
+        return run
+    return setup
+
+
+# preprocessing stages of recsys.steam_preprocess
+
+
+def _setup_iter_chunks(data):
+    # one python literal per line, like the raw UCSD files
+    f = tempfile.NamedTemporaryFile("w", suffix=".json", delete=False)
+    with f:
+        for record in data.reviews:
+            f.write(repr(record) + "\n")
+    atexit.register(os.remove, f.name)
+    return lambda: sum(len(chunk) for chunk in
+                       steam_preprocess.iter_chunks(f.name))
+
+
+def _setup_get_review_ls(data):
+    reviews = data.reviews
+    return lambda: steam_preprocess.get_review_ls(reviews)
+
+
+def _setup_review_summaries(data):
+    df_review = steam_preprocess.get_review_ls(data.reviews)
+
+    def run():
+        steam_preprocess.review_by_user_summary(df_review)
+        steam_preprocess.review_by_item_summary(df_review)
+    return run
+
+
+def _setup_filter_explicit(data):
+    df_explicit = steam_preprocess.get_explicit_ls(
+        steam_preprocess.get_review_ls(data.reviews))
+    return lambda: steam_preprocess.get_filtered_explicit_ls(df_explicit)
+
+
+def _setup_encode_ids(data):
+    ratings = data.ratings
+
+    def run():
+        # encode_ids reports the memory saved on stdout
+        with contextlib.redirect_stdout(io.StringIO()):
+            steam_preprocess.encode_ids(ratings)
+    return run
+
+
+# serving, through the Flask test client of main.py
+
+
+def _serving_client(data):
+    """test client of main.server serving an SVD fitted on data."""
+    if ROOT_DIR not in sys.path:
+        sys.path.insert(0, ROOT_DIR)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            import main
+    except Exception as e:
+        raise Skip(f"main.py cannot be imported: {e!r}")
+    from recsys.registry import ModelRegistry
+
+    def build():
+        train.set_seed()
+        algo = SVD(random_state=data.seed)
+        algo.fit(data.dataset.build_full_trainset())
+        directory = join(tempfile.mkdtemp(), "model")
+        save_model_output({"algo": algo, "top_n": build_top_k(algo)},
+                          directory)
+        return ModelRegistry(directory)
+
+    # the routes read the module level registry on every request
+    main.registry = data._get("registry", build)
+    return main.server.test_client()
+
+
+def _setup_predict(data):
+    client = _serving_client(data)
+    pairs = data.ratings[["user_id", "item_id"]].sample(
+        1000, replace=True, random_state=data.seed).values.tolist()
+    requests = cycle(pairs)
+
+    def run():
+        uid, iid = next(requests)
+        client.post("/predict", json={"uid": uid, "iid": iid})
+    return run
+
+
+def _setup_rec(data):
+    client = _serving_client(data)
+    uids = data.ratings["user_id"].sample(
+        1000, replace=True, random_state=data.seed).tolist()
+    requests = cycle(uids)
+
+    def run():
+        client.post("/rec", json={"rec_uid": next(requests)})
+    return run
+
+
+ALL_SCALES = tuple(SCALES)
+# KNNWithMeans keeps a users x users similarity matrix, SlopeOne an
+# items x items one, the large scale is left to the vectorized paths
+TRAIN_SCALES = ("small", "medium")
+
+CASES = [
+    Case("evaluate.get_top_n", _setup_get_top_n, 5, ALL_SCALES),
+    Case("evaluate.precision_recall_at_k", _setup_precision_recall, 5,
+         ALL_SCALES),
+    Case("evaluate.personalization", _setup_personalization, 5, ALL_SCALES),
+] + [
+    Case(f"train.iterate_algo.{algo_class.__name__}",
+         _setup_iterate_algo(algo_class), 3, TRAIN_SCALES)
+    for algo_class in (KNNWithMeans, SVDpp, SlopeOne, CoClustering,
+                       ImplicitALS)
+] + [
+    Case("steam_preprocess.iter_chunks", _setup_iter_chunks, 5, ALL_SCALES),
+    Case("steam_preprocess.get_review_ls", _setup_get_review_ls, 5,
+         ALL_SCALES),
+    Case("steam_preprocess.review_summaries", _setup_review_summaries, 5,
+         ALL_SCALES),
+    Case("steam_preprocess.get_filtered_explicit_ls", _setup_filter_explicit,
+         5, ALL_SCALES),
+    Case("steam_preprocess.encode_ids", _setup_encode_ids, 5, ALL_SCALES),
+    Case("serve.predict", _setup_predict, 200, ALL_SCALES),
+    Case("serve.rec", _setup_rec, 200, ALL_SCALES),
+]
+
+
+def time_case(run, repeat, warmup=1):
+    """time a callable repeat times after warmup untimed calls.
+
+    Returns
+    -------
+    type: dict
+        keys: repeat, min, median, mean, p95, max, in seconds per call.
+
+    """
+    for _ in range(warmup):
+        run()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    times = np.array(times)
+    return {"repeat": repeat,
+            "min": float(times.min()),
+            "median": float(np.median(times)),
+            "mean": float(times.mean()),
+            "p95": float(np.percentile(times, 95)),
+            "max": float(times.max())}
+
+
+def _environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT_DIR,
+                                capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "commit": commit}
+
+
+def run_benchmarks(scales=ALL_SCALES, patterns=None, repeat=None, seed=0):
+    """run every case matching patterns at each of its scales.
+
+    Parameters
+    ----------
+    scales : iterable of str
+        keys of SCALES.
+    patterns : list of str, optional
+        substrings of case names, all cases when None.
+    repeat : int, optional
+        timed calls per case, each case's own default when None.
+    seed : int
+        seed of the synthetic data.
+
+    Returns
+    -------
+    type: dict
+        keys: environment, scales, results; results maps "case[scale]" to
+        the timings of time_case plus case and scale, or to skipped with
+        the reason the case could not run.
+
+    """
+    results = {}
+    for scale in scales:
+        data = ScaleData(scale, seed)
+        for case in CASES:
+            if scale not in case.scales:
+                continue
+            if patterns and not any(p in case.name for p in patterns):
+                continue
+            key = f"{case.name}[{scale}]"
+            try:
+                run = case.setup(data)
+            except Skip as e:
+                results[key] = {"case": case.name, "scale": scale,
+                                "skipped": str(e)}
+                print(f"{key:<55} skipped: {e}")
+                continue
+            timing = time_case(run, repeat or case.repeat)
+            results[key] = {"case": case.name, "scale": scale, **timing}
+            print(f"{key:<55} median {timing['median'] * 1e3:10.3f} ms "
+                  f"(min {timing['min'] * 1e3:.3f} ms, "
+                  f"n={timing['repeat']})")
+    return {"environment": _environment(),
+            "scales": {scale: SCALES[scale] for scale in scales},
+            "results": results}
+
+
+def compare(results, baseline, tolerance=0.2):
+    """compare median times with a baseline run.
+
+    Parameters
+    ----------
+    results : dict
+        output of run_benchmarks.
+    baseline : dict
+        output of an earlier run_benchmarks.
+    tolerance : float
+        relative slowdown of the median tolerated before a regression.
+
+    Returns
+    -------
+    type: list of dict
+        keys: key, baseline, current (median seconds), ratio, regression,
+        for cases timed in both runs.
+
+    """
+    rows = []
+    for key, current in results["results"].items():
+        previous = baseline["results"].get(key)
+        if previous is None or "median" not in previous \
+                or "median" not in current:
+            continue
+        ratio = current["median"] / max(previous["median"], 1e-12)
+        rows.append({"key": key,
+                     "baseline": previous["median"],
+                     "current": current["median"],
+                     "ratio": ratio,
+                     "regression": ratio > 1 + tolerance})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scales", nargs="+", default=["small"],
+                        choices=list(SCALES),
+                        help="data scales to run the cases at")
+    parser.add_argument("--cases", nargs="+", default=None,
+                        help="only run cases whose name contains one of "
+                             "these substrings")
+    parser.add_argument("--repeat", type=int, default=None,
+                        help="timed calls per case, overrides each case's "
+                             "default")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=str, default=None,
+                        help="write the results as JSON to this file")
+    parser.add_argument("--baseline", type=str, default=None,
+                        help="JSON results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="relative slowdown flagged as a regression")
+    args = vars(parser.parse_args())
+
+    results = run_benchmarks(args["scales"], args["cases"], args["repeat"],
+                             args["seed"])
+    if args["output"]:
+        with open(args["output"], "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args["baseline"]:
+        with open(args["baseline"], "r") as f:
+            baseline = json.load(f)
+        rows = compare(results, baseline, args["tolerance"])
+        for row in rows:
+            flag = "REGRESSION" if row["regression"] else ""
+            print(f"{row['key']:<55} {row['baseline'] * 1e3:10.3f} ms -> "
+                  f"{row['current'] * 1e3:10.3f} ms  x{row['ratio']:.2f} "
+                  f"{flag}")
+        n_regressions = sum(row["regression"] for row in rows)
+        print(f"{n_regressions} regression(s) in {len(rows)} compared cases "
+              f"(tolerance {args['tolerance']:.0%})")
+        if n_regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
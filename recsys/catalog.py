@@ -0,0 +1,75 @@
+"""
+Game details loaded once and indexed by game id.
+
+GameCatalog
+get_catalog
+"""
+
+from os.path import abspath, dirname, join
+
+from recsys.artifacts import load_table
+
+DATA_DIR = join(dirname(dirname(abspath((__file__)))), "data")
+DETAIL_FILE = join(DATA_DIR, "details.parquet")
+VALID_COLS = ['id', 'app_name', 'publisher', 'developer', 'genres', 'url',
+              'tags', 'discount_price', 'reviews_url', 'specs', 'price',
+              'early_access']
+
+_catalogs = {}
+
+
+class GameCatalog:
+    """game details indexed by id.
+
+    Parameters
+    ----------
+    file : str
+        details table written by steam_preprocess.
+    columns : list, optional
+        only keep these columns in memory, id is always kept.
+
+    """
+
+    def __init__(self, file=DETAIL_FILE, columns=None):
+        if columns is not None:
+            columns = ["id"] + [col for col in columns if col != "id"]
+        df = load_table(file, columns=columns)
+        df = df.dropna(subset=["id"]).drop_duplicates("id")
+        self.df = df.set_index("id", drop=False)
+        self.columns = list(self.df.columns)
+
+    def __contains__(self, game_id):
+        return game_id in self.df.index
+
+    def lookup(self, ids, cols=None):
+        """details of several games in the given order.
+
+        Parameters
+        ----------
+        ids : list
+            game ids, e.g. a ranked recommendation list.
+        cols : list, optional
+            columns to return, all columns by default.
+
+        Returns
+        -------
+        type: pandas.DataFrame
+            one row per known id in the order of ids, unknown ids are
+            skipped.
+
+        """
+        cols = self.columns if cols is None else cols
+        unknown = [col for col in cols if col not in self.columns]
+        if unknown:
+            raise KeyError(f"unknown columns {unknown}")
+        positions = self.df.index.get_indexer(ids)
+        positions = positions[positions >= 0]
+        return self.df[cols].iloc[positions].reset_index(drop=True)
+
+
+def get_catalog(file=DETAIL_FILE):
+    """process-wide catalog of file, loaded on first use."""
+    file = abspath(file)
+    if file not in _catalogs:
+        _catalogs[file] = GameCatalog(file)
+    return _catalogs[file]
@@ -0,0 +1,262 @@
+"""
+Concurrent, rate-limited crawler for the Steam web APIs.
+
+A pooled requests session is shared by a bounded thread pool, every request
+takes a token from a token bucket and failed requests are retried with
+exponential backoff. Results are appended to a JSON lines file as soon as
+they arrive, so a crash only loses the requests in flight. Raw responses
+can be kept in a ResponseCache so reruns only fetch new or stale keys.
+
+TokenBucket
+ResponseCache
+make_session
+fetch_json
+crawl
+read_jsonl
+"""
+
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from os.path import exists, join
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """thread-safe token bucket, rate tokens per second up to capacity.
+
+    Parameters
+    ----------
+    rate : float
+        tokens added per second, i.e. sustained requests per second.
+    capacity : int
+        largest burst, defaults to one second of tokens.
+
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, int(rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """block until a token is available, then take it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens
+                                  + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class ResponseCache:
+    """raw responses on disk keyed by appid, with a checkpoint of done keys.
+
+    Every response is one json file in directory. checkpoint.tsv lists each
+    completed key with the time it was fetched, so a rerun knows which keys
+    are done without opening their files.
+
+    Parameters
+    ----------
+    directory : str
+    max_age : float, optional
+        seconds after which a cached response is stale and fetched again,
+        None keeps responses forever.
+
+    """
+
+    def __init__(self, directory, max_age=None):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_age = max_age
+        self.checkpoint_file = join(directory, "checkpoint.tsv")
+        self.completed = {}
+        if exists(self.checkpoint_file):
+            line = "\n"
+            with open(self.checkpoint_file) as f:
+                for line in f:
+                    # a crash can leave the last line half written
+                    fields = line.rstrip("\n").split("\t")
+                    if len(fields) == 2 and exists(self._file(fields[0])):
+                        self.completed[fields[0]] = float(fields[1])
+            if not line.endswith("\n"):
+                # end it, or the next key would be appended to it
+                with open(self.checkpoint_file, "a") as f:
+                    f.write("\n")
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.lock = threading.Lock()
+
+    def _file(self, key):
+        return join(self.directory, f"{key}.json")
+
+    def is_fresh(self, key):
+        fetched_at = self.completed.get(str(key))
+        if fetched_at is None:
+            return False
+        age = time.time() - fetched_at
+        return self.max_age is None or age <= self.max_age
+
+    def get(self, key):
+        with open(self._file(key)) as f:
+            return json.load(f)
+
+    def put(self, key, response):
+        # write then rename, a crash never leaves a truncated response
+        tmp_file = self._file(key) + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(response, f)
+        os.replace(tmp_file, self._file(key))
+        fetched_at = time.time()
+        with self.lock:
+            self.completed[str(key)] = fetched_at
+            with open(self.checkpoint_file, "a") as f:
+                f.write(f"{key}\t{fetched_at}\n")
+
+    def fetch(self, key, download):
+        """cached response of key, or download(key) when missing or stale."""
+        if self.is_fresh(key):
+            with self.lock:
+                self.hits += 1
+            return self.get(key)
+        with self.lock:
+            self.misses += 1
+            if str(key) in self.completed:
+                self.stale += 1
+        response = download(key)
+        self.put(key, response)
+        return response
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses,
+                "stale": self.stale}
+
+
+def make_session(pool_size=10):
+    """requests session keeping up to pool_size connections per host."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def fetch_json(session, url, bucket=None, max_retries=5, backoff=1.,
+               timeout=30, params=None):
+    """GET a json document, retrying throttled or failed requests.
+
+    Retries on connection errors, timeouts and status 429/5xx, sleeping
+    backoff * 2 ** attempt seconds with jitter, or the Retry-After header
+    when the server sends one.
+
+    Returns
+    -------
+    type: dict or list
+        decoded json body.
+
+    """
+    for attempt in range(max_retries + 1):
+        if bucket is not None:
+            bucket.acquire()
+        try:
+            r = session.get(url, params=params, timeout=timeout)
+            if r.status_code not in RETRY_STATUS:
+                r.raise_for_status()
+                return r.json()
+            retry_after = r.headers.get("Retry-After")
+            error = requests.HTTPError(f"{r.status_code} for {r.url}")
+        except (requests.ConnectionError, requests.Timeout) as e:
+            retry_after = None
+            error = e
+        if attempt == max_retries:
+            raise error
+
+        if retry_after is not None and retry_after.isdigit():
+            delay = float(retry_after)
+        else:
+            delay = backoff * 2 ** attempt * (0.5 + random.random())
+        logging.warning(f"retry {attempt + 1}/{max_retries} of {url} in "
+                        f"{delay:.1f} s: {error}")
+        time.sleep(delay)
+
+
+def crawl(keys, fetch, out_file, concurrency=8, mode="w"):
+    """run fetch(key) for every key on a thread pool, streaming to disk.
+
+    Parameters
+    ----------
+    keys : iterable
+        e.g. appids, consumed lazily.
+    fetch : callable
+        fetch(key) returns a json-serializable record, or None to skip.
+    out_file : str
+        JSON lines file, one record per line, flushed as records arrive.
+    concurrency : int
+        # of requests in flight.
+    mode : str
+        "w" starts a new file, "a" appends to it.
+
+    Returns
+    -------
+    type: dict
+        keys: done, skipped, failed, seconds, keys_per_s.
+
+    """
+    stats = {"done": 0, "skipped": 0, "failed": 0}
+    start = time.time()
+    keys = iter(keys)
+
+    def record(key, future):
+        try:
+            result = future.result()
+        except Exception as e:
+            logging.error(f"giving up on {key}: {e}")
+            stats["failed"] += 1
+            return
+        if result is None:
+            stats["skipped"] += 1
+            return
+        f.write(json.dumps(result) + "\n")
+        f.flush()
+        stats["done"] += 1
+
+    with open(out_file, mode) as f, \
+            ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = deque()
+        for key in keys:
+            pending.append((key, executor.submit(fetch, key)))
+            # keep a bounded window so millions of keys are not queued at once
+            if len(pending) >= 2 * concurrency:
+                record(*pending.popleft())
+        while pending:
+            record(*pending.popleft())
+
+    stats["seconds"] = round(time.time() - start, 2)
+    n_keys = stats["done"] + stats["skipped"] + stats["failed"]
+    stats["keys_per_s"] = round(n_keys / max(stats["seconds"], 1e-9), 2)
+    return stats
+
+
+def read_jsonl(file):
+    """yield the records of a JSON lines file written by crawl."""
+    with open(file) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
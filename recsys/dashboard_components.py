@@ -5,7 +5,7 @@ import dash_html_components as html
 import plotly.graph_objs as go
 from recsys.dashboard_data_validate import get_data
 
-df, df2, df_summary, df2_summary = get_data()
+df, df2, df_summary, df2_summary, text_indexes = get_data()
 most_frequent_genres = ["Indie", "Action",
                         "Adventure", "Casual", "Strategy", "RPG"]
 variable_labels = {"n_recommend": "Number of Recommend (Vote Up or not)",
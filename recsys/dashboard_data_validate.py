@@ -1,18 +1,13 @@
 from os.path import abspath, dirname, join
 import pandas as pd
-import pickle
 
-
-DATA_DIR = join(dirname(dirname(abspath((__file__)))), "data")
-ITEM_FILE = join(DATA_DIR, "dashboard_item_summary.pkl")
-USER_FILE = join(DATA_DIR, "dashboard_user_summary.pkl")
+from recsys.artifacts import load_table
+from recsys.text_index import TokenIndex, NgramIndex
 
 
-def load_pkl(file):
-    f = open(file, "rb")
-    output = pickle.load(f)
-    f.close()
-    return output
+DATA_DIR = join(dirname(dirname(abspath((__file__)))), "data")
+ITEM_FILE = join(DATA_DIR, "dashboard_item_summary.parquet")
+USER_FILE = join(DATA_DIR, "dashboard_user_summary.parquet")
 
 
 def validate_df(df):
@@ -40,10 +35,18 @@ def validate_df(df):
     return df
 
 
+def build_text_indexes(df):
+    """inverted indexes of the text columns the dashboard filters on."""
+    return {"genres": TokenIndex(df["genres"]),
+            "publisher": NgramIndex(df["publisher"]),
+            "developer": NgramIndex(df["developer"])}
+
+
 def get_data(file1=ITEM_FILE, file2=USER_FILE):
-    df = load_pkl(file1)
-    df2 = load_pkl(file2)
+    df = load_table(file1)
+    df2 = load_table(file2)
     df = validate_df(df)
     df_summary = df.describe().reset_index().round(2).drop("release_year", axis=1)
     df2_summary = df2.describe().reset_index().round(2)
-    return df, df2, df_summary, df2_summary
+    text_indexes = build_text_indexes(df)
+    return df, df2, df_summary, df2_summary, text_indexes
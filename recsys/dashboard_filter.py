@@ -0,0 +1,127 @@
+"""
+Filter engine shared by the dashboard callbacks.
+
+Every dashboard widget feeds the same filters, so the scatter plot and the
+row count callbacks ask for the same selection. The engine turns the widget
+values into one normalized key, builds a single boolean mask over column
+arrays extracted once, and keeps the most recent masks in an LRU cache.
+
+FilterEngine
+"""
+
+from functools import lru_cache
+
+import numpy as np
+
+NUMERIC_COLS = ["n_review", "n_recommend", "price", "release_year"]
+TEXT_COLS = ["genres", "publisher", "developer"]
+
+
+class FilterEngine:
+    """memoized row selection of the dashboard item table.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        item table from recsys.dashboard_data_validate.get_data.
+    text_indexes : dict, optional
+        column to recsys.text_index index, columns without one are
+        filtered with str.contains.
+    cache_size : int
+        # of filter combinations whose masks are kept.
+
+    """
+
+    def __init__(self, df, text_indexes=None, cache_size=128):
+        self.df = df
+        self.columns = {col: df[col].values for col in NUMERIC_COLS}
+        self.text = {col: df[col] for col in TEXT_COLS}
+        self.text_indexes = text_indexes or {}
+        # early_access holds True, False or "unknown", so both masks are kept
+        self.early_access = {True: (df["early_access"] == True).values,
+                             False: (df["early_access"] == False).values}
+        self.defaults = {"n_review": df["n_review"].min(),
+                         "n_recommend": df["n_recommend"].min(),
+                         "price": df["price"].max(),
+                         "release_year": (df["release_year"].min(),
+                                          df["release_year"].max())}
+        self._mask = lru_cache(maxsize=cache_size)(self._build_mask)
+
+    def normalize(self, nb_reviews, nb_recommend, price_min, price_max,
+                  genre, more_genre, publisher, developer, years_released):
+        """widget values as a hashable key, empty widgets take defaults."""
+        year_start, year_end = years_released or self.defaults["release_year"]
+        return (nb_reviews or self.defaults["n_review"],
+                nb_recommend or self.defaults["n_recommend"],
+                price_min or 0,
+                price_max or self.defaults["price"],
+                year_start,
+                year_end,
+                genre or None,
+                (more_genre or "").strip() or None,
+                (publisher or "").strip() or None,
+                (developer or "").strip() or None)
+
+    def _build_mask(self, key):
+        (nb_reviews, nb_recommend, price_min, price_max, year_start, year_end,
+         genre, more_genre, publisher, developer) = key
+        col = self.columns
+        with np.errstate(invalid="ignore"):
+            # comparisons with NaN are False, as in pandas
+            mask = ((col["n_review"] >= nb_reviews)
+                    & (col["release_year"] >= year_start)
+                    & (col["release_year"] <= year_end)
+                    & (col["n_recommend"] >= nb_recommend)
+                    & (col["price"] >= price_min)
+                    & (col["price"] <= price_max))
+        rows = None
+        for name, pattern in [("genres", genre), ("genres", more_genre),
+                              ("publisher", publisher),
+                              ("developer", developer)]:
+            if not pattern or not mask.any():
+                continue
+            if name in self.text_indexes:
+                # intersect the row ids of every indexed text filter
+                matched = self.text_indexes[name].search(pattern)
+                rows = matched if rows is None else np.intersect1d(
+                    rows, matched, assume_unique=True)
+            else:
+                mask &= self.text[name].str.contains(
+                    pattern, case=False, na=False).values
+        if rows is not None:
+            text_mask = np.zeros(len(mask), dtype=bool)
+            text_mask[rows] = True
+            mask &= text_mask
+        # cached masks are shared by every caller
+        mask.setflags(write=False)
+        return mask
+
+    def mask(self, *filters):
+        """boolean mask of the selected rows, filters as in normalize."""
+        return self._mask(self.normalize(*filters))
+
+    def count(self, *filters):
+        """# of selected rows."""
+        return int(np.count_nonzero(self.mask(*filters)))
+
+    def select(self, *filters, early_access=None, cols=None):
+        """selected rows, optionally only those with early_access.
+
+        Returns
+        -------
+        type: pandas.DataFrame
+            selected rows restricted to cols, all columns when cols is None;
+            a column asked for twice, e.g. the same variable on both axes,
+            is returned once.
+
+        """
+        mask = self.mask(*filters)
+        if early_access is not None:
+            mask = mask & self.early_access[early_access]
+        rows = np.flatnonzero(mask)
+        if cols is None:
+            return self.df.iloc[rows]
+        return self.df[list(dict.fromkeys(cols))].iloc[rows]
+
+    def cache_info(self):
+        return self._mask.cache_info()
@@ -0,0 +1,154 @@
+"""
+Server-side downsampling of the dashboard scatter plot.
+
+The scatter plot used to ship every selected game to the browser. Once more
+than max_points games are visible, points are either aggregated on a 2D grid,
+one marker per non-empty cell sized by its count, or sampled uniformly,
+which keeps the density of the plot. Zooming in narrows the visible range
+until exact points are sent again.
+
+axis_range
+scatter_points
+payload_size
+"""
+
+import json
+
+import numpy as np
+from plotly.utils import PlotlyJSONEncoder
+
+MAX_POINTS = 5000
+GRID_SIZE = 100
+
+
+def axis_range(relayout_data, axis):
+    """visible [lo, hi] of axis ("xaxis" or "yaxis"), None when autoscaled.
+
+    Parameters
+    ----------
+    relayout_data : dict, optional
+        relayoutData of a dcc.Graph, either "xaxis.range[0]" and
+        "xaxis.range[1]" keys or a single "xaxis.range" list.
+
+    """
+    if not relayout_data or relayout_data.get(f"{axis}.autorange"):
+        return None
+    if f"{axis}.range" in relayout_data:
+        lo, hi = relayout_data[f"{axis}.range"]
+    elif f"{axis}.range[0]" in relayout_data:
+        lo = relayout_data[f"{axis}.range[0]"]
+        hi = relayout_data.get(f"{axis}.range[1]")
+    else:
+        return None
+    return sorted([float(lo), float(hi)])
+
+
+def _crop(df, col, rng):
+    if rng is None:
+        return df
+    values = df[col].values
+    with np.errstate(invalid="ignore"):
+        return df[(values >= rng[0]) & (values <= rng[1])]
+
+
+def _edges(values, rng):
+    if rng is not None:
+        lo, hi = rng
+    elif np.isnan(values).all():
+        lo, hi = 0, 1
+    else:
+        lo, hi = np.nanmin(values), np.nanmax(values)
+    if hi <= lo:
+        hi = lo + 1
+    return lo, hi
+
+
+def _bin(df, x_axis, y_axis, x_edges, y_edges, grid_size):
+    x = df[x_axis].values.astype(float)
+    y = df[y_axis].values.astype(float)
+    keep = ~(np.isnan(x) | np.isnan(y))
+    x, y = x[keep], y[keep]
+    ix = ((x - x_edges[0]) / (x_edges[1] - x_edges[0]) * grid_size)
+    iy = ((y - y_edges[0]) / (y_edges[1] - y_edges[0]) * grid_size)
+    cell = (np.clip(ix.astype(int), 0, grid_size - 1) * grid_size
+            + np.clip(iy.astype(int), 0, grid_size - 1))
+    _, inverse, count = np.unique(cell, return_inverse=True,
+                                  return_counts=True)
+    # markers sit on the mean of their games, not on the cell centre
+    return {"x": np.bincount(inverse, weights=x) / count,
+            "y": np.bincount(inverse, weights=y) / count,
+            "count": count}
+
+
+def scatter_points(groups, x_axis, y_axis, relayout_data=None,
+                   max_points=MAX_POINTS, mode="bin", grid_size=GRID_SIZE,
+                   seed=0):
+    """points to draw for each trace, downsampled when too many are visible.
+
+    Parameters
+    ----------
+    groups : list of pandas.DataFrame
+        rows of each trace, with x_axis, y_axis and app_name columns.
+    x_axis, y_axis : str
+        columns plotted.
+    relayout_data : dict, optional
+        relayoutData of the graph, only games in the zoomed range are sent.
+    max_points : int
+        largest # of exact points sent over all traces.
+    mode : str
+        "bin" aggregates on a grid_size x grid_size grid, "sample" draws
+        max_points games at random.
+    grid_size : int
+        # of cells per axis in "bin" mode.
+    seed : int
+        seed of the "sample" mode, the same filters draw the same games.
+
+    Returns
+    -------
+    type: list of dict
+        one per group, keys: x, y, text, size (None for exact points) and
+        the # of visible games n_rows.
+
+    """
+    x_range = axis_range(relayout_data, "xaxis")
+    y_range = axis_range(relayout_data, "yaxis")
+    groups = [_crop(_crop(df, x_axis, x_range), y_axis, y_range)
+              for df in groups]
+    n_rows = sum(len(df) for df in groups)
+
+    if n_rows <= max_points or mode not in ("bin", "sample"):
+        return [{"x": df[x_axis].values, "y": df[y_axis].values,
+                 "text": df["app_name"].values, "size": None,
+                 "n_rows": len(df)} for df in groups]
+
+    if mode == "sample":
+        rng = np.random.RandomState(seed)
+        points = []
+        for df in groups:
+            n = int(round(len(df) * max_points / n_rows))
+            rows = np.sort(rng.choice(len(df), n, replace=False))
+            sample = df.iloc[rows]
+            points.append({"x": sample[x_axis].values,
+                           "y": sample[y_axis].values,
+                           "text": sample["app_name"].values, "size": None,
+                           "n_rows": len(df)})
+        return points
+
+    # every trace shares one grid so their cells line up
+    x_all = np.concatenate([df[x_axis].values for df in groups]).astype(float)
+    y_all = np.concatenate([df[y_axis].values for df in groups]).astype(float)
+    x_edges = _edges(x_all, x_range)
+    y_edges = _edges(y_all, y_range)
+    cells = [_bin(df, x_axis, y_axis, x_edges, y_edges, grid_size)
+             for df in groups]
+    max_count = max([c["count"].max() for c in cells if len(c["count"])],
+                    default=1)
+    return [{"x": c["x"], "y": c["y"],
+             "text": [f"{n} games" for n in c["count"]],
+             "size": 6 + 24 * np.sqrt(c["count"] / max_count),
+             "n_rows": len(df)} for c, df in zip(cells, groups)]
+
+
+def payload_size(figure):
+    """# of bytes of figure once serialized for the browser."""
+    return len(json.dumps(figure, cls=PlotlyJSONEncoder))
@@ -0,0 +1,93 @@
+"""
+Dense integer codes for user and item ids.
+
+Steam user ids are 17 digit strings or vanity names, item ids are strings
+too. The pipeline encodes both once in steam_preprocess and trains, scores
+and stores predictions on int32 codes; ids are decoded back to strings only
+where they leave the API.
+
+IdEncoder
+encode_id
+decode_ids
+memory_mb
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class IdEncoder:
+    """bijection between raw ids and the codes 0 .. n - 1.
+
+    Parameters
+    ----------
+    ids : array-like
+        raw id of each code, in code order.
+
+    """
+
+    def __init__(self, ids):
+        self.ids = np.asarray(ids, dtype=object)
+        self.index = pd.Index(self.ids)
+
+    @classmethod
+    def fit(cls, values):
+        """encoder of the distinct values, codes follow their sorted order."""
+        return cls(np.sort(pd.unique(np.asarray(values, dtype=object))))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, raw_id):
+        return self.code(raw_id) is not None
+
+    def code(self, raw_id):
+        """code of one raw id, None when it is unknown."""
+        try:
+            return int(self.index.get_loc(raw_id))
+        except (KeyError, TypeError, pd.errors.InvalidIndexError):
+            # unhashable ids such as a list sent as JSON are unknown too
+            return None
+
+    def encode(self, values):
+        """int32 codes of many raw ids, -1 for unknown ids."""
+        return self.index.get_indexer(
+            np.asarray(values, dtype=object)).astype(np.int32)
+
+    def decode(self, codes):
+        """raw ids of many codes, None for the -1 of unknown ids or
+        padding."""
+        codes = np.asarray(codes, dtype=np.int64)
+        ids = self.ids[codes]
+        ids[codes < 0] = None
+        return ids
+
+    def extend(self, values):
+        """encoder with the unknown values appended, existing codes kept."""
+        values = pd.unique(np.asarray(values, dtype=object))
+        new = values[self.index.get_indexer(values) < 0]
+        return IdEncoder(np.concatenate([self.ids, new]))
+
+
+def encode_id(encoder, raw_id):
+    """id the model knows raw_id by.
+
+    The code when raw_id is known, None otherwise: a raw id passed through
+    could equal the code of another user or item. Models trained before the
+    encoder existed have no encoder and use raw ids.
+    """
+    if encoder is None:
+        return raw_id
+    return encoder.code(raw_id)
+
+
+def decode_ids(encoder, codes):
+    """raw ids of model ids, the inverse of encode_id."""
+    if encoder is None:
+        return list(codes)
+    return encoder.decode(codes).tolist()
+
+
+def memory_mb(df):
+    """deep memory usage of a DataFrame in MB, python strings included."""
+    return df.memory_usage(deep=True).sum() / 1024 ** 2
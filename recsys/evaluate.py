@@ -4,16 +4,24 @@ self defined metrics for model evaluation.
 get_top_n
 personalization
 precision_recall_at_k
+rank_predictions
+precision_recall_at_ks
+held_out_precision_recall_at_ks
+top_n_codes
+top_n_from_ranked
+rec_matrix_from_ranked
+personalization_from_ranked
+sampled_personalization_from_ranked
 metrics_dataframe
 plot_precision_recall_k
 show_results
 """
 
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot  # it will be used through pd.plot
-from sklearn.metrics.pairwise import cosine_similarity
+from scipy import sparse, stats
 
 
 def get_top_n(predictions, n):
@@ -63,50 +71,7 @@ def personalization(prediction, n):
         personalization score.
 
     """
-    # prediction
-    # n top n recommendation
-
-    top_n = get_top_n(prediction, n)
-
-    rec_dict = {}
-    for uid, user_ratings in top_n.items():
-        rec_dict[uid] = [iid for (iid, _) in user_ratings]
-
-    rec_user_ls = [pred[0] for pred in prediction]
-    rec_item_ls = [pred[1] for pred in prediction]
-
-    unique_rec_user_ls = np.unique(rec_user_ls)
-    unique_rec_item_ls = np.unique(rec_item_ls)
-
-    # assign each item with index number
-    unique_rec_item_dict = {item: ind for ind,
-                            item in enumerate(unique_rec_item_ls)}
-
-    n_unique_rec_user = len(unique_rec_user_ls)
-    n_unique_rec_item = len(unique_rec_item_ls)
-
-    # recommended user item matrix
-    rec_matrix = np.zeros(shape=(n_unique_rec_user, n_unique_rec_item))
-
-    # represent recommended item for each user as binary 0/1
-    for user in range(n_unique_rec_user):
-        # get userid
-        user_id = unique_rec_user_ls[user]
-        # get rec item list
-        item_ls = rec_dict[user_id]
-
-        for item_id in item_ls:
-            # get item index
-            item = unique_rec_item_dict[item_id]
-            rec_matrix[user, item] = 1
-
-    # calculate cosine similarity matrix across all user recommendations
-    similarity = cosine_similarity(X=rec_matrix, dense_output=False)
-    # calculate average of upper triangle of cosine matrix
-    upper_right = np.triu_indices(similarity.shape[0], k=1)
-    # personalization is 1-average cosine similarity
-    score = 1 - np.mean(similarity[upper_right])
-    return score
+    return personalization_from_ranked(rank_predictions(prediction), n)
 
 
 def precision_recall_at_k(predictions, k, threshold):
@@ -163,6 +128,257 @@ def precision_recall_at_k(predictions, k, threshold):
     return overall_precisions, overall_recalls
 
 
+RankedPredictions = namedtuple("RankedPredictions", [
+    "users", "items", "user_codes", "item_codes", "est", "true_r",
+    "starts", "counts", "user_order"])
+
+
+def rank_predictions(predictions):
+    """encode predictions as arrays sorted by user then estimate, once.
+
+    Parameters
+    ----------
+    predictions : list
+        userid, itemid, true rating, estimates, details
+
+    Returns
+    -------
+    type: RankedPredictions
+        users, items: unique user ids and item ids, indexed by code.
+        user_codes, item_codes, est, true_r: arrays sorted by user code and
+            descending estimate, ties keep the original order like get_top_n.
+        starts, counts: position and length of each user's block.
+        user_order: user codes in order of first appearance.
+
+    """
+    uid, iid, true_r, est, _ = zip(*predictions)
+    users, first_seen, user_codes = np.unique(
+        np.array(uid, dtype=object), return_index=True, return_inverse=True)
+    items, item_codes = np.unique(
+        np.array(iid, dtype=object), return_inverse=True)
+    est = np.asarray(est, dtype=np.float64)
+    true_r = np.asarray(true_r, dtype=np.float64)
+
+    # lexsort is stable, equal estimates keep their original order
+    order = np.lexsort((-est, user_codes))
+    counts = np.bincount(user_codes, minlength=len(users))
+    starts = np.cumsum(counts) - counts
+
+    return RankedPredictions(users=users,
+                             items=items,
+                             user_codes=user_codes[order],
+                             item_codes=item_codes[order],
+                             est=est[order],
+                             true_r=true_r[order],
+                             starts=starts,
+                             counts=counts,
+                             user_order=np.argsort(first_seen))
+
+
+def _rank_within_user(ranked):
+    return np.arange(len(ranked.est)) - np.repeat(ranked.starts,
+                                                  ranked.counts)
+
+
+def precision_recall_at_ks(ranked, k_ls, threshold):
+    """precision and recall at every k from a single sorted pass.
+
+    Parameters
+    ----------
+    ranked : RankedPredictions
+    k_ls : list
+        list of different # of top items recommended.
+    threshold : float
+        rating threshold used to determine relevant and irrelevant item.
+
+    Returns
+    -------
+    type: turple of dict
+        keys: k
+        items: precision at k, recall at k; same values as
+            precision_recall_at_k.
+
+    """
+    rel = ranked.true_r >= threshold
+    rec = ranked.est >= threshold
+    cum_rec = np.concatenate([[0], np.cumsum(rec)])
+    cum_rel_and_rec = np.concatenate([[0], np.cumsum(rel & rec)])
+    n_rel = np.bincount(ranked.user_codes[rel], minlength=len(ranked.users))
+
+    precisions = {}
+    recalls = {}
+    for k in k_ls:
+        end = ranked.starts + np.minimum(k, ranked.counts)
+        n_rec_k = cum_rec[end] - cum_rec[ranked.starts]
+        n_rel_and_rec_k = (cum_rel_and_rec[end]
+                           - cum_rel_and_rec[ranked.starts])
+
+        precision = np.ones(len(ranked.users))
+        np.divide(n_rel_and_rec_k, n_rec_k, out=precision,
+                  where=n_rec_k != 0)
+        recall = np.ones(len(ranked.users))
+        np.divide(n_rel_and_rec_k, n_rel, out=recall, where=n_rel != 0)
+
+        # sum in first-appearance order so floats match the dict version
+        precisions[k] = sum(
+            precision[ranked.user_order].tolist()) / len(precision)
+        recalls[k] = sum(recall[ranked.user_order].tolist()) / len(recall)
+
+    return precisions, recalls
+
+
+def held_out_precision_recall_at_ks(recommended, held_out, k_ls):
+    """precision and recall at every k of implicit feedback, no threshold.
+
+    Every held out item is relevant and every recommended item counts, so
+    precision at k is # of hits / k and recall at k # of hits / # of held
+    out items of the user.
+
+    Parameters
+    ----------
+    recommended : dict
+        keys: user_id
+        items: list of turple (iid, est) sorted by est, ranked over the
+            catalog, see recsys.scoring.recommend.
+    held_out : dict
+        keys: user_id
+        items: set of held out iid.
+    k_ls : list
+        list of different # of top items recommended.
+
+    Returns
+    -------
+    type: turple of dict
+        keys: k
+        items: precision at k, recall at k, averaged over the users of
+            recommended with held out items.
+
+    """
+    users = [uid for uid in recommended if held_out.get(uid)]
+    precisions = {}
+    recalls = {}
+    for k in k_ls:
+        hits = np.array([sum(iid in held_out[uid]
+                             for iid, _ in recommended[uid][:k])
+                         for uid in users], dtype=np.float64)
+        n_held_out = np.array([len(held_out[uid]) for uid in users])
+        precisions[k] = float(np.mean(hits / k)) if users else np.nan
+        recalls[k] = float(np.mean(hits / n_held_out)) if users else np.nan
+    return precisions, recalls
+
+
+def top_n_codes(ranked, n):
+    """user code and item code of every item in each user's top n."""
+    in_top_n = _rank_within_user(ranked) < n
+    return ranked.user_codes[in_top_n], ranked.item_codes[in_top_n]
+
+
+def top_n_from_ranked(ranked, n):
+    """same output as get_top_n, built from ranked predictions."""
+    in_top_n = _rank_within_user(ranked) < n
+    users = ranked.users[ranked.user_codes[in_top_n]]
+    items = ranked.items[ranked.item_codes[in_top_n]]
+    ests = ranked.est[in_top_n].tolist()
+    ends = np.cumsum(np.minimum(ranked.counts, n))
+
+    top_n = defaultdict(list)
+    for code in ranked.user_order:
+        start = ends[code] - min(ranked.counts[code], n)
+        top_n[users[start]] = list(zip(items[start:ends[code]],
+                                       ests[start:ends[code]]))
+    return top_n
+
+
+def rec_matrix_from_ranked(ranked, n):
+    """binary users x items CSR matrix of each user's top n items."""
+    user_codes, item_codes = top_n_codes(ranked, n)
+    rec_matrix = sparse.csr_matrix(
+        (np.ones(len(user_codes)), (user_codes, item_codes)),
+        shape=(len(ranked.users), len(ranked.items)))
+    # duplicate user-item predictions are summed by csr, keep it binary
+    rec_matrix.data[:] = 1
+    return rec_matrix
+
+
+def _row_normalize(rec_matrix):
+    norms = np.sqrt(np.asarray(rec_matrix.sum(axis=1)).ravel())
+    inv_norms = np.zeros(len(norms))
+    np.divide(1, norms, out=inv_norms, where=norms != 0)
+    return sparse.diags(inv_norms) @ rec_matrix
+
+
+def personalization_from_ranked(ranked, n):
+    """personalization without materializing the users x users matrix.
+
+    With rows of the recommendation matrix scaled to unit length, the sum of
+    cosine similarities over all user pairs is the squared norm of the column
+    sums, so the mean over the upper triangle costs O(nnz).
+
+    Parameters
+    ----------
+    ranked : RankedPredictions
+    n : int
+        # of recommended items.
+
+    Returns
+    -------
+    type: float
+        personalization score, same as the dense cosine similarity version.
+
+    """
+    normalized = _row_normalize(rec_matrix_from_ranked(ranked, n))
+    n_users = normalized.shape[0]
+    if n_users < 2:
+        return np.nan
+
+    col_sums = np.asarray(normalized.sum(axis=0)).ravel()
+    # each nonempty row has similarity 1 with itself on the diagonal
+    n_nonempty = np.count_nonzero(normalized.getnnz(axis=1))
+    upper_sum = (col_sums @ col_sums - n_nonempty) / 2
+    n_pairs = n_users * (n_users - 1) / 2
+    return 1 - upper_sum / n_pairs
+
+
+def sampled_personalization_from_ranked(ranked, n, n_pairs=10000,
+                                        confidence=0.95, seed=0):
+    """personalization estimated from randomly sampled user pairs.
+
+    Parameters
+    ----------
+    ranked : RankedPredictions
+    n : int
+        # of recommended items.
+    n_pairs : int
+        # of distinct-user pairs drawn uniformly with replacement.
+    confidence : float
+        coverage of the normal confidence interval.
+    seed : int
+        seed of the pair sampler.
+
+    Returns
+    -------
+    type: turple
+        personalization estimate, (lower bound, upper bound).
+
+    """
+    normalized = _row_normalize(rec_matrix_from_ranked(ranked, n))
+    n_users = normalized.shape[0]
+    if n_users < 2:
+        return np.nan, (np.nan, np.nan)
+
+    rng = np.random.RandomState(seed)
+    users_a = rng.randint(n_users, size=n_pairs)
+    users_b = rng.randint(n_users - 1, size=n_pairs)
+    users_b[users_b >= users_a] += 1
+
+    similarity = np.asarray(normalized[users_a].multiply(
+        normalized[users_b]).sum(axis=1)).ravel()
+    score = 1 - similarity.mean()
+    half_width = (stats.norm.ppf((1 + confidence) / 2)
+                  * similarity.std(ddof=1) / np.sqrt(n_pairs))
+    return score, (score - half_width, score + half_width)
+
+
 def mean_average_precision_recall(precision, recall):
     """MAP: Average precision across multiple k same for recall.
     Parameters
@@ -0,0 +1,389 @@
+"""
+Fold newly arriving reviews into a trained factorization model.
+
+Instead of rerunning preprocessing, cross validation and refit, a small
+batch of (user_id, item_id, recommend) rows is added to the model's trainset
+and a few SGD epochs run over that batch only, so only the biases and
+factors of the users and items in it move. Unknown users and items are
+added on the fly, and only the top-K lists those moves can change are
+ranked again. The updated model is published as a new model artifact,
+which a running server picks up through recsys.registry.
+
+usage example:
+
+python incremental.py --input new_reviews.parquet --epochs 5
+
+Supported models: SVD, SVDpp
+
+extend_trainset
+sgd_update
+update_predictions
+rerank_top_k
+update_model
+main
+"""
+
+import argparse
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+from surprise import SVD, SVDpp
+
+from recsys.artifacts import load_table, load_model_output, save_model_output
+from recsys.inference import OUTPUT_DIR
+from recsys.scoring import (
+    get_factors, score_pairs, score_users, top_k as top_k_scores)
+from recsys.topk import MAX_N, build_top_k
+
+
+def _add_id(raw2inner, raw_id):
+    if raw_id not in raw2inner:
+        raw2inner[raw_id] = len(raw2inner)
+    return raw2inner[raw_id]
+
+
+def extend_trainset(trainset, ratings):
+    """add ratings to a trainset in place, registering unknown ids.
+
+    The global mean stays the one the model was fitted with, so the learned
+    biases of every other user and item remain calibrated.
+
+    Parameters
+    ----------
+    trainset : surprise.Trainset
+    ratings : pandas.DataFrame
+        columns: user_id, item_id, recommend.
+
+    Returns
+    -------
+    type: list of tuple
+        (inner uid, inner iid, rating) of the added ratings.
+
+    """
+    trainset.global_mean  # computed and cached before the ratings change
+    users = trainset._raw2inner_id_users
+    items = trainset._raw2inner_id_items
+    added = []
+    for uid, iid, r in ratings[["user_id", "item_id", "recommend"]].itertuples(
+            index=False, name=None):
+        u = _add_id(users, uid)
+        i = _add_id(items, iid)
+        trainset.ur.setdefault(u, []).append((i, float(r)))
+        trainset.ir.setdefault(i, []).append((u, float(r)))
+        added.append((u, i, float(r)))
+    trainset.n_users = len(users)
+    trainset.n_items = len(items)
+    trainset.n_ratings += len(added)
+    # rebuilt lazily by to_raw_uid and to_raw_iid
+    trainset._inner2raw_id_users = None
+    trainset._inner2raw_id_items = None
+    return added
+
+
+def _grow(rows, n, algo, rng):
+    """append factor rows for new ids, initialized as the model's fit does."""
+    if len(rows) >= n:
+        return rows
+    new = rng.normal(algo.init_mean, algo.init_std_dev,
+                     size=(n - len(rows), algo.n_factors))
+    return np.vstack([rows, new])
+
+
+def sgd_update(algo, ratings, n_epochs=5, seed=0):
+    """run SGD epochs over ratings only, with the model's learning rates.
+
+    The update rules are those of surprise's SVD and SVDpp fit, applied to
+    the new ratings instead of the whole trainset.
+
+    Parameters
+    ----------
+    algo : surprise.SVD or surprise.SVDpp
+        fitted model whose trainset already holds ratings.
+    ratings : list of tuple
+        (inner uid, inner iid, rating), see extend_trainset.
+    n_epochs : int
+    seed : int
+        seeds the order of ratings and the factors of new ids.
+
+    """
+    trainset = algo.trainset
+    rng = np.random.RandomState(seed)
+    n_users, n_items = trainset.n_users, trainset.n_items
+
+    algo.pu = _grow(np.asarray(algo.pu, dtype=np.float64), n_users, algo, rng)
+    algo.qi = _grow(np.asarray(algo.qi, dtype=np.float64), n_items, algo, rng)
+    algo.bu = np.concatenate([algo.bu, np.zeros(n_users - len(algo.bu))])
+    algo.bi = np.concatenate([algo.bi, np.zeros(n_items - len(algo.bi))])
+    implicit = isinstance(algo, SVDpp)
+    if implicit:
+        algo.yj = _grow(np.asarray(algo.yj, dtype=np.float64), n_items, algo,
+                        rng)
+    biased = getattr(algo, "biased", True)
+    global_mean = trainset.global_mean if biased else 0.
+
+    bu, bi, pu, qi = algo.bu, algo.bi, algo.pu, algo.qi
+    for _ in range(n_epochs):
+        for k in rng.permutation(len(ratings)):
+            u, i, r = ratings[k]
+            if implicit:
+                Iu = [j for j, _ in trainset.ur[u]]
+                sqrt_Iu = np.sqrt(len(Iu))
+                u_impl = algo.yj[Iu].sum(axis=0) / sqrt_Iu
+            else:
+                u_impl = 0.
+            err = r - (global_mean + bu[u] + bi[i] + qi[i] @ (pu[u] + u_impl))
+
+            if biased:
+                bu[u] += algo.lr_bu * (err - algo.reg_bu * bu[u])
+                bi[i] += algo.lr_bi * (err - algo.reg_bi * bi[i])
+
+            puf, qif = pu[u].copy(), qi[i].copy()
+            pu[u] += algo.lr_pu * (err * qif - algo.reg_pu * puf)
+            qi[i] += algo.lr_qi * (err * (puf + u_impl) - algo.reg_qi * qif)
+            if implicit:
+                # a user can rate an item twice, fancy-index += would
+                # apply its update once
+                np.add.at(algo.yj, Iu, algo.lr_yj * (
+                    err * qif / sqrt_Iu - algo.reg_yj * algo.yj[Iu]))
+
+
+def update_predictions(algo, predictions, users, items):
+    """refresh the estimates of stored predictions whose factors moved.
+
+    The stored predictions are a cross validation holdout, the new ratings
+    are training data and are not added to them.
+
+    Parameters
+    ----------
+    algo : surprise.prediction_algorithms
+        updated model.
+    predictions : list
+        userid, itemid, true rating, estimates, details of the artifact.
+    users, items : set
+        raw ids whose factors moved.
+
+    Returns
+    -------
+    type: list
+        predictions of the updated model, in the same order with the same
+        true ratings.
+
+    """
+    updated = []
+    for p in predictions:
+        uid, iid, r_ui, _, _ = p
+        if uid in users or iid in items:
+            p = algo.predict(uid, iid, r_ui)
+        updated.append(p)
+    return updated
+
+
+def _lists(factors, users, items, scores):
+    # ranked inner item ids, -1 padded, as arguments of TopK.patch
+    kept = items >= 0
+    scores = np.clip(scores, *factors["rating_scale"])
+    return (factors["raw_uids"][users], kept.sum(axis=1),
+            factors["raw_iids"][items[kept]], scores[kept])
+
+
+def _merge_moved(factors, top_k, rows, users, items, max_n):
+    """merge the moved items into the lists of users who did not move.
+
+    Every item outside a full list that did not move scores at most the
+    last unmoved item of the list, so the best max_n of the unmoved listed
+    items and the moved items are the new list when the last of them still
+    scores that much.
+
+    Returns
+    -------
+    type: turple
+        TopK.patch arguments of the lists that changed, users whose list
+        must be ranked again.
+
+    """
+    item_inner = np.array([factors["iid_index"][iid]
+                           for iid in top_k.item_ids.tolist()],
+                          dtype=np.int64)
+    listed = top_k.items[rows[users]].astype(np.int64)
+    valid = listed >= 0
+    listed = np.where(valid, item_inner[np.maximum(listed, 0)], -1)
+    moved = valid & np.isin(listed, items)
+    unmoved = valid & ~moved
+
+    # scores of the unmoved listed items are those they were ranked with
+    listed_scores = np.full(listed.shape, -np.inf)
+    r, c = np.nonzero(unmoved)
+    listed_scores[r, c] = score_pairs(factors, users[r], listed[r, c],
+                                      clip=False)
+    last = listed.shape[1] - 1 - np.argmax(unmoved[:, ::-1], axis=1)
+    bound = np.where(unmoved.any(axis=1),
+                     listed_scores[np.arange(len(users)), last], np.inf)
+    # lists shorter than max_n held every unseen item
+    bound[valid.sum(axis=1) < max_n] = -np.inf
+
+    moved_scores = score_users(
+        {**factors, "qi": factors["qi"][items], "bi": factors["bi"][items]},
+        users, clip=False)
+    moved_scores[factors["seen"][users][:, items].toarray() > 0] = -np.inf
+
+    candidates = np.hstack([listed,
+                            np.broadcast_to(items, moved_scores.shape)])
+    idx, scores = top_k_scores(np.hstack([listed_scores, moved_scores]),
+                               max_n)
+    merged = np.where(idx >= 0, np.take_along_axis(
+        candidates, np.maximum(idx, 0), axis=1), -1)
+    n_kept = (idx >= 0).sum(axis=1)
+    exact = scores[np.arange(len(users)), np.maximum(n_kept - 1, 0)] >= bound
+    changed = exact & (moved.any(axis=1) | np.isin(merged, items).any(axis=1))
+    return (_lists(factors, users[changed], merged[changed], scores[changed]),
+            users[~exact])
+
+
+def rerank_top_k(algo, top_k, users, items, max_n=MAX_N, batch_size=1024):
+    """update the lists of a TopK after the factors of some users and items
+    moved, without ranking every user again.
+
+    The moved users are ranked again over the catalog. The moved items are
+    merged into every other list, which is only ranked again when one of
+    its items dropped out and the next best is unknown.
+
+    Parameters
+    ----------
+    algo : surprise.SVD or surprise.SVDpp
+        updated model.
+    top_k : recsys.topk.TopK
+        lists of the model before the update.
+    users, items : iterable of int
+        inner ids of the users and items whose biases or factors moved,
+        new ones included.
+    max_n : int
+        # of recommended items kept per user.
+    batch_size : int
+        # of users scored together.
+
+    Returns
+    -------
+    type: TopK
+
+    """
+    factors = get_factors(algo)
+    items = np.array(sorted(set(items)), dtype=np.int64)
+    # row of every inner user in top_k, -1 for users it does not hold
+    rows = np.array([top_k.user_index.get(uid, -1)
+                     for uid in factors["raw_uids"].tolist()],
+                    dtype=np.int64)
+    stale = rows < 0
+    stale[list(set(users))] = True
+
+    parts = []
+    kept = np.flatnonzero(~stale)
+    for start in range(0, len(kept), batch_size):
+        merged, unknown = _merge_moved(factors, top_k, rows,
+                                       kept[start:start + batch_size],
+                                       items, max_n)
+        parts.append(merged)
+        stale[unknown] = True
+    n_merged = sum(len(part[0]) for part in parts)
+
+    stale = np.flatnonzero(stale)
+    for start in range(0, len(stale), batch_size):
+        batch = stale[start:start + batch_size]
+        idx, scores = top_k_scores(score_users(factors, batch, clip=False),
+                                   max_n, factors["seen"][batch])
+        parts.append(_lists(factors, batch, idx, scores))
+    logging.info(f"merged {n_merged} lists and ranked {len(stale)} of "
+                 f"{len(rows)} users again")
+    if not parts:
+        return top_k
+    return top_k.patch(*(np.concatenate(column) for column in zip(*parts)))
+
+
+def update_model(output, ratings, n_epochs=5, seed=0, max_n=MAX_N):
+    """fold ratings into the model of a refit output.
+
+    Parameters
+    ----------
+    output : dict
+        keys: predictions, algo, encoders and top_n, as loaded by
+        recsys.artifacts; every list is ranked again when top_n is None.
+    ratings : pandas.DataFrame
+        columns: user_id, item_id, recommend, with raw ids.
+    n_epochs : int
+        SGD epochs over ratings.
+    seed : int
+    max_n : int
+        # of recommended items kept per user.
+
+    Returns
+    -------
+    type: dict
+        keys: predictions, algo, encoders, top_n, ready for
+        recsys.artifacts.save_model_output; predictions are only refreshed
+        when output has them.
+
+    """
+    algo = output["algo"]
+    if not isinstance(algo, (SVD, SVDpp)):
+        raise ValueError(f"{type(algo).__name__} has no incremental update, "
+                         "retrain with recsys.train")
+    encoders = output.get("encoders")
+    if encoders is not None:
+        # new users and items get the next free codes
+        encoders = {"user": encoders["user"].extend(ratings["user_id"]),
+                    "item": encoders["item"].extend(ratings["item_id"])}
+        ratings = ratings.assign(
+            user_id=encoders["user"].encode(ratings["user_id"]).tolist(),
+            item_id=encoders["item"].encode(ratings["item_id"]).tolist())
+    added = extend_trainset(algo.trainset, ratings)
+    sgd_update(algo, added, n_epochs, seed)
+
+    users = {u for u, _, _ in added}
+    items = {i for _, i, _ in added}
+    trainset = algo.trainset
+    if isinstance(algo, SVDpp):
+        # yj of every item a batch user rated moved, and with it the
+        # implicit feedback of every user who rated one of those items
+        users |= {v for u in list(users) for j, _ in trainset.ur[u]
+                  for v, _ in trainset.ir[j]}
+    predictions = output["predictions"]
+    if predictions:
+        predictions = update_predictions(
+            algo, predictions, {trainset.to_raw_uid(u) for u in users},
+            {trainset.to_raw_iid(i) for i in items})
+    if output.get("top_n") is None:
+        top_n = build_top_k(algo, max_n=max_n)
+    else:
+        top_n = rerank_top_k(algo, output["top_n"], users, items, max_n)
+    return {"predictions": predictions, "algo": algo, "encoders": encoders,
+            "top_n": top_n}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", type=str, required=True,
+                        help="table of new user_id, item_id, recommend rows, "
+                             "parquet or csv")
+    parser.add_argument("--directory", default=OUTPUT_DIR, type=str,
+                        help="model artifact to update and publish")
+    parser.add_argument("--epochs", default=5, type=int,
+                        help="# of SGD epochs over the new rows")
+    args = vars(parser.parse_args())
+
+    start = time.time()
+    if args["input"].endswith(".csv"):
+        ratings = pd.read_csv(args["input"], dtype={"user_id": str,
+                                                    "item_id": str})
+    else:
+        ratings = load_table(args["input"],
+                             columns=["user_id", "item_id", "recommend"])
+    output = load_model_output(args["directory"])
+    output = update_model(output, ratings, args["epochs"])
+    save_model_output(output, args["directory"])
+    print(f"folded {len(ratings)} ratings into "
+          f"{type(output['algo']).__name__} in {time.time() - start:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
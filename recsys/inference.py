@@ -5,49 +5,179 @@ usage example:
 python inference.py --input_uid "76561198107703934" --input_iid "12210" --input_rec_uid "76561198067243010" --input_n 5
 
 """
-import pickle
 import argparse
 from os.path import abspath, dirname, join
 
-from recsys.evaluate import get_top_n
+from recsys.artifacts import load_model_output
+from recsys.catalog import VALID_COLS, get_catalog
+from recsys.encoding import encode_id, decode_ids
+from recsys.scoring import score_pairs
+from recsys.topk import MAX_N, build_top_k
 from surprise import SVDpp, SlopeOne
 
 DATA_DIR = join(dirname(dirname(abspath((__file__)))), "data")
-OUTPUT_FILE = join(DATA_DIR, "best_model_predictions.pkl")
-DETAIL_FILE = join(DATA_DIR, "details.pkl")
+OUTPUT_DIR = join(DATA_DIR, "best_model_predictions")
+IMPLICIT_OUTPUT_DIR = join(DATA_DIR, "best_model_predictions_implicit")
 
 
-def load_output(file=OUTPUT_FILE):
-    f = open(file, "rb")
-    output = pickle.load(f)
-    f.close()
-    return output
-
-
-def rec_top_n_items(user_id, pred, n=5):
-    rec_item_ls = {}
-    top_n = get_top_n(pred, n)
-    for uid, rating, in top_n.items():
-        rec_item_ls[uid] = [iid for (iid, _) in rating]
-    return rec_item_ls[user_id]
+def load_output(directory=OUTPUT_DIR, predictions=True):
+    return load_model_output(directory, predictions)
+
+
+def build_top_n_index(pred, max_n=MAX_N, algo=None, factors=None):
+    """rank every user's items once so recommendations can be sliced.
+
+    Factor models (SVD, SVDpp, NMF) are ranked over the full catalog,
+    excluding items the user already rated; other algorithms fall back to
+    ranking the stored predictions.
+
+    Parameters
+    ----------
+    pred : list
+        userid, itemid, true rating, estimates, details
+    max_n : int
+        largest # of recommended items that can be served from the index.
+    algo : surprise.prediction_algorithms, optional
+        trained model the predictions come from.
+    factors : dict, optional
+        factors of algo when already extracted, see recsys.scoring.
+
+    Returns
+    -------
+    type: recsys.topk.TopK
+        indexed like a dict of user_id to the list of itemid sorted by
+        estimated rating, at most max_n long.
+
+    """
+    return build_top_k(algo, pred, max_n, factors)
+
+
+def _encoder(encoders, kind):
+    return None if encoders is None else encoders[kind]
+
+
+def rec_top_n_items(user_id, top_n_index, n=5, encoders=None):
+    """top n items for user_id, n larger than the index max_n is capped.
+
+    With encoders the index holds int codes, user_id is encoded and the
+    items decoded back to raw ids. KeyError when user_id is unknown.
+    """
+    uid = encode_id(_encoder(encoders, "user"), user_id)
+    if uid is None or uid not in top_n_index:
+        raise KeyError(f"User {user_id} is not part of the trainset.")
+    return decode_ids(_encoder(encoders, "item"), top_n_index[uid][:n])
+
+
+def predict_rating(algo, uid, iid, encoders=None):
+    """estimated rating of one raw user-item pair, the default prediction
+    of algo when either id is unknown."""
+    # None is unknown to every trainset
+    return algo.predict(encode_id(_encoder(encoders, "user"), uid),
+                        encode_id(_encoder(encoders, "item"), iid)).est
+
+
+def similar_items(item_index, iid, n=10, encoders=None):
+    """n items most similar to raw iid, see recsys.similarity.
+
+    Returns
+    -------
+    type: list of tuple
+        (raw iid, cosine similarity).
+
+    """
+    item_encoder = _encoder(encoders, "item")
+    code = encode_id(item_encoder, iid)
+    if code is None or code not in item_index:
+        raise KeyError(f"Item {iid} is not part of the trainset.")
+    neighbours = item_index.similar(code, n)
+    raw_iids = decode_ids(item_encoder, [i for i, _ in neighbours])
+    return [(i, score) for i, (_, score) in zip(raw_iids, neighbours)]
+
+
+def _inner_id(to_inner, raw_id):
+    try:
+        return to_inner(raw_id)
+    except (ValueError, TypeError):
+        return None
+
+
+def predict_pairs(algo, pairs, factors=None, encoders=None):
+    """estimate many user-item pairs, unknown ids fail only their own pair.
+
+    Parameters
+    ----------
+    algo : surprise.prediction_algorithms
+        trained model.
+    pairs : list of dict
+        keys: uid, iid, a pair that is not a dict gets an error.
+    factors : dict, optional
+        factors of algo, see recsys.scoring, scores all pairs in one
+        vectorized pass.
+    encoders : dict, optional
+        user and item IdEncoder of algo, pairs and results keep raw ids.
+
+    Returns
+    -------
+    type: list of dict
+        keys: uid, iid and est, or uid, iid and error.
+
+    """
+    trainset = algo.trainset
+    results = []
+    known = []
+    for pair in pairs:
+        if not isinstance(pair, dict):
+            results.append({"error": "pair must be an object with uid and "
+                                     "iid"})
+            continue
+        result = {"uid": pair.get("uid"), "iid": pair.get("iid")}
+        results.append(result)
+        uid = encode_id(_encoder(encoders, "user"), result["uid"])
+        iid = encode_id(_encoder(encoders, "item"), result["iid"])
+        if factors is not None:
+            u = _inner_id(factors["uid_index"].get, uid)
+            i = _inner_id(factors["iid_index"].get, iid)
+        else:
+            u = _inner_id(trainset.to_inner_uid, uid)
+            i = _inner_id(trainset.to_inner_iid, iid)
+
+        if u is None:
+            result["error"] = f"User {result['uid']} is not part of the " \
+                "trainset."
+        elif i is None:
+            result["error"] = f"Item {result['iid']} is not part of the " \
+                "trainset."
+        else:
+            known.append((result, u, i))
+
+    if factors is not None and known:
+        _, users, items = zip(*known)
+        ests = score_pairs(factors, users, items).tolist()
+        for (result, _, _), est in zip(known, ests):
+            result["est"] = est
+    else:
+        for result, _, _ in known:
+            result["est"] = predict_rating(algo, result["uid"],
+                                           result["iid"], encoders)
+    return results
 
 
 def get_game_info(rec_item_ls, cols):
-    valid_col = ['id', 'app_name', 'publisher', 'developer', 'genres', 'url',
-                 'tags', 'discount_price',
-                 'reviews_url', 'specs', 'price', 'early_access']
-    if cols not in valid_col:
+    """one column of game details, in the order of rec_item_ls."""
+    if cols not in VALID_COLS:
         print("check your spelling")
     else:
-        df_game = load_output(DETAIL_FILE)
-        df_rec_game = df_game.loc[df_game["id"].isin(rec_item_ls)]
-        rec_info = list(df_rec_game[cols])
-        return rec_info
+        return get_catalog().lookup(rec_item_ls, [cols])[cols].tolist()
 
 
 def main():
-    output = load_output()
-    pred, algo = output["predictions"], output["algo"]
+    output = load_output(predictions=False)
+    algo, encoders = output["algo"], output["encoders"]
+    top_n_index = output["top_n"]
+    if top_n_index is None:
+        # artifact written before refit stored the top-K lists
+        pred = load_output()["predictions"]
+        top_n_index = build_top_n_index(pred, algo=algo)
     parser = argparse.ArgumentParser()
     parser.add_argument("--input_uid", type=str,
                         help="input userid to predict rating")
@@ -63,10 +193,12 @@ def main():
     iid = args["input_iid"]
     rec_uid = args["input_rec_uid"]
     n = args["input_n"]
-    _, _, _, est, _ = algo.predict(uid, iid)
+    est = predict_rating(algo, uid, iid, encoders)
 
-    rec_ls = rec_top_n_items(args["input_rec_uid"], pred, args["input_n"])
-    rec_name = get_game_info(rec_ls, "app_name")
+    rec_ls = rec_top_n_items(args["input_rec_uid"], top_n_index,
+                             args["input_n"], encoders)
+    df_rec_game = get_catalog().lookup(rec_ls, ["app_name"])
+    rec_name = df_rec_game["app_name"].tolist()
     uid = args["input_uid"]
     print(f'input user id: {uid}, item id: {iid}, estimated rating: {est}')
     print(f'top {n} recommended items for input user id {rec_uid}: {rec_ls}')
@@ -0,0 +1,254 @@
+"""
+In-process serving metrics in the Prometheus text exposition format.
+
+Routes and Dash callbacks record a request count, an error count and a
+latency histogram each; a scrape of /metrics renders them together with the
+load time, artifact size and identity of the model being served. Recording
+is a dict lookup, a bisect and two additions under a lock, so it adds
+microseconds to a request and needs no external service.
+
+CONTENT_TYPE
+LATENCY_BUCKETS
+mark_error
+Counter
+Gauge
+Histogram
+ServingMetrics
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+from flask import g, request
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# seconds, from a top-N lookup to a slow dashboard callback
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1., 2.5, 5., 10.)
+
+
+def mark_error():
+    """count the current request as an error, for routes that answer a
+    failure with 200 and an "error" key."""
+    g.metrics_error = True
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\")
+                         .replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._values = {}
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        """exposition lines of every labelled series."""
+        lines = [f"# HELP {self.name} {self.help}",
+                 f"# TYPE {self.name} {self.kind}"]
+        for name, labelnames, labels, value in self._samples():
+            lines.append(f"{name}{_format_labels(labelnames, labels)} "
+                         f"{_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """monotonic count per label values."""
+
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield self.name, self.labelnames, labels, value
+
+
+class Gauge(_Metric):
+    """last set value per label values."""
+
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def _samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield self.name, self.labelnames, labels, value
+
+
+class Histogram(_Metric):
+    """observation counts in cumulative buckets, plus their sum and count.
+
+    Parameters
+    ----------
+    buckets : tuple of float
+        increasing upper bounds, +Inf is added.
+
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [
+                    [0] * (len(self.buckets) + 1), 0.]
+            state[0][i] += 1
+            state[1] += value
+
+    def _samples(self):
+        with self._lock:
+            values = sorted((labels, (list(counts), total))
+                            for labels, (counts, total) in
+                            self._values.items())
+        bucket_names = self.labelnames + ("le",)
+        for labels, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield (f"{self.name}_bucket", bucket_names,
+                       labels + (_format_value(bound),), cumulative)
+            yield f"{self.name}_sum", self.labelnames, labels, total
+            yield f"{self.name}_count", self.labelnames, labels, cumulative
+
+
+class ServingMetrics:
+    """metrics of the Flask routes, Dash callbacks and served model.
+
+    Parameters
+    ----------
+    model_registry : recsys.registry.ModelRegistry, optional
+        model whose snapshot is reported on every scrape.
+    namespace : str
+        prefix of every metric name.
+
+    """
+
+    def __init__(self, model_registry=None, namespace="recsys"):
+        self.model_registry = model_registry
+        self.requests = Counter(f"{namespace}_http_requests_total",
+                                "HTTP requests handled.", ["endpoint"])
+        self.errors = Counter(f"{namespace}_http_errors_total",
+                              "HTTP requests answered with an error.",
+                              ["endpoint"])
+        self.latency = Histogram(f"{namespace}_http_request_duration_seconds",
+                                 "HTTP request latency.", ["endpoint"])
+        self.callbacks = Counter(f"{namespace}_dash_callbacks_total",
+                                 "Dash callback calls.", ["callback"])
+        self.callback_errors = Counter(
+            f"{namespace}_dash_callback_errors_total",
+            "Dash callback calls that raised.", ["callback"])
+        self.callback_latency = Histogram(
+            f"{namespace}_dash_callback_duration_seconds",
+            "Dash callback latency.", ["callback"])
+        self.model_info = Gauge(f"{namespace}_model_info",
+                                "Served model, always 1.", ["algo", "stamp"])
+        self.model_load = Gauge(f"{namespace}_model_load_seconds",
+                                "Time taken to load the served model.")
+        self.model_loaded_at = Gauge(
+            f"{namespace}_model_loaded_timestamp_seconds",
+            "Unix time the served model was loaded.")
+        self.artifact_bytes = Gauge(f"{namespace}_model_artifact_bytes",
+                                    "Size of the served model artifact.")
+
+    def instrument(self, server, endpoints):
+        """time every request to one of endpoints, URL rules of server."""
+        endpoints = frozenset(endpoints)
+
+        @server.before_request
+        def _start_timer():
+            g.metrics_start = time.perf_counter()
+
+        @server.after_request
+        def _record(response):
+            rule = request.url_rule
+            start = g.get("metrics_start")
+            if rule is None or start is None or rule.rule not in endpoints:
+                return response
+            self.latency.observe(time.perf_counter() - start, rule.rule)
+            self.requests.inc(rule.rule)
+            if response.status_code >= 400 or g.get("metrics_error"):
+                self.errors.inc(rule.rule)
+            return response
+
+        return server
+
+    def track_callback(self, func):
+        """decorator timing a Dash callback under its function name."""
+        name = func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                self.callback_errors.inc(name)
+                raise
+            finally:
+                self.callback_latency.observe(time.perf_counter() - start,
+                                              name)
+                self.callbacks.inc(name)
+        return wrapper
+
+    def _collect_model(self):
+        if self.model_registry is None:
+            return
+        snapshot = self.model_registry.current()
+        self.model_info.clear()
+        self.model_info.set(1, type(snapshot.algo).__name__, snapshot.stamp)
+        self.model_load.set(snapshot.load_seconds)
+        self.model_loaded_at.set(snapshot.loaded_at)
+        self.artifact_bytes.set(snapshot.artifact_bytes)
+
+    def render(self):
+        """every metric in the text exposition format."""
+        self._collect_model()
+        lines = []
+        for metric in (self.requests, self.errors, self.latency,
+                       self.callbacks, self.callback_errors,
+                       self.callback_latency, self.model_info,
+                       self.model_load, self.model_loaded_at,
+                       self.artifact_bytes):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
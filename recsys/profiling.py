@@ -0,0 +1,243 @@
+"""
+Stage-level time and memory profile of the offline pipeline.
+
+Off by default. With RECSYS_PROFILE=1 (or rss) in the environment, or
+--profile passed to steam_preprocess.py or train.py, every stage of the run
+records its wall time, CPU time (worker processes included), resident
+memory and the process's peak resident memory during the stage, and how
+far that peak rose over the memory the stage started with.
+RECSYS_PROFILE=tracemalloc (--profile tracemalloc) also traces python
+allocations for an exact per-stage peak, at the cost of a slower run. A
+JSON and a text report are written when the run ends.
+
+usage example:
+
+RECSYS_PROFILE=1 python train.py
+python steam_preprocess.py --profile tracemalloc
+
+PROFILE_ENV
+MEMORY_MODES
+peak_rss_mb
+reset_peak_rss
+track_peak_rss
+StageProfiler
+profiler
+"""
+
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+PROFILE_ENV = "RECSYS_PROFILE"
+MEMORY_MODES = ("rss", "tracemalloc")
+
+
+def peak_rss_mb():
+    """peak resident memory of this process since it started or since
+    reset_peak_rss."""
+    try:
+        # VmHWM, unlike ru_maxrss, is reset through /proc/self/clear_refs
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    # ru_maxrss is in kilobytes on linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 ** 2 if sys.platform == "darwin" else 1024)
+
+
+# peaks cleared by reset_peak_rss while each track_peak_rss block is open
+_open_peaks = []
+
+
+def reset_peak_rss():
+    """start peak_rss_mb again from the current resident memory, the open
+    track_peak_rss blocks keep the peak reached so far.
+
+    Returns
+    -------
+    type: bool
+        False where the peak cannot be reset (not linux), peak_rss_mb then
+        keeps the peak since the process started.
+
+    """
+    peak = peak_rss_mb()
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+    for block in _open_peaks:
+        block["peak"] = max(block["peak"], peak)
+    return True
+
+
+@contextmanager
+def track_peak_rss():
+    """peak resident memory of this process over the block.
+
+    Yields a dict whose peak_rss_mb is set when the block exits: the peak
+    since the block started, or since the process started where the peak
+    cannot be reset. Blocks can be nested.
+    """
+    reset_peak_rss()
+    block = {"peak": 0.}
+    _open_peaks.append(block)
+    result = {}
+    try:
+        yield result
+    finally:
+        _open_peaks.remove(block)
+        result["peak_rss_mb"] = max(block["peak"], peak_rss_mb())
+
+
+def _rss_mb():
+    try:
+        with open("/proc/self/statm", "r") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    except (OSError, ValueError):
+        return peak_rss_mb()
+
+
+def _cpu_seconds():
+    # children cover pool workers once they have been joined
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+class StageProfiler:
+    """records of the stages run inside stage() blocks.
+
+    Parameters
+    ----------
+    memory : str, optional
+        None disables profiling, "rss" records resident memory, and
+        "tracemalloc" also the peak of traced python allocations.
+
+    """
+
+    def __init__(self, memory=None):
+        self.memory = None
+        self.records = []
+        self._stack = []
+        if memory is not None:
+            self.enable(memory)
+
+    @classmethod
+    def from_env(cls):
+        """profiler configured by the RECSYS_PROFILE variable."""
+        value = os.environ.get(PROFILE_ENV, "").strip().lower()
+        if value in ("", "0", "false", "off"):
+            return cls()
+        return cls("tracemalloc" if value == "tracemalloc" else "rss")
+
+    @property
+    def enabled(self):
+        return self.memory is not None
+
+    def enable(self, memory="rss"):
+        if memory not in MEMORY_MODES:
+            raise ValueError(f"memory must be one of {MEMORY_MODES}, "
+                             f"got {memory!r}")
+        self.memory = memory
+        if memory == "tracemalloc" and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        return self
+
+    @contextmanager
+    def stage(self, name, **info):
+        """profile the block as stage name, info is stored with it."""
+        if not self.enabled:
+            yield
+            return
+        record = {"name": name, "depth": len(self._stack), **info}
+        self.records.append(record)
+        frame = {"peak": 0}
+        if self.memory == "tracemalloc":
+            # the enclosing stage keeps the peak reached before this one
+            if self._stack:
+                self._stack[-1]["peak"] = max(
+                    self._stack[-1]["peak"], tracemalloc.get_traced_memory()[1])
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+        self._stack.append(frame)
+        rss_before = _rss_mb()
+        cpu_start = _cpu_seconds()
+        start = time.perf_counter()
+        try:
+            # the peak of this stage alone, also in a reused pool worker
+            with track_peak_rss() as memory:
+                yield
+        finally:
+            record["wall_seconds"] = round(time.perf_counter() - start, 4)
+            record["cpu_seconds"] = round(_cpu_seconds() - cpu_start, 4)
+            record["rss_mb"] = round(_rss_mb(), 1)
+            record["peak_rss_mb"] = round(memory["peak_rss_mb"], 1)
+            # over the rss the stage started at, never printed as -0.0
+            record["peak_rss_growth_mb"] = round(
+                max(0., memory["peak_rss_mb"] - rss_before), 1)
+            self._stack.pop()
+            if self.memory == "tracemalloc":
+                peak = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+                record["traced_peak_mb"] = round(peak / 1024 ** 2, 1)
+                if self._stack:
+                    self._stack[-1]["peak"] = max(self._stack[-1]["peak"],
+                                                  peak)
+
+    def add(self, records, **info):
+        """append records of another profiler, e.g. of a worker process,
+        nested under the current stage."""
+        depth = len(self._stack)
+        for record in records:
+            self.records.append({**record, **info,
+                                 "depth": record["depth"] + depth})
+
+    def report(self):
+        """records as a text table, one row per stage, nested stages
+        indented."""
+        traced = self.memory == "tracemalloc"
+        header = (f"{'stage':<48} {'wall s':>9} {'cpu s':>9} "
+                  f"{'rss MB':>9} {'peak MB':>9} {'+peak MB':>9}")
+        if traced:
+            header += f" {'traced MB':>10}"
+        lines = [header, "-" * len(header)]
+        for r in self.records:
+            if "wall_seconds" not in r:
+                # stage still running when the report was asked for
+                continue
+            name = ("  " * r["depth"] + r["name"])[:48]
+            line = (f"{name:<48} {r['wall_seconds']:>9.2f} "
+                    f"{r['cpu_seconds']:>9.2f} {r['rss_mb']:>9.1f} "
+                    f"{r['peak_rss_mb']:>9.1f} "
+                    f"{r['peak_rss_growth_mb']:>9.1f}")
+            if traced:
+                line += f" {r.get('traced_peak_mb', float('nan')):>10.1f}"
+            lines.append(line)
+        return "\n".join(lines)
+
+    def write_report(self, prefix):
+        """write prefix.json and prefix.txt and print the text report.
+
+        Does nothing when profiling is disabled.
+        """
+        if not self.enabled:
+            return
+        with open(f"{prefix}.json", "w") as f:
+            json.dump({"memory": self.memory, "stages": self.records}, f,
+                      indent=2, default=str)
+        text = self.report()
+        with open(f"{prefix}.txt", "w") as f:
+            f.write(text + "\n")
+        print(text)
+        print(f"profile written to {prefix}.json and {prefix}.txt")
+
+
+# process-wide profiler of the pipeline scripts
+profiler = StageProfiler.from_env()
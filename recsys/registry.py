@@ -0,0 +1,170 @@
+"""
+Process-wide model registry shared by the Flask routes.
+
+The registry loads the model artifact once, then a background thread
+watches it and swaps in a newly trained model. Requests read one immutable
+snapshot, so they never wait on a reload or see a half-loaded model.
+
+artifact_stamp
+artifact_size
+load_snapshot
+ModelSnapshot
+ModelRegistry
+"""
+
+import logging
+import threading
+import time
+from collections import namedtuple
+from os import stat, walk
+from os.path import getsize, isdir, join
+
+from recsys.artifacts import MANIFEST, resolve, swapping, load_factors
+from recsys.inference import OUTPUT_DIR, MAX_N, load_output, build_top_n_index
+from recsys.scoring import is_factor_model, get_factors
+from recsys.similarity import build_item_index
+
+ModelSnapshot = namedtuple("ModelSnapshot", [
+    "algo", "predictions", "encoders", "factors", "top_n_index", "item_index",
+    "stamp", "artifact_bytes", "loaded_at", "load_seconds"])
+
+
+def artifact_stamp(directory):
+    """modification stamp of the model artifact, None while it is missing or
+    a new one is being swapped in.
+
+    The manifest is written last, so its mtime changes only once the rest of
+    the artifact is complete.
+    """
+    if swapping(directory):
+        return None
+    path = resolve(directory)
+    if isdir(path):
+        path = join(path, MANIFEST)
+    try:
+        return stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def artifact_size(directory):
+    """# of bytes of the model artifact on disk."""
+    path = resolve(directory)
+    if not isdir(path):
+        return getsize(path)
+    return sum(getsize(join(root, file))
+               for root, _, files in walk(path) for file in files)
+
+
+def load_snapshot(directory=OUTPUT_DIR, max_n=MAX_N):
+    """load a model artifact and build everything the routes serve from."""
+    start = time.time()
+    stamp = artifact_stamp(directory)
+    # the stored top-K lists are all serving needs, skip the predictions
+    output = load_output(directory, predictions=False)
+    algo, pred = output["algo"], output["predictions"]
+
+    factors = None
+    if is_factor_model(algo):
+        if isdir(join(resolve(directory), "factors")):
+            factors = load_factors(resolve(directory))
+        else:
+            factors = get_factors(algo)
+    top_n_index = output["top_n"]
+    if top_n_index is None:
+        # artifact written before refit stored the top-K lists
+        if factors is None:
+            pred = load_output(directory)["predictions"]
+        top_n_index = build_top_n_index(pred, max_n, factors=factors)
+    # similar games need item factors, other models serve no /similar
+    item_index = build_item_index(factors) if factors is not None else None
+
+    return ModelSnapshot(algo=algo,
+                         predictions=pred,
+                         encoders=output["encoders"],
+                         factors=factors,
+                         top_n_index=top_n_index,
+                         item_index=item_index,
+                         stamp=stamp,
+                         artifact_bytes=artifact_size(directory),
+                         loaded_at=time.time(),
+                         load_seconds=time.time() - start)
+
+
+class ModelRegistry:
+    """current model plus a watcher that hot-reloads it.
+
+    Parameters
+    ----------
+    directory : str
+        model artifact written by train.save_output.
+    poll_interval : float
+        seconds between checks of the artifact.
+    max_n : int
+        largest # of recommended items served from the top-N index.
+
+    """
+
+    def __init__(self, directory=OUTPUT_DIR, poll_interval=30, max_n=MAX_N):
+        self.directory = directory
+        self.poll_interval = poll_interval
+        self.max_n = max_n
+        self._snapshot = load_snapshot(directory, max_n)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def current(self):
+        """snapshot to serve one request from, read once per request."""
+        return self._snapshot
+
+    def reload(self):
+        """load the artifact again and swap it in if it stayed unchanged.
+
+        The current snapshot is kept while the artifact is missing or being
+        replaced.
+        """
+        stamp = artifact_stamp(self.directory)
+        if stamp is None:
+            return False
+        try:
+            snapshot = load_snapshot(self.directory, self.max_n)
+        except Exception:
+            if artifact_stamp(self.directory) != stamp:
+                # replaced under the loader, pick it up next poll
+                return False
+            raise
+        if snapshot.stamp != stamp or stamp != artifact_stamp(self.directory):
+            # a new model was written while loading, pick it up next poll
+            return False
+        # rebinding one attribute is atomic, readers get old or new
+        self._snapshot = snapshot
+        logging.info(f"reloaded model {type(snapshot.algo).__name__} in "
+                     f"{snapshot.load_seconds:.2f} s")
+        return True
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_interval):
+            stamp = artifact_stamp(self.directory)
+            if stamp is None or stamp == self._snapshot.stamp:
+                continue
+            try:
+                self.reload()
+            except Exception:
+                logging.exception("model reload failed, keep serving the "
+                                  "current model")
+
+    def start(self):
+        """start the background watcher, at most once."""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._watch,
+                                            name="model-registry",
+                                            daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
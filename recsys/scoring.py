@@ -0,0 +1,246 @@
+"""
+Vectorized full-catalog scoring for fitted matrix factorization models.
+
+Supported models: SVD, SVDpp, NMF (anything exposing bu, bi, pu, qi)
+
+is_factor_model
+get_factors
+score_users
+score_pairs
+top_k
+recommend
+batch_recommend
+"""
+
+import numpy as np
+from scipy import sparse
+
+
+def is_factor_model(algo):
+    return all(hasattr(algo, attr) for attr in ("bu", "bi", "pu", "qi")) \
+        and hasattr(algo, "trainset")
+
+
+def get_factors(algo):
+    """pull learned biases and factors out of a fitted surprise model.
+
+    For SVDpp the implicit feedback term |N(u)|^-1/2 * sum(yj) is folded into
+    the user factors, so every supported model is scored as
+    global_mean + bu + bi + pu . qi
+
+    Parameters
+    ----------
+    algo : surprise.prediction_algorithms
+        fitted SVD, SVDpp or NMF.
+
+    Returns
+    -------
+    type: dict
+        keys: global_mean, bu, bi, pu, qi, seen, rating_scale,
+              raw_uids, raw_iids, uid_index, iid_index
+        items: numpy arrays indexed by inner id, seen is a sparse
+               user x item matrix of rated pairs.
+
+    """
+    if not is_factor_model(algo):
+        raise ValueError(f"{type(algo).__name__} has no latent factors")
+
+    trainset = algo.trainset
+    n_users, n_items = trainset.n_users, trainset.n_items
+
+    rows = np.fromiter((u for u, ratings in trainset.ur.items()
+                        for _ in ratings), dtype=np.int64,
+                       count=trainset.n_ratings)
+    cols = np.fromiter((i for ratings in trainset.ur.values()
+                        for i, _ in ratings), dtype=np.int64,
+                       count=trainset.n_ratings)
+    seen = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)),
+                             shape=(n_users, n_items))
+
+    pu = np.asarray(algo.pu, dtype=np.float64)
+    qi = np.asarray(algo.qi, dtype=np.float64)
+    if hasattr(algo, "yj"):
+        # SVDpp: pu + |N(u)|^-1/2 * sum of yj over items rated by u
+        n_rated = np.asarray(seen.sum(axis=1)).ravel()
+        norm = sparse.diags(1 / np.sqrt(np.maximum(n_rated, 1)))
+        pu = pu + norm @ seen @ np.asarray(algo.yj, dtype=np.float64)
+    # duplicate ratings count twice above, seen itself is a 0/1 mask
+    seen.data[:] = 1
+
+    if getattr(algo, "biased", True):
+        global_mean = trainset.global_mean
+        bu = np.asarray(algo.bu, dtype=np.float64)
+        bi = np.asarray(algo.bi, dtype=np.float64)
+    else:
+        global_mean = 0.
+        bu = np.zeros(n_users)
+        bi = np.zeros(n_items)
+
+    raw_uids = np.array([trainset.to_raw_uid(u) for u in range(n_users)],
+                        dtype=object)
+    raw_iids = np.array([trainset.to_raw_iid(i) for i in range(n_items)],
+                        dtype=object)
+
+    return {"global_mean": global_mean,
+            "bu": bu,
+            "bi": bi,
+            "pu": pu,
+            "qi": qi,
+            "seen": seen,
+            "rating_scale": trainset.rating_scale,
+            "raw_uids": raw_uids,
+            "raw_iids": raw_iids,
+            "uid_index": {uid: u for u, uid in enumerate(raw_uids)},
+            "iid_index": {iid: i for i, iid in enumerate(raw_iids)}}
+
+
+def score_users(factors, users, clip=True):
+    """estimated rating of every item for a batch of users.
+
+    Parameters
+    ----------
+    factors : dict
+        output of get_factors.
+    users : array-like of int
+        inner user ids.
+    clip : bool
+        clip estimates into the rating scale, same as algo.predict.
+
+    Returns
+    -------
+    type: numpy.ndarray
+        shape (len(users), n_items).
+
+    """
+    users = np.asarray(users, dtype=np.int64)
+    scores = factors["pu"][users] @ factors["qi"].T
+    scores += factors["bu"][users][:, None]
+    scores += factors["bi"][None, :]
+    scores += factors["global_mean"]
+    if clip:
+        lower, upper = factors["rating_scale"]
+        np.clip(scores, lower, upper, out=scores)
+    return scores
+
+
+def score_pairs(factors, users, items, clip=True):
+    """estimated rating of many (user, item) pairs in one vectorized pass.
+
+    Parameters
+    ----------
+    factors : dict
+        output of get_factors.
+    users, items : array-like of int
+        inner user ids and inner item ids, same length.
+    clip : bool
+        clip estimates into the rating scale, same as algo.predict.
+
+    Returns
+    -------
+    type: numpy.ndarray
+        shape (len(users),).
+
+    """
+    users = np.asarray(users, dtype=np.int64)
+    items = np.asarray(items, dtype=np.int64)
+    scores = np.einsum("ij,ij->i", factors["pu"][users], factors["qi"][items])
+    scores += factors["bu"][users] + factors["bi"][items]
+    scores += factors["global_mean"]
+    if clip:
+        lower, upper = factors["rating_scale"]
+        np.clip(scores, lower, upper, out=scores)
+    return scores
+
+
+def top_k(scores, k, exclude=None):
+    """k highest scores of each row, sorted in descending order.
+
+    Parameters
+    ----------
+    scores : numpy.ndarray
+        shape (n_users, n_items).
+    k : int
+        # of items kept per row.
+    exclude : scipy.sparse matrix, optional
+        same shape as scores, nonzero entries are never returned.
+
+    Returns
+    -------
+    type: turple of numpy.ndarray
+        item index and score, both shape (n_users, k). Rows with fewer than k
+        eligible items are padded with index -1 and score -inf.
+
+    """
+    scores = np.array(scores, dtype=np.float64)
+    if exclude is not None:
+        exclude = exclude.tocoo()
+        scores[exclude.row, exclude.col] = -np.inf
+    k = min(k, scores.shape[1])
+    if k == 0:
+        empty = np.empty((scores.shape[0], 0))
+        return empty.astype(np.int64), empty
+
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    part_scores = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-part_scores, axis=1, kind="stable")
+    idx = np.take_along_axis(part, order, axis=1)
+    top_scores = np.take_along_axis(part_scores, order, axis=1)
+    idx[np.isneginf(top_scores)] = -1
+    return idx, top_scores
+
+
+def _rank_batch(factors, users, k, exclude_seen):
+    # rank on unclipped scores, clipping would tie everything at the bound
+    scores = score_users(factors, users, clip=False)
+    exclude = factors["seen"][users] if exclude_seen else None
+    idx, top_scores = top_k(scores, k, exclude)
+    np.clip(top_scores, *factors["rating_scale"], out=top_scores)
+    raw_iids = factors["raw_iids"]
+    for u, items, ests in zip(users, idx, top_scores):
+        keep = items >= 0
+        yield factors["raw_uids"][u], list(zip(raw_iids[items[keep]],
+                                               ests[keep].tolist()))
+
+
+def recommend(factors, raw_uids, k, exclude_seen=True):
+    """top k items over the full catalog for the given users.
+
+    Parameters
+    ----------
+    factors : dict
+        output of get_factors.
+    raw_uids : list
+        raw user ids.
+    k : int
+        # of recommended items.
+    exclude_seen : bool
+        drop items the user already rated in the trainset.
+
+    Returns
+    -------
+    type: dict
+        keys: user_id
+        items: list of turple (iid, est) sorted by est.
+
+    """
+    try:
+        users = [factors["uid_index"][uid] for uid in raw_uids]
+    except KeyError as e:
+        raise ValueError(f"User {e.args[0]} is not part of the trainset.")
+    return dict(_rank_batch(factors, np.asarray(users, dtype=np.int64), k,
+                            exclude_seen))
+
+
+def batch_recommend(factors, k, batch_size=1024, exclude_seen=True):
+    """top k items for every user in the trainset, scored batch by batch.
+
+    Yields
+    ------
+    type: turple
+        user_id, list of turple (iid, est) sorted by est.
+
+    """
+    n_users = len(factors["raw_uids"])
+    for start in range(0, n_users, batch_size):
+        users = np.arange(start, min(start + batch_size, n_users))
+        yield from _rank_batch(factors, users, k, exclude_seen)
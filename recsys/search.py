@@ -0,0 +1,299 @@
+"""
+Budgeted hyperparameter search with successive halving.
+
+Every configuration of an algorithm is first evaluated on a small sample of
+users with few folds; only the best 1 / eta advance to the next rung, which
+uses eta times more users, until the survivors are evaluated on the whole
+data. Each rung costs about the same, so a budget buys many cheap first
+rung trials instead of a handful of full cross validations. The folds of a
+rung run in a process pool through recsys.train.cv_job.
+
+The budget is counted in fold fits on the whole data: a trial on a fraction
+f of the users with kfold folds costs f * kfold.
+
+PARAM_SPACES
+IMPLICIT_PARAM_SPACES
+sample_configs
+subsample_users
+successive_halving
+search_algorithms
+"""
+
+import itertools
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from surprise import (Dataset, Reader, KNNWithMeans, SVDpp, SlopeOne,
+                      CoClustering, model_selection)
+
+from recsys.als import ImplicitALS
+
+PARAM_SPACES = {
+    "KNNWithMeans": {"k": [10, 20, 40, 80],
+                     "min_k": [1, 3],
+                     "sim_options": [{"name": "msd", "user_based": True},
+                                     {"name": "pearson", "user_based": True},
+                                     {"name": "pearson_baseline",
+                                      "user_based": True},
+                                     {"name": "msd", "user_based": False}]},
+    "SVDpp": {"n_factors": [10, 20, 50],
+              "n_epochs": [10, 20, 30],
+              "lr_all": [0.002, 0.007, 0.02],
+              "reg_all": [0.005, 0.02, 0.1]},
+    "SlopeOne": {},
+    "CoClustering": {"n_cltr_u": [2, 3, 5, 8],
+                     "n_cltr_i": [2, 3, 5, 8],
+                     "n_epochs": [10, 20, 40]},
+}
+IMPLICIT_PARAM_SPACES = {
+    "ImplicitALS": {"n_factors": [16, 32, 64, 128],
+                    "reg": [0.01, 0.1, 1.],
+                    "alpha": [1., 10., 40.],
+                    "n_epochs": [10, 20]},
+}
+ALGORITHMS = {"KNNWithMeans": KNNWithMeans, "SVDpp": SVDpp,
+              "SlopeOne": SlopeOne, "CoClustering": CoClustering,
+              "ImplicitALS": ImplicitALS}
+
+
+def sample_configs(space, n, seed=0):
+    """at most n distinct configurations of a parameter grid.
+
+    Parameters
+    ----------
+    space : dict
+        keys: parameter name, items: list of candidate values.
+    n : int
+    seed : int
+
+    Returns
+    -------
+    type: list of dict
+        the whole grid when it has at most n points, a random sample of it
+        otherwise.
+
+    """
+    names = sorted(space)
+    grid = list(itertools.product(*(space[name] for name in names)))
+    if len(grid) > n:
+        rng = np.random.RandomState(seed)
+        grid = [grid[i] for i in sorted(rng.choice(len(grid), n,
+                                                   replace=False))]
+    return [dict(zip(names, values)) for values in grid]
+
+
+def subsample_users(df, fraction, seed=0):
+    """ratings of a random fraction of the users, all of their ratings kept
+    so precision at k still sees whole user profiles."""
+    if fraction >= 1:
+        return df
+    users = df["user_id"].unique()
+    rng = np.random.RandomState(seed)
+    keep = rng.choice(users, max(1, int(round(len(users) * fraction))),
+                      replace=False)
+    return df[df["user_id"].isin(keep)]
+
+
+def _trial(args, seed, implicit=False):
+    # imported here, recsys.train imports this module
+    from recsys.train import cv_job
+    try:
+        return cv_job(*args, seed=seed, implicit=implicit)
+    except Exception:
+        # e.g. a similarity undefined on the sampled users, the config loses
+        logging.exception(f"trial {args[0]} failed")
+        return None
+
+
+def _score(result, rank_by):
+    if result is None:
+        return -np.inf
+    if rank_by == "rmse":
+        return -result["rmse"]
+    values = result["precisions" if rank_by == "precision" else "recalls"]
+    return float(np.mean(list(values.values())))
+
+
+def _rung_fractions(min_fraction, eta):
+    fractions = [min_fraction]
+    while fractions[-1] < 1:
+        fractions.append(min(1., fractions[-1] * eta))
+    return fractions
+
+
+def _search_cost(n_configs, fractions, eta, kfold):
+    # the rungs successive_halving runs for n_configs, in fold fits
+    cost = 0.
+    for fraction in fractions:
+        cost += n_configs * fraction * kfold
+        if fraction >= 1 or n_configs == 1:
+            break
+        n_configs = max(1, n_configs // eta)
+    return cost
+
+
+def successive_halving(algo_class, configs, df, kfold=3, eta=3,
+                       min_fraction=1 / 9, top_n=10, threshold=0.7,
+                       k_ls=(3, 5, 7, 10), rank_by="precision", n_jobs=1,
+                       rating_scale=(0, 1), implicit=False, seed=0):
+    """evaluate configs of one algorithm rung by rung, keep the best 1 / eta.
+
+    Parameters
+    ----------
+    algo_class : type
+        surprise algorithm class, configs are its keyword arguments.
+    configs : list of dict
+    df : pandas.DataFrame
+        columns: user_id, item_id, recommend.
+    kfold : int
+        folds per trial.
+    eta : int
+        1 / eta of the trials advance, with eta times more users.
+    min_fraction : float
+        fraction of the users in the first rung.
+    top_n, threshold, k_ls :
+        see recsys.train.iterate_algo.
+    rank_by : str
+        precision (mean over k_ls), recall or rmse.
+    n_jobs : int
+        # of worker processes, 1 runs sequentially, -1 uses every core.
+    rating_scale : tuple
+    implicit : bool
+        evaluate playtime ratings as implicit feedback, see
+        recsys.train.cv_job; rank by precision or recall then.
+    seed : int
+
+    Returns
+    -------
+    type: dict
+        keys: best_config, best_score, trials (list of dict with config,
+        rung, fraction, score), cost (in full-data fold fits).
+
+    """
+    if not configs:
+        raise ValueError(f"no configurations of {algo_class.__name__} "
+                         f"to evaluate")
+    reader = Reader(rating_scale=rating_scale)
+    max_workers = os.cpu_count() if n_jobs == -1 else n_jobs
+    executor = ProcessPoolExecutor(max_workers=max_workers) \
+        if max_workers != 1 else None
+    survivors = list(range(len(configs)))
+    trials = []
+    cost = 0.
+    try:
+        for rung, fraction in enumerate(_rung_fractions(min_fraction, eta)):
+            data = Dataset.load_from_df(
+                subsample_users(df, fraction, seed + rung), reader=reader)
+            folds = list(model_selection.KFold(
+                n_splits=kfold, random_state=seed + rung).split(data))
+            jobs = [(c, (algo_class(**configs[c]), train, test, top_n,
+                         threshold, list(k_ls)),
+                     seed + rung * kfold + fold_i)
+                    for c in survivors
+                    for fold_i, (train, test) in enumerate(folds)]
+            if executor is None:
+                results = [_trial(args, job_seed, implicit)
+                           for _, args, job_seed in jobs]
+            else:
+                results = [future.result() for future in [
+                    executor.submit(_trial, args, job_seed, implicit)
+                    for _, args, job_seed in jobs]]
+
+            scores = {c: [] for c in survivors}
+            for (c, _, _), result in zip(jobs, results):
+                scores[c].append(_score(result, rank_by))
+            for c in survivors:
+                trials.append({"config": configs[c], "rung": rung,
+                               "fraction": fraction,
+                               "score": float(np.mean(scores[c]))})
+            cost += len(survivors) * fraction * kfold
+
+            ranked = sorted(survivors, key=lambda c: -np.mean(scores[c]))
+            if fraction >= 1 or len(ranked) == 1:
+                break
+            survivors = ranked[:max(1, len(ranked) // eta)]
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    best = ranked[0]
+    return {"best_config": configs[best],
+            "best_score": float(np.mean(scores[best])),
+            "trials": trials,
+            "cost": cost}
+
+
+def search_algorithms(df, budget, param_spaces=PARAM_SPACES, kfold=3, eta=3,
+                      min_fraction=1 / 9, n_jobs=1, seed=0, **kwargs):
+    """tune every algorithm of param_spaces within budget.
+
+    The budget is split evenly between the algorithms left to tune, so
+    what one algorithm does not spend of its share goes to the ones after
+    it; an algorithm gets as many first rung configurations as its share
+    pays for, each rung costing about # of configs * min_fraction * kfold.
+    An algorithm whose share does not pay for a single first rung trial
+    keeps its defaults.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        columns: user_id, item_id, recommend.
+    budget : float
+        # of fold fits on the whole data.
+    param_spaces : dict
+        keys: algorithm name of ALGORITHMS, items: parameter grid, empty
+        to keep the defaults.
+    **kwargs
+        passed to successive_halving.
+
+    Returns
+    -------
+    type: dict
+        keys: algorithm name, items: dict of algo (unfitted instance with
+        the best config) and the successive_halving result plus its budget
+        (None when the defaults are kept).
+
+    """
+    for name, space in param_spaces.items():
+        empty = [param for param, values in space.items() if not values]
+        if empty:
+            raise ValueError(f"{name}: no candidate values for {empty}")
+    n_left = len([space for space in param_spaces.values() if space])
+    fractions = _rung_fractions(min_fraction, eta)
+    spent = 0.
+    results = {}
+    for name, space in param_spaces.items():
+        algo_class = ALGORITHMS[name]
+        if not space:
+            # nothing to tune, keep the defaults
+            results[name] = {"algo": algo_class(), "search": None}
+            continue
+        share = (budget - spent) / n_left
+        n_left -= 1
+        if _search_cost(1, fractions, eta, kfold) > share:
+            logging.warning(f"{name}: a budget of {share:.2f} fold fits "
+                            f"does not pay for one trial on "
+                            f"{min_fraction:.2f} of the users, the defaults "
+                            f"are kept")
+            results[name] = {"algo": algo_class(), "search": None}
+            continue
+        grid_size = int(np.prod([len(values) for values in space.values()]))
+        n_configs = 1
+        while n_configs < grid_size and _search_cost(
+                n_configs + 1, fractions, eta, kfold) <= share:
+            n_configs += 1
+        configs = sample_configs(space, n_configs, seed)
+        search = successive_halving(algo_class, configs, df, kfold=kfold,
+                                    eta=eta, min_fraction=min_fraction,
+                                    n_jobs=n_jobs, seed=seed, **kwargs)
+        search["budget"] = share
+        spent += search["cost"]
+        print(f"{name}: {len(configs)} configs, best "
+              f"{search['best_config']} scored {search['best_score']:.4f} "
+              f"for {search['cost']:.1f} of {share:.1f} fold fits")
+        results[name] = {"algo": algo_class(**search["best_config"]),
+                         "search": search}
+    print(f"search: {spent:.1f} of {budget:.1f} fold fits")
+    return results
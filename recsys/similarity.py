@@ -0,0 +1,116 @@
+"""
+Nearest-neighbour index over item factors for "similar games" queries.
+
+Items are compared by the cosine of their latent factors qi. Small catalogs
+are searched exhaustively; larger ones are bucketed IVF-style: items are
+assigned to k-means centroids and a query only scans the items of the
+n_probe closest buckets.
+
+item_vectors
+ItemIndex
+build_item_index
+"""
+
+import numpy as np
+
+from recsys.scoring import top_k
+
+EXACT_MAX_ITEMS = 20000
+
+
+def item_vectors(factors):
+    """unit-norm item factors, so the dot product is the cosine."""
+    qi = np.asarray(factors["qi"], dtype=np.float64)
+    norm = np.linalg.norm(qi, axis=1, keepdims=True)
+    return qi / np.maximum(norm, 1e-12)
+
+
+def _kmeans(vectors, n_lists, n_iter, rng):
+    centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)]
+    for _ in range(n_iter):
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        for c in range(n_lists):
+            members = vectors[assign == c]
+            if len(members):
+                centroid = members.mean(axis=0)
+                centroids[c] = centroid / max(np.linalg.norm(centroid), 1e-12)
+    return centroids, np.argmax(vectors @ centroids.T, axis=1)
+
+
+class ItemIndex:
+    """cosine nearest neighbours of items, exact or IVF bucketed.
+
+    Parameters
+    ----------
+    vectors : numpy.ndarray
+        unit-norm item vectors, see item_vectors.
+    raw_iids : numpy.ndarray
+        raw item id of each row of vectors.
+    n_lists : int, optional
+        # of IVF buckets, 0 searches exhaustively, defaults to sqrt(# items)
+        for catalogs larger than EXACT_MAX_ITEMS.
+    n_probe : int
+        # of buckets scanned per query.
+    n_iter : int
+        k-means iterations when building the buckets.
+    seed : int
+
+    """
+
+    def __init__(self, vectors, raw_iids, n_lists=None, n_probe=8, n_iter=10,
+                 seed=0):
+        self.vectors = vectors
+        self.raw_iids = raw_iids
+        self.iid_index = {iid: i for i, iid in enumerate(raw_iids)}
+        if n_lists is None:
+            n_lists = int(np.sqrt(len(vectors))) \
+                if len(vectors) > EXACT_MAX_ITEMS else 0
+        self.n_lists = min(n_lists, len(vectors))
+        self.n_probe = n_probe
+        if self.n_lists:
+            rng = np.random.RandomState(seed)
+            self.centroids, assign = _kmeans(vectors, self.n_lists, n_iter,
+                                             rng)
+            order = np.argsort(assign, kind="stable")
+            bounds = np.searchsorted(assign[order],
+                                     np.arange(self.n_lists + 1))
+            self.lists = [order[bounds[c]:bounds[c + 1]]
+                          for c in range(self.n_lists)]
+
+    def __contains__(self, iid):
+        return iid in self.iid_index
+
+    def _candidates(self, query):
+        if not self.n_lists:
+            return None
+        closest = np.argsort(-(self.centroids @ query))[:self.n_probe]
+        return np.concatenate([self.lists[c] for c in closest])
+
+    def similar(self, iid, k=10):
+        """k items closest to iid, most similar first, iid itself excluded.
+
+        Returns
+        -------
+        type: list of tuple
+            (raw iid, cosine similarity)
+
+        """
+        i = self.iid_index[iid]
+        query = self.vectors[i]
+        candidates = self._candidates(query)
+        if candidates is None:
+            scores = self.vectors @ query
+            candidates = np.arange(len(scores))
+        else:
+            scores = self.vectors[candidates] @ query
+        scores[candidates == i] = -np.inf
+        idx, top_scores = top_k(scores[None, :], k)
+        keep = idx[0] >= 0
+        return [(self.raw_iids[j], float(score))
+                for j, score in zip(candidates[idx[0][keep]],
+                                    top_scores[0][keep])]
+
+
+def build_item_index(factors, **kwargs):
+    """ItemIndex over the item factors of a model, see recsys.scoring."""
+    return ItemIndex(item_vectors(factors), factors["raw_iids"], **kwargs)
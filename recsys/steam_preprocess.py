@@ -1,32 +1,153 @@
-import pickle
+import argparse
+import os
+import time
 import pandas as pd
-from os.path import abspath, dirname, join
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from os.path import abspath, basename, dirname, join, getsize
 import ast
 
+from recsys.artifacts import save_table, save_encoders
+from recsys.encoding import IdEncoder, memory_mb
+from recsys.profiling import (
+    MEMORY_MODES, peak_rss_mb, profiler, track_peak_rss)
+
 DATA_DIR = join(dirname(dirname(abspath((__file__)))),
                 "data")
 GAME_FILE = join(DATA_DIR, "steam_games.json")
 AU_REVIEW_FILE = join(DATA_DIR, "australian_user_reviews.json")
 AU_ITEM_FILE = join(DATA_DIR, "australian_users_items.json")
-PKL_FILE1 = join(DATA_DIR, "filtered_explicit_data.pkl")
-PKL_FILE2 = join(DATA_DIR, "implicit_data.pkl")
-PKL_FILE3 = join(DATA_DIR, "details.pkl")
-PKL_FILE4 = join(DATA_DIR, "review_text.pkl")
-PKL_FILE5 = join(DATA_DIR, "dashboard_item_summary.pkl")
-PKL_FILE6 = join(DATA_DIR, "dashboard_user_summary.pkl")
-
-
-def load_data(file):
-    data = []
-    for line in open(file, "r"):
-        data.append(ast.literal_eval(line))
-    return data
+TABLE_FILE1 = join(DATA_DIR, "filtered_explicit_data.parquet")
+TABLE_FILE2 = join(DATA_DIR, "implicit_data.parquet")
+TABLE_FILE3 = join(DATA_DIR, "details.parquet")
+TABLE_FILE4 = join(DATA_DIR, "review_text.parquet")
+TABLE_FILE5 = join(DATA_DIR, "dashboard_item_summary.parquet")
+TABLE_FILE6 = join(DATA_DIR, "dashboard_user_summary.parquet")
+
+
+def _parse_lines(lines):
+    return [ast.literal_eval(line) for line in lines]
+
+
+def _parse_chunk(lines):
+    # in a pool worker: the records, and the worker's peak so far, which
+    # covers this file only since every file gets a new pool
+    return _parse_lines(lines), os.getpid(), peak_rss_mb()
+
+
+def _iter_parsed(file, chunksize, n_jobs):
+    # chunks of records with the pid and peak memory of the worker that
+    # parsed them, None without a pool
+    with open(file, "r") as f:
+        chunks = iter(lambda: list(islice(f, chunksize)), [])
+        if n_jobs == 1:
+            for lines in chunks:
+                yield _parse_lines(lines), None, None
+            return
+
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            pending = deque()
+            for lines in chunks:
+                pending.append(executor.submit(_parse_chunk, lines))
+                if len(pending) >= 2 * n_jobs:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+
+def iter_chunks(file, chunksize=10000, n_jobs=1):
+    """parse a file of one python literal per line, chunk by chunk.
+
+    Chunks are parsed by a pool of n_jobs processes, at most 2 * n_jobs
+    chunks are in flight, so the file is never held in memory at once.
+
+    Parameters
+    ----------
+    file : str
+        path of the raw UCSD json file.
+    chunksize : int
+        # of lines per chunk.
+    n_jobs : int
+        # of parser processes, 1 parses in the calling process.
+
+    Yields
+    ------
+    type: list
+        parsed records of one chunk, in file order.
+
+    """
+    for records, _, _ in _iter_parsed(file, chunksize, n_jobs):
+        yield records
+
+
+def stream_data(file, chunksize=10000, n_jobs=1, stats=None):
+    """yield parsed records one at a time, see iter_chunks.
+
+    Parameters
+    ----------
+    stats : dict, optional
+        filled with records, mb, seconds, records_per_s, mb_per_s,
+        peak_rss_mb and worker_peak_rss_mb once the file is exhausted.
+        seconds is the time spent reading and parsing, not consuming the
+        records. peak_rss_mb is the peak resident memory of this process
+        while the file was streamed, records kept by the consumer included
+        (since the process started where the peak cannot be reset);
+        worker_peak_rss_mb sums the peaks of the parser processes, pages
+        shared with this process included, 0 without a pool.
+
+    """
+    worker_peaks = {}
+    seconds = 0.
+    n_records = 0
+    chunks = _iter_parsed(file, chunksize, n_jobs)
+    with track_peak_rss() as memory:
+        while True:
+            # with a pool the wait for the next chunk is the parse the
+            # consumer did not overlap
+            start = time.perf_counter()
+            chunk = next(chunks, None)
+            seconds += time.perf_counter() - start
+            if chunk is None:
+                break
+            records, pid, peak = chunk
+            if pid is not None:
+                worker_peaks[pid] = max(worker_peaks.get(pid, 0.), peak)
+            n_records += len(records)
+            yield from records
+
+    if stats is not None:
+        mb = getsize(file) / 1024 ** 2
+        stats.update({"records": n_records,
+                      "mb": round(mb, 2),
+                      "seconds": round(seconds, 2),
+                      "records_per_s": round(n_records / seconds, 1)
+                      if seconds > 0 else 0.,
+                      "mb_per_s": round(mb / seconds, 2)
+                      if seconds > 0 else 0.,
+                      "peak_rss_mb": round(memory["peak_rss_mb"], 1),
+                      "worker_peak_rss_mb": round(
+                          sum(worker_peaks.values(), 0.), 1)})
+
+
+def load_data(file, n_jobs=1):
+    with profiler.stage(f"load_data {basename(file)}"):
+        return list(stream_data(file, n_jobs=n_jobs))
+
+
+def print_load_stats(load_stats):
+    for file, stats in load_stats.items():
+        print(f"loaded {file}: {stats['records']} records, "
+              f"{stats['mb']} MB in {stats['seconds']} s "
+              f"({stats['records_per_s']} records/s, "
+              f"{stats['mb_per_s']} MB/s), "
+              f"peak rss {stats['peak_rss_mb']} MB, "
+              f"workers {stats['worker_peak_rss_mb']} MB")
 
 
 def save_data(data, file):
-    outfile = open(file, "wb")
-    pickle.dump(data, outfile)
-    outfile.close()
+    with profiler.stage(f"save_data {basename(file)}", rows=len(data)):
+        save_table(data, file)
 
 
 def get_review_ls(review_info):
@@ -139,6 +260,27 @@ def get_filtered_explicit_ls(data, min=5):
     return data_after_filter
 
 
+def encode_ids(data_after_filter):
+    """replace user and item ids by int32 codes, shared by every stage.
+
+    Returns
+    -------
+    type: turple
+        encoded DataFrame (user_id, item_id, recommend), dict of user and
+        item IdEncoder.
+
+    """
+    encoders = {"user": IdEncoder.fit(data_after_filter["user_id"]),
+                "item": IdEncoder.fit(data_after_filter["item_id"])}
+    df_encoded = pd.DataFrame({
+        "user_id": encoders["user"].encode(data_after_filter["user_id"]),
+        "item_id": encoders["item"].encode(data_after_filter["item_id"]),
+        "recommend": data_after_filter["recommend"].values})
+    print(f"explicit data: {memory_mb(data_after_filter):.1f} MB with "
+          f"string ids, {memory_mb(df_encoded):.1f} MB with int32 codes")
+    return df_encoded, encoders
+
+
 def get_related_game_info(game_info, data_after_filter):
     df_game = pd.DataFrame(game_info)
     remain_col = ['id', 'app_name', 'publisher', 'developer', 'genres',
@@ -150,38 +292,78 @@ def get_related_game_info(game_info, data_after_filter):
 
 
 def main():
-    game_info = load_data(GAME_FILE)
-    au_review_info = load_data(AU_REVIEW_FILE)
-    au_item_info = load_data(AU_ITEM_FILE)
-
-    df_review = get_review_ls(au_review_info)
-    df_review_user = review_by_user_summary(df_review)
-    df_review_item = review_by_item_summary(df_review)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_dir", default=DATA_DIR, type=str,
+                        help="directory of the UCSD files, e.g. written by "
+                             "recsys.synthetic, tables are saved next to them")
+    parser.add_argument("--profile", nargs="?", const="rss", default=None,
+                        choices=MEMORY_MODES,
+                        help="report time and memory of every stage, see "
+                             "recsys.profiling")
+    args = parser.parse_args()
+    data_dir = args.data_dir
+    if args.profile:
+        profiler.enable(args.profile)
+    (game_file, au_review_file, au_item_file, table_file1, table_file2,
+     table_file3, table_file4, table_file5, table_file6) = [
+        join(data_dir, basename(file)) for file in (
+            GAME_FILE, AU_REVIEW_FILE, AU_ITEM_FILE, TABLE_FILE1, TABLE_FILE2,
+            TABLE_FILE3, TABLE_FILE4, TABLE_FILE5, TABLE_FILE6)]
+
+    n_jobs = os.cpu_count()
+    load_stats = {game_file: {}, au_review_file: {}, au_item_file: {}}
+    # games are read twice below, reviews and user items are streamed
+    with profiler.stage(f"load_data {basename(game_file)}"):
+        game_info = list(stream_data(game_file, n_jobs=n_jobs,
+                                     stats=load_stats[game_file]))
+    au_review_info = stream_data(au_review_file, n_jobs=n_jobs,
+                                 stats=load_stats[au_review_file])
+    au_item_info = stream_data(au_item_file, n_jobs=n_jobs,
+                               stats=load_stats[au_item_file])
+
+    # streamed files are read inside the stage consuming them
+    with profiler.stage("get_review_ls", streams=basename(au_review_file)):
+        df_review = get_review_ls(au_review_info)
+    with profiler.stage("review summaries"):
+        df_review_user = review_by_user_summary(df_review)
+        df_review_item = review_by_item_summary(df_review)
 
     # for dashboard
-    df_user_overall, df_user_items = get_user_items_detail(
-        au_item_info, df_review_user)
-    df_review_item_overall = get_item_detail(df_review_item, game_info)
+    with profiler.stage("get_user_items_detail",
+                        streams=basename(au_item_file)):
+        df_user_overall, df_user_items = get_user_items_detail(
+            au_item_info, df_review_user)
+    print_load_stats(load_stats)
+    with profiler.stage("get_item_detail"):
+        df_review_item_overall = get_item_detail(df_review_item, game_info)
 
     # for recommender system
-    df_review_explicit = get_explicit_ls(df_review)
-    df_review_implitic = get_implicit_ls(df_user_items)
+    with profiler.stage("get_explicit_ls"):
+        df_review_explicit = get_explicit_ls(df_review)
+        df_review_implitic = get_implicit_ls(df_user_items)
+
+    with profiler.stage("get_filtered_explicit_ls"):
+        data_after_filter = get_filtered_explicit_ls(df_review_explicit)
+        df_related_game_info = get_related_game_info(game_info,
+                                                     data_after_filter)
 
-    data_after_filter = get_filtered_explicit_ls(df_review_explicit)
-    df_related_game_info = get_related_game_info(game_info, data_after_filter)
+    with profiler.stage("encode_ids"):
+        df_encoded, encoders = encode_ids(data_after_filter)
 
     print("now save df_review_explicit")
-    save_data(data_after_filter, PKL_FILE1)
+    save_data(df_encoded, table_file1)
+    save_encoders(encoders, data_dir)
     print("now save df_review_implitic")
-    save_data(df_review_implitic, PKL_FILE2)
+    save_data(df_review_implitic, table_file2)
     print("now save df_related_game_info")
-    save_data(df_related_game_info, PKL_FILE3)
+    save_data(df_related_game_info, table_file3)
     print("now save df_review")
-    save_data(df_review, PKL_FILE4)
+    save_data(df_review, table_file4)
     print("now save df_review_item_overall and df_user_overall")
-    save_data(df_review_item_overall, PKL_FILE5)
-    save_data(df_user_overall, PKL_FILE6)
+    save_data(df_review_item_overall, table_file5)
+    save_data(df_user_overall, table_file6)
     print("Finish")
+    profiler.write_report(join(data_dir, "profile_preprocess"))
 
 
 if __name__ == "__main__":
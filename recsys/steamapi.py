@@ -1,58 +1,136 @@
-import requests
-import json
 import pandas as pd
+from functools import partial
 from os.path import abspath, dirname, join
 
+from recsys.crawler import (
+    TokenBucket, ResponseCache, make_session, fetch_json, crawl, read_jsonl)
+
 
 DATA_DIR = join(dirname(dirname(abspath((__file__)))),
                 "data")
 APP_GENERAL_FILE = join(DATA_DIR, "app_review_general_part1.csv")
 APP_DETAIL_FILE = join(DATA_DIR, "app_review_details_part1.csv")
+APP_REVIEW_STREAM = join(DATA_DIR, "app_review_part1.jsonl")
+APP_REVIEW_CACHE = join(DATA_DIR, "cache", "appreviews")
+MAX_AGE = 7 * 24 * 3600
+API_URL = "https://api.steampowered.com"
+STORE_URL = "https://store.steampowered.com"
 
 
-def get_applist():
-    url = "https://api.steampowered.com/ISteamApps/GetAppList/v2"
-    r = requests.get(url)
-    data = r.json()
+def get_applist(session=None, base_url=API_URL):
+    session = session or make_session()
+    data = fetch_json(session, f"{base_url}/ISteamApps/GetAppList/v2")
     applist = data["applist"]["apps"]
     app_dict = {app["appid"]: [app["name"]] for app in applist}
     return app_dict
 
 
-def get_appreview():
-    app_dict = get_applist()
-    app_ls = list(app_dict.keys())[:500]
-    app_review_detail = []
-    counter = 0
-    total = len(app_ls)
-    for appid in app_ls:
-        counter += 1
-        left = total - counter
-        print(f"This is #{counter}, remaining app #{left}")
-        print(f"start app {appid}")
-        url = f"https://store.steampowered.com/appreviews/{appid}?json=1"
-        r = requests.get(url)
-        data = r.json()
-        if "query_summary" and "reviews" in data.keys():
-            if len(data["query_summary"]) != 0 and len(data["reviews"]) != 0:
-                #'num_reviews', 'review_score', 'review_score_desc',
-                #'total_positive', 'total_negative', 'total_reviews'
-                app_dict[appid].extend(data["query_summary"].values())
-                reviews = data["reviews"]
-                for i in reviews:
-                    author = i["author"]
-                    author["appid"] = appid
-                    author["voted_up"] = i["voted_up"]  # most important info
-                    author["votes_up"] = i["votes_up"]
-                    author["comment_count"] = i["comment_count"]
-                    author["weighted_vote_score"] = i["weighted_vote_score"]
-                    author["review"] = i["review"]
-                    author["steam_purchase"] = i["steam_purchase"]
-                    author["received_for_free"] = i["received_for_free"]
-                    author["written_during_early_access"] = i["written_during_early_access"]
-                    app_review_detail.append(author)
-        print(f"finish app {appid}")
-    return app_dict, app_review_detail
+def download_appreview(appid, session, bucket, base_url=STORE_URL,
+                       max_pages=None):
+    """every page of an app's reviews, following the appreviews cursor.
+
+    filter=recent is the ordering Steam documents for paging with cursor,
+    paging stops at an empty page, a repeated cursor or max_pages.
+
+    Returns
+    -------
+    type: list
+        raw json response of each page.
+
+    """
+    pages = []
+    cursor = "*"
+    while max_pages is None or len(pages) < max_pages:
+        params = {"json": 1, "filter": "recent", "language": "all",
+                  "purchase_type": "all", "num_per_page": 100,
+                  "cursor": cursor}
+        data = fetch_json(session, f"{base_url}/appreviews/{appid}", bucket,
+                          params=params)
+        pages.append(data)
+        if len(data.get("reviews", [])) == 0 or \
+                data.get("cursor") in (None, cursor):
+            break
+        cursor = data["cursor"]
+    return pages
+
+
+def parse_appreview(appid, pages):
+    """reviews of one app as a record, None when the app has none."""
+    data = pages[0]
+    if "query_summary" in data.keys() and "reviews" in data.keys():
+        if len(data["query_summary"]) != 0 and len(data["reviews"]) != 0:
+            #'num_reviews', 'review_score', 'review_score_desc',
+            #'total_positive', 'total_negative', 'total_reviews'
+            reviews = {}
+            for page in pages:
+                for review in page.get("reviews", []):
+                    reviews.setdefault(review.get("recommendationid"), review)
+            return {"appid": appid,
+                    "query_summary": data["query_summary"],
+                    "reviews": list(reviews.values())}
+    return None
+
+
+def fetch_appreview(appid, session, bucket, base_url=STORE_URL, cache=None,
+                    max_pages=None):
+    """reviews of one app, served from cache when it is still fresh."""
+    download = partial(download_appreview, session=session, bucket=bucket,
+                       base_url=base_url, max_pages=max_pages)
+    pages = cache.fetch(appid, download) if cache else download(appid)
+    return parse_appreview(appid, pages)
+
+
+def get_appreview(app_dict=None, out_file=APP_REVIEW_STREAM, limit=500,
+                  concurrency=8, rate=10, base_url=STORE_URL,
+                  cache_dir=APP_REVIEW_CACHE, max_age=MAX_AGE,
+                  max_pages=None):
+    """crawl reviews of the first limit apps into a JSON lines file.
+
+    Raw responses are cached per appid in cache_dir, a rerun only fetches
+    apps that are new or older than max_age and rebuilds out_file from the
+    cache.
+
+    Parameters
+    ----------
+    app_dict : dict, optional
+        appid to [name], fetched with get_applist when missing.
+    out_file : str
+        JSON lines file the records are streamed to.
+    limit : int
+        # of apps to crawl, None crawls the whole catalog.
+    concurrency : int
+        # of requests in flight.
+    rate : float
+        requests per second.
+    base_url : str
+        store url, point it at a local stub server for testing.
+    cache_dir : str, optional
+        response cache directory, None disables the cache.
+    max_age : float, optional
+        seconds before a cached app is refreshed, None never refreshes.
+    max_pages : int, optional
+        # of review pages fetched per app, None follows the cursor to the
+        end.
+
+    Returns
+    -------
+    type: dict
+        crawl stats, see recsys.crawler.crawl, plus cache hits, misses and
+        stale refreshes.
+
+    """
+    session = make_session(concurrency)
+    app_dict = app_dict if app_dict is not None else get_applist(session)
+    app_ls = list(app_dict.keys())[:limit]
+    cache = ResponseCache(cache_dir, max_age) if cache_dir else None
+    fetch = partial(fetch_appreview, session=session,
+                    bucket=TokenBucket(rate), base_url=base_url, cache=cache,
+                    max_pages=max_pages)
+    stats = crawl(app_ls, fetch, out_file, concurrency)
+    if cache:
+        stats.update(cache.stats())
+    print(f"crawled {len(app_ls)} apps: {stats}")
+    return stats
 
 
 def get_dict_param_name():
@@ -61,8 +139,32 @@ def get_dict_param_name():
     return dict_param_name
 
 
-def to_df():
-    app_dict, app_review_detail = get_appreview()
+def get_review_records(app_dict, records):
+    """add review summaries to app_dict and flatten reviews per author."""
+    app_review_detail = []
+    for record in records:
+        appid = record["appid"]
+        app_dict[appid].extend(record["query_summary"].values())
+        for i in record["reviews"]:
+            author = i["author"]
+            author["appid"] = appid
+            author["voted_up"] = i["voted_up"]  # most important info
+            author["votes_up"] = i["votes_up"]
+            author["comment_count"] = i["comment_count"]
+            author["weighted_vote_score"] = i["weighted_vote_score"]
+            author["review"] = i["review"]
+            author["steam_purchase"] = i["steam_purchase"]
+            author["received_for_free"] = i["received_for_free"]
+            author["written_during_early_access"] = i["written_during_early_access"]
+            app_review_detail.append(author)
+    return app_dict, app_review_detail
+
+
+def to_df(out_file=APP_REVIEW_STREAM):
+    app_dict = get_applist()
+    get_appreview(app_dict, out_file)
+    app_dict, app_review_detail = get_review_records(
+        app_dict, read_jsonl(out_file))
     dict_param_name = get_dict_param_name()
     df_app_review_detail = pd.DataFrame(app_review_detail)
     df_app_dict = pd.DataFrame(app_dict, index=dict_param_name).T
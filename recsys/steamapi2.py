@@ -1,65 +1,98 @@
-import requests
 import pandas as pd
+from functools import partial
 from os.path import abspath, dirname, join
 
+from recsys.crawler import (
+    TokenBucket, ResponseCache, make_session, fetch_json, crawl, read_jsonl)
+from recsys.steamapi import get_applist, STORE_URL, MAX_AGE
+
 
 DATA_DIR = join(dirname(dirname(abspath((__file__)))),
                 "data")
 APP_INFO_FILE = join(DATA_DIR, "app_info_details.csv")
-
-
-def get_applist():
-    url = "https://api.steampowered.com/ISteamApps/GetAppList/v2"
-    r = requests.get(url)
-    data = r.json()
-    applist = data["applist"]["apps"]
-    app_dict = {app["appid"]: [app["name"]] for app in applist}
-    return app_dict
-
-
-def get_appinfo():
-    app_dict = get_applist()
+APP_INFO_STREAM = join(DATA_DIR, "app_info_details.jsonl")
+APP_INFO_CACHE = join(DATA_DIR, "cache", "appdetails")
+INFO_LS = ['type', 'name', 'steam_appid', 'required_age', 'is_free',
+           'detailed_description',
+           'fullgame', 'header_image',
+           'website', 'developers',
+           'publishers', 'platforms',
+           'categories', 'genres',
+           'release_date']
+
+
+def download_appinfo(appid, session, bucket, base_url=STORE_URL):
+    return fetch_json(session, f"{base_url}/api/appdetails?appids={appid}",
+                      bucket)
+
+
+def parse_appinfo(appid, data):
+    """store details of one app as a record, None when there are none."""
+    if data is not None:
+        data = list(data.values())[0]
+        if "data" in data.keys():
+            data = data["data"]
+            return {i: data[i] for i in INFO_LS if i in data.keys()}
+    return None
+
+
+def fetch_appinfo(appid, session, bucket, base_url=STORE_URL, cache=None):
+    """store details of one app, served from cache when it is still fresh."""
+    download = partial(download_appinfo, session=session, bucket=bucket,
+                       base_url=base_url)
+    data = cache.fetch(appid, download) if cache else download(appid)
+    return parse_appinfo(appid, data)
+
+
+def get_appinfo(app_dict=None, out_file=APP_INFO_STREAM, concurrency=8,
+                rate=10, base_url=STORE_URL, cache_dir=APP_INFO_CACHE,
+                max_age=MAX_AGE):
+    """crawl store details of every app into a JSON lines file.
+
+    Raw responses are cached per appid in cache_dir, a rerun only fetches
+    apps that are new or older than max_age and rebuilds out_file from the
+    cache.
+
+    Parameters
+    ----------
+    app_dict : dict, optional
+        appid to [name], fetched with get_applist when missing.
+    out_file : str
+        JSON lines file the records are streamed to.
+    concurrency : int
+        # of requests in flight.
+    rate : float
+        requests per second.
+    base_url : str
+        store url, point it at a local stub server for testing.
+    cache_dir : str, optional
+        response cache directory, None disables the cache.
+    max_age : float, optional
+        seconds before a cached app is refreshed, None never refreshes.
+
+    Returns
+    -------
+    type: dict
+        crawl stats, see recsys.crawler.crawl, plus cache hits, misses and
+        stale refreshes.
+
+    """
+    session = make_session(concurrency)
+    app_dict = app_dict if app_dict is not None else get_applist(session)
     app_ls = list(app_dict.keys())
-    app_info_detail = []
-    counter = 0
-    total = len(app_ls)
-    info_ls = ['type', 'name', 'steam_appid', 'required_age', 'is_free',
-               'detailed_description',
-               'fullgame', 'header_image',
-               'website', 'developers',
-               'publishers', 'platforms',
-               'categories', 'genres',
-               'release_date']
-
-    for appid in app_ls:
-        counter += 1
-        left = total - counter
-        print(f"This is #{counter}, remaining app #{left}")
-        print(f"start app {appid}")
-        url = f"https://store.steampowered.com/api/appdetails?appids={appid}"
-        r = requests.get(url)
-        data = r.json()
-        if data is not None:
-            data = list(data.values())[0]
-            if "data" in data.keys():
-                data = data["data"]
-                remove_ls = []
-                for i in info_ls:
-                    if i not in data.keys():
-                        remove_ls.append(i)
-
-                info_ls_temp = info_ls.copy()
-                for i in remove_ls:
-                    info_ls_temp.remove(i)
-                info = {i: data[i] for i in info_ls_temp}
-                app_info_detail.append(info)
-                print(f"finish app {appid}")
-    return app_info_detail
-
-
-def to_df():
-    app_info_detail = get_appinfo()
-    df_app_info = pd.DataFrame(app_info_detail)
+    cache = ResponseCache(cache_dir, max_age) if cache_dir else None
+    fetch = partial(fetch_appinfo, session=session, bucket=TokenBucket(rate),
+                    base_url=base_url, cache=cache)
+    stats = crawl(app_ls, fetch, out_file, concurrency)
+    if cache:
+        stats.update(cache.stats())
+    print(f"crawled {len(app_ls)} apps: {stats}")
+    return stats
+
+
+def to_df(out_file=APP_INFO_STREAM):
+    get_appinfo(out_file=out_file)
+    df_app_info = pd.DataFrame(list(read_jsonl(out_file)))
     return df_app_info
 
 
@@ -0,0 +1,272 @@
+"""
+Synthetic Steam datasets in the line format of the UCSD files.
+
+Writes steam_games.json, australian_user_reviews.json and
+australian_users_items.json with one python literal per line, the format
+steam_preprocess.load_data parses, at any number of users and items. Games
+are popular along a power law and users own a power-law number of games, a
+fraction of which they review. Users are generated and written one chunk at
+a time, so the files can be larger than memory, and the same seed always
+writes the same files.
+
+usage example:
+
+python synthetic.py --directory ../data/synthetic --n_users 1000000 --n_items 50000
+python steam_preprocess.py --data_dir ../data/synthetic
+
+GENRES
+SyntheticSteam
+generate
+main
+"""
+
+import argparse
+import time
+from os import makedirs
+from os.path import abspath, dirname, join, getsize
+
+import numpy as np
+
+DATA_DIR = join(dirname(dirname(abspath((__file__)))), "data")
+SYNTHETIC_DIR = join(DATA_DIR, "synthetic")
+GAME_FILE = "steam_games.json"
+REVIEW_FILE = "australian_user_reviews.json"
+ITEM_FILE = "australian_users_items.json"
+
+GENRES = ["Action", "Adventure", "Casual", "Free to Play", "Indie",
+          "Massively Multiplayer", "RPG", "Racing", "Simulation", "Sports",
+          "Strategy", "Early Access"]
+REVIEW_TEXT = {True: ["great game", "10/10 would play again",
+                      "worth every penny", "fun with friends"],
+               False: ["refunded", "too many bugs", "not worth the price",
+                       "crashes on start"]}
+# first 64 bit steam id of an individual account
+STEAM_ID_BASE = 76561197960265728
+
+
+class SyntheticSteam:
+    """power-law model of games, ownership and reviews.
+
+    Parameters
+    ----------
+    n_users : int
+    n_items : int
+        # of games in the catalog.
+    popularity_exponent : float
+        zipf exponent of game popularity, larger concentrates ownership on
+        fewer games.
+    activity_exponent : float
+        pareto exponent of the # of games a user owns, smaller gives heavier
+        users.
+    min_items : int
+        # of games the lightest users own.
+    review_rate : float
+        mean fraction of owned games a user reviews.
+    recommend_ratio : float
+        mean fraction of reviews that recommend the game.
+    vanity_ratio : float
+        fraction of users known by a vanity name instead of a steam id.
+    seed : int
+
+    """
+
+    def __init__(self, n_users, n_items, popularity_exponent=1.0,
+                 activity_exponent=1.2, min_items=10, review_rate=0.05,
+                 recommend_ratio=0.88, vanity_ratio=0.3, seed=0):
+        self.n_users = n_users
+        self.n_items = n_items
+        self.activity_exponent = activity_exponent
+        self.min_items = min(min_items, n_items)
+        self.review_rate = review_rate
+        self.vanity_ratio = vanity_ratio
+        self.seed = seed
+
+        rng = np.random.RandomState(seed)
+        self.item_ids = (10 + 10 * rng.permutation(n_items)).astype(
+            str).tolist()
+        # popularity rank is independent of the appid
+        weights = 1. / np.arange(1, n_items + 1) ** popularity_exponent
+        self.cdf = np.cumsum(weights[rng.permutation(n_items)])
+        self.cdf /= self.cdf[-1]
+        # games lean towards being recommended or not
+        logit = np.log(recommend_ratio / (1. - recommend_ratio))
+        self.recommend_p = 1. / (1. + np.exp(-(logit + rng.normal(
+            0., 1., n_items))))
+
+    def item_name(self, i):
+        return f"Game {i}"
+
+    def games(self):
+        """one steam_games.json record per game."""
+        rng = np.random.RandomState(self.seed + 1)
+        n_publishers = max(1, self.n_items // 20)
+        for i, iid in enumerate(self.item_ids):
+            publisher = f"Publisher {rng.zipf(1.5) % n_publishers}"
+            developer = f"Developer {rng.zipf(1.5) % (2 * n_publishers)}"
+            genres = sorted(rng.choice(GENRES, rng.randint(1, 4),
+                                       replace=False).tolist())
+            free = rng.rand() < 0.1
+            release = (f"{rng.randint(2000, 2018)}-{rng.randint(1, 13):02d}-"
+                       f"{rng.randint(1, 29):02d}")
+            yield {"publisher": publisher,
+                   "genres": genres,
+                   "app_name": self.item_name(i),
+                   "title": self.item_name(i),
+                   "url": f"http://store.steampowered.com/app/{iid}/",
+                   "release_date": release,
+                   "tags": genres,
+                   "reviews_url": f"http://steamcommunity.com/app/{iid}/"
+                                  "reviews/?browsefilter=mostrecent&p=1",
+                   "specs": ["Single-player"],
+                   "price": "Free To Play" if free else round(
+                       float(rng.choice([0.99, 4.99, 9.99, 14.99, 19.99,
+                                         29.99, 59.99])), 2),
+                   "early_access": bool(rng.rand() < 0.05),
+                   "id": iid,
+                   "developer": developer}
+
+    def _user_id(self, u, rng):
+        if rng.rand() < self.vanity_ratio:
+            return f"player{u}"
+        return str(STEAM_ID_BASE + u)
+
+    def _owned(self, rng):
+        n_owned = int(self.min_items * (1. - rng.rand()) ** (
+            -1. / self.activity_exponent))
+        n_owned = min(n_owned, self.n_items)
+        # draw by popularity, keep the first n_owned distinct games
+        draws = np.searchsorted(self.cdf, rng.rand(2 * n_owned + 10))
+        _, first = np.unique(draws, return_index=True)
+        return draws[np.sort(first)][:n_owned]
+
+    def users(self, start, stop):
+        """review and item records of users start .. stop - 1.
+
+        Each user is generated from its own seed, so a chunk is the same
+        whatever chunksize it was written with.
+
+        Yields
+        ------
+        type: tuple
+            australian_user_reviews.json record or None when the user wrote
+            no review, australian_users_items.json record.
+
+        """
+        for u in range(start, stop):
+            rng = np.random.RandomState([self.seed, u])
+            uid = self._user_id(u, rng)
+            url = (f"http://steamcommunity.com/id/{uid}" if uid.startswith(
+                "player") else f"http://steamcommunity.com/profiles/{uid}")
+            owned = self._owned(rng)
+            # lognormal minutes, a third of the library is never started
+            playtime = (rng.lognormal(6., 2., len(owned))
+                        * (rng.rand(len(owned)) > 0.3)).astype(int)
+            playtime_2weeks = np.where(rng.rand(len(owned)) < 0.05,
+                                       np.minimum(playtime, 1200), 0)
+            items = [{"item_id": self.item_ids[i],
+                      "item_name": self.item_name(i),
+                      "playtime_forever": int(p),
+                      "playtime_2weeks": int(p2)}
+                     for i, p, p2 in zip(owned, playtime, playtime_2weeks)]
+            item_record = {"user_id": uid, "items_count": len(items),
+                           "steam_id": str(STEAM_ID_BASE + u),
+                           "user_url": url, "items": items}
+
+            n_reviews = rng.binomial(len(owned), self.review_rate)
+            reviews = []
+            for i in owned[rng.permutation(len(owned))[:n_reviews]]:
+                recommend = bool(rng.rand() < self.recommend_p[i])
+                texts = REVIEW_TEXT[recommend]
+                reviews.append({"funny": "",
+                                "posted": f"Posted June {rng.randint(1, 29)}"
+                                          ", 2015.",
+                                "last_edited": "",
+                                "item_id": self.item_ids[i],
+                                "helpful": "No ratings yet",
+                                "recommend": recommend,
+                                "review": texts[rng.randint(len(texts))]})
+            review_record = {"user_id": uid, "user_url": url,
+                             "reviews": reviews} if reviews else None
+            yield review_record, item_record
+
+
+def _write_lines(f, records):
+    f.write("".join(repr(record) + "\n" for record in records))
+
+
+def generate(directory, n_users, n_items, chunksize=10000, **kwargs):
+    """write the three UCSD files of a synthetic dataset into directory.
+
+    Parameters
+    ----------
+    directory : str
+    n_users : int
+    n_items : int
+    chunksize : int
+        # of users generated before they are written.
+    **kwargs
+        popularity, activity and review settings, see SyntheticSteam.
+
+    Returns
+    -------
+    type: dict
+        keys: games, users, reviews, items (# of records or rows), mb,
+        seconds.
+
+    """
+    start = time.time()
+    makedirs(directory, exist_ok=True)
+    steam = SyntheticSteam(n_users, n_items, **kwargs)
+    game_file = join(directory, GAME_FILE)
+    review_file = join(directory, REVIEW_FILE)
+    item_file = join(directory, ITEM_FILE)
+
+    with open(game_file, "w") as f:
+        _write_lines(f, steam.games())
+
+    n_reviews = n_owned = 0
+    with open(review_file, "w") as f_review, open(item_file, "w") as f_item:
+        for chunk_start in range(0, n_users, chunksize):
+            chunk = list(steam.users(chunk_start,
+                                     min(chunk_start + chunksize, n_users)))
+            reviews = [review for review, _ in chunk if review is not None]
+            _write_lines(f_review, reviews)
+            _write_lines(f_item, [items for _, items in chunk])
+            n_reviews += sum(len(review["reviews"]) for review in reviews)
+            n_owned += sum(items["items_count"] for _, items in chunk)
+
+    mb = sum(getsize(file) for file in (game_file, review_file, item_file))
+    return {"games": n_items,
+            "users": n_users,
+            "reviews": n_reviews,
+            "items": n_owned,
+            "mb": round(mb / 1024 ** 2, 2),
+            "seconds": round(time.time() - start, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--directory", default=SYNTHETIC_DIR, type=str,
+                        help="where the three UCSD files are written")
+    parser.add_argument("--n_users", default=100000, type=int)
+    parser.add_argument("--n_items", default=10000, type=int)
+    parser.add_argument("--popularity_exponent", default=1.0, type=float)
+    parser.add_argument("--activity_exponent", default=1.2, type=float)
+    parser.add_argument("--min_items", default=10, type=int)
+    parser.add_argument("--review_rate", default=0.05, type=float)
+    parser.add_argument("--recommend_ratio", default=0.88, type=float)
+    parser.add_argument("--vanity_ratio", default=0.3, type=float,
+                        help="fraction of users known by a vanity name")
+    parser.add_argument("--seed", default=0, type=int)
+    parser.add_argument("--chunksize", default=10000, type=int)
+    args = vars(parser.parse_args())
+
+    stats = generate(**args)
+    print(f"wrote {stats['games']} games, {stats['users']} users, "
+          f"{stats['reviews']} reviews and {stats['items']} owned games "
+          f"({stats['mb']} MB) to {args['directory']} in "
+          f"{stats['seconds']} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Inverted indexes answering case-insensitive substring filters on text
+columns, with the same result as Series.str.contains(pattern, case=False,
+na=False).
+
+Both indexes are built over the distinct values of a column, so duplicated
+publishers or genre lists are matched once. A pattern with regex
+metacharacters is matched with str.contains over the distinct values.
+
+TextIndex
+TokenIndex
+NgramIndex
+"""
+
+import re
+
+import numpy as np
+import pandas as pd
+
+REGEX_META = set(".^$*+?{}[]\\|()")
+
+
+def _is_ascii(text):
+    return all(ord(c) < 128 for c in text)
+
+
+class TextIndex:
+    """distinct values of a column and the rows holding each of them.
+
+    Parameters
+    ----------
+    values : pandas.Series
+        text column, values that are not str never match.
+
+    """
+
+    def __init__(self, values):
+        codes, uniques = pd.factorize(values)
+        self.uniques = pd.Series(uniques, dtype=object)
+        self.values = list(uniques)
+        self.n_rows = len(codes)
+        order = np.argsort(codes, kind="stable")
+        bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+        self.postings = [order[bounds[v]:bounds[v + 1]]
+                         for v in range(len(uniques))]
+        self.text_ids = [v for v, u in enumerate(uniques)
+                         if isinstance(u, str)]
+
+    def _candidates(self, pattern):
+        """ids of distinct values that may contain pattern."""
+        return self.text_ids
+
+    def _is_plain(self, pattern):
+        return not REGEX_META.intersection(pattern)
+
+    def search(self, pattern):
+        """rows whose value contains pattern, ignoring case.
+
+        Returns
+        -------
+        type: numpy.ndarray
+            sorted row positions.
+
+        """
+        if self._is_plain(pattern):
+            regex = re.compile(pattern, flags=re.IGNORECASE)
+            value_ids = [v for v in self._candidates(pattern)
+                         if regex.search(self.values[v])]
+        else:
+            value_ids = np.flatnonzero(self.uniques.str.contains(
+                pattern, case=False, na=False).values)
+        return self._rows(value_ids)
+
+    def _rows(self, value_ids):
+        if len(value_ids) == 0:
+            return np.array([], dtype=np.int64)
+        return np.sort(np.concatenate([self.postings[v] for v in value_ids]))
+
+
+class TokenIndex(TextIndex):
+    """exact token postings of a delimited column, e.g. genre lists.
+
+    A pattern without delimiters can only match inside one token, so the
+    rows containing it are those holding a token that contains it.
+
+    Parameters
+    ----------
+    values : pandas.Series
+    delimiters : str
+        characters separating tokens, by default those of a str(list).
+
+    """
+
+    def __init__(self, values, delimiters="[]'\","):
+        super().__init__(values)
+        self.delimiters = set(delimiters)
+        split = re.compile("[" + re.escape(delimiters) + "]")
+        self.tokens = {}
+        for v in self.text_ids:
+            for token in split.split(self.values[v]):
+                self.tokens.setdefault(token, set()).add(v)
+
+    def _is_plain(self, pattern):
+        return super()._is_plain(pattern) and \
+            not self.delimiters.intersection(pattern)
+
+    def search(self, pattern):
+        if not self._is_plain(pattern):
+            return super().search(pattern)
+        regex = re.compile(pattern, flags=re.IGNORECASE)
+        value_ids = set()
+        for token, ids in self.tokens.items():
+            if regex.search(token):
+                value_ids.update(ids)
+        return self._rows(list(value_ids))
+
+
+class NgramIndex(TextIndex):
+    """n-gram postings of lower-cased values for substring search.
+
+    Every n-gram of the pattern has to occur in a matching value, so the
+    intersection of their postings are the candidates, each confirmed with
+    a regex search. Non-ASCII values are always candidates, their case
+    folding does not reduce to str.lower.
+
+    Parameters
+    ----------
+    values : pandas.Series
+    n : int
+        n-gram length, shorter patterns check every distinct value.
+
+    """
+
+    def __init__(self, values, n=3):
+        super().__init__(values)
+        self.n = n
+        postings = {}
+        self.non_ascii = []
+        for v in self.text_ids:
+            text = self.values[v]
+            if not _is_ascii(text):
+                self.non_ascii.append(v)
+                continue
+            text = text.lower()
+            for gram in {text[i:i + n] for i in range(len(text) - n + 1)}:
+                postings.setdefault(gram, []).append(v)
+        self.grams = {gram: np.array(ids) for gram, ids in postings.items()}
+
+    def _candidates(self, pattern):
+        if len(pattern) < self.n or not _is_ascii(pattern):
+            return self.text_ids
+        pattern = pattern.lower()
+        candidates = None
+        for i in range(len(pattern) - self.n + 1):
+            ids = self.grams.get(pattern[i:i + self.n])
+            if ids is None:
+                candidates = np.array([], dtype=np.int64)
+                break
+            candidates = ids if candidates is None else np.intersect1d(
+                candidates, ids, assume_unique=True)
+        return list(candidates) + self.non_ascii
@@ -0,0 +1,167 @@
+"""
+Compact per-user top-K recommendation lists.
+
+Instead of every training-pair Prediction, serving only needs each user's K
+best items. They are kept as one n_users x K block of item positions, int16
+when the catalog allows it, each row sorted by score and padded with -1.
+Scores are optional, serving only needs the order.
+
+MAX_N
+TopK
+build_top_k
+"""
+
+import numpy as np
+import pandas as pd
+
+from recsys.evaluate import get_top_n
+from recsys.scoring import is_factor_model, get_factors, batch_recommend
+
+MAX_N = 50
+
+
+def _objects(values):
+    # 1-d object array even of tuple ids
+    array = np.empty(len(values), dtype=object)
+    array[:] = values.tolist() if isinstance(values, np.ndarray) \
+        else list(values)
+    return array
+
+
+def _position_dtype(n_items):
+    return np.int16 if n_items <= np.iinfo(np.int16).max else np.int32
+
+
+class TopK:
+    """top-K items, and optionally their scores, of every user.
+
+    Parameters
+    ----------
+    users : numpy.ndarray
+        model user id of each row.
+    items : numpy.ndarray
+        n_users x K positions into item_ids, each row sorted by score and
+        padded with -1.
+    item_ids : numpy.ndarray
+        model item id of each item position.
+    scores : numpy.ndarray, optional
+        n_users x K float32 estimated ratings, NaN padded, None when only
+        the order was kept.
+
+    """
+
+    def __init__(self, users, items, item_ids, scores=None):
+        self.users = users
+        self.items = items
+        self.item_ids = item_ids
+        self.scores = scores
+        self.user_index = {uid: u for u, uid in enumerate(users.tolist())}
+
+    @classmethod
+    def from_ranked(cls, ranked):
+        """build from (uid, [(iid, est), ...]) pairs, e.g. get_top_n items."""
+        users, lengths, item_ids, scores = [], [], [], []
+        for uid, ratings in ranked:
+            users.append(uid)
+            lengths.append(len(ratings))
+            for iid, est in ratings:
+                item_ids.append(iid)
+                scores.append(est)
+        empty = cls(_objects([]), np.empty((0, 0), np.int16), _objects([]),
+                    np.empty((0, 0), np.float32))
+        return empty.patch(users, lengths, item_ids, scores)
+
+    def patch(self, users, lengths, item_ids, scores=None):
+        """TopK with the lists of users replaced, users and items it does
+        not hold yet are appended and every other list is kept.
+
+        Parameters
+        ----------
+        users : array-like
+            model user id of each new list.
+        lengths : array-like of int
+            # of items of each new list.
+        item_ids : array-like
+            model item ids of the new lists back to back, each list sorted
+            by score.
+        scores : array-like, optional
+            estimated ratings of item_ids, not stored when the TopK keeps
+            no scores.
+
+        Returns
+        -------
+        type: TopK
+
+        """
+        lengths = np.asarray(lengths, dtype=np.int64)
+        # look up each distinct item once, new items get the next positions
+        codes, distinct = pd.factorize(_objects(item_ids))
+        positions = pd.Index(self.item_ids, dtype=object).get_indexer(
+            distinct)
+        new = positions < 0
+        positions[new] = len(self.item_ids) + np.arange(new.sum())
+        all_item_ids = np.concatenate([_objects(self.item_ids),
+                                       _objects(distinct[new])])
+        user_index = dict(self.user_index)
+        rows = np.array([user_index.setdefault(uid, len(user_index))
+                         for uid in _objects(users).tolist()],
+                        dtype=np.int64)
+
+        n_users, width = self.items.shape
+        shape = (len(user_index), max(width, lengths.max(initial=0)))
+        filled = np.arange(shape[1]) < lengths[:, None]
+        items = np.full(shape, -1, dtype=_position_dtype(len(all_item_ids)))
+        items[:n_users, :width] = self.items
+        block = np.full(filled.shape, -1, dtype=items.dtype)
+        block[filled] = positions[codes]
+        items[rows] = block
+        all_scores = None
+        if self.scores is not None:
+            all_scores = np.full(shape, np.nan, dtype=np.float32)
+            all_scores[:n_users, :width] = self.scores
+            block = np.full(filled.shape, np.nan, dtype=np.float32)
+            if scores is not None:
+                block[filled] = scores
+            all_scores[rows] = block
+        return TopK(_objects(list(user_index)), items, all_item_ids,
+                    all_scores)
+
+    def __len__(self):
+        return len(self.users)
+
+    def __contains__(self, uid):
+        return uid in self.user_index
+
+    def _row(self, uid):
+        row = self.items[self.user_index[uid]]
+        return row[row >= 0]
+
+    def __getitem__(self, uid):
+        """ranked item ids of uid, so a TopK reads like a dict of lists."""
+        return self.item_ids[self._row(uid)].tolist()
+
+    def ratings(self, uid):
+        """ranked (iid, est) of uid."""
+        if self.scores is None:
+            raise ValueError("scores were not kept, only the ranking")
+        iids = self[uid]
+        scores = self.scores[self.user_index[uid], :len(iids)]
+        return list(zip(iids, scores.tolist()))
+
+
+def build_top_k(algo, predictions=None, max_n=MAX_N, factors=None):
+    """rank every user's items once, see recsys.inference.build_top_n_index.
+
+    Factor models are ranked over the full catalog excluding rated items,
+    other algorithms rank predictions.
+
+    Returns
+    -------
+    type: TopK
+
+    """
+    if factors is None and algo is not None and is_factor_model(algo):
+        factors = get_factors(algo)
+    if factors is not None:
+        return TopK.from_ranked(batch_recommend(factors, max_n))
+    return TopK.from_ranked(get_top_n(predictions, max_n).items())
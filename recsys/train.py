@@ -1,12 +1,18 @@
 """
 Train and Select models with best performance.
 
-Current model: KNNWithMeans, SVD, SVDpp, SlopeOne, CoClustering
-Metrics: RMSE, Precision, Recall, Fit Time, Test time
+Current model: KNNWithMeans, SVD, SVDpp, SlopeOne, CoClustering,
+ImplicitALS on playtime with --implicit
+Metrics: RMSE, Precision, Recall, Fit Time, Test time; with --implicit the
+played games of each test fold are held out and ranked over the catalog,
+without RMSE or rating threshold
 
 load_data
 save_output
+save_metrics
+load_metrics
 set_seed
+cv_job
 iterate_algo
 find_best_model
 refit
@@ -14,43 +20,167 @@ refit
 
 from surprise import KNNWithMeans, SVDpp, SlopeOne, CoClustering
 from surprise import Reader, Dataset, accuracy, model_selection
+import argparse
+import os
+import json
 import random
 import time
 import re
-import pickle
 
-from os.path import abspath, dirname, join
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from os.path import abspath, basename, dirname, join
 import numpy as np
+from recsys.als import ImplicitALS
+from recsys.artifacts import load_table, load_encoders, save_model_output
+from recsys.profiling import MEMORY_MODES, StageProfiler, profiler
+from recsys.scoring import get_factors, is_factor_model, recommend
+from recsys.search import (
+    IMPLICIT_PARAM_SPACES, PARAM_SPACES, search_algorithms)
+from recsys.topk import MAX_N, build_top_k
 from recsys.evaluate import (
-    precision_recall_at_k, personalization, metrics_dataframe, show_results)
+    rank_predictions, precision_recall_at_ks, held_out_precision_recall_at_ks,
+    personalization_from_ranked,
+    sampled_personalization_from_ranked, metrics_dataframe, show_results)
 
 
 DATA_DIR = join(dirname(dirname(abspath((__file__)))), "data")
-PKL_FILE = join(DATA_DIR, "filtered_explicit_data.pkl")
-METRICS_FILE = join(DATA_DIR, "metrics.pkl")
-OUTPUT_FILE = join(DATA_DIR, "best_model_predictions.pkl")
+TABLE_FILE = join(DATA_DIR, "filtered_explicit_data.parquet")
+IMPLICIT_TABLE_FILE = join(DATA_DIR, "implicit_data.parquet")
+METRICS_FILE = join(DATA_DIR, "metrics.json")
+SEARCH_FILE = join(DATA_DIR, "search.json")
+OUTPUT_DIR = join(DATA_DIR, "best_model_predictions")
+# the implicit model is kept apart from the served review vote model
+IMPLICIT_METRICS_FILE = join(DATA_DIR, "metrics_implicit.json")
+IMPLICIT_SEARCH_FILE = join(DATA_DIR, "search_implicit.json")
+IMPLICIT_OUTPUT_DIR = join(DATA_DIR, "best_model_predictions_implicit")
 
 
 def load_data(file):
-    f = open(file, "rb")
-    data = pickle.load(f)
-    f.close()
-    return data
+    return load_table(file, columns=["user_id", "item_id", "recommend"])
 
 
-def save_output(output, file):
-    f = open(file, "wb")
-    pickle.dump(output, f)
-    f.close()
+def save_output(output, directory):
+    save_model_output(output, directory)
 
 
-def set_seed():
-    seed = 0
+def save_metrics(metrics, file):
+    # metrics are small nested lists and dicts of floats, keep them readable
+    with open(file, "w") as f:
+        json.dump(metrics, f, indent=2, default=float)
+
+
+def _int_keys(pairs):
+    # json object keys are strings, k of precision and recall at k is an int
+    return {int(key) if key.isdigit() else key: value
+            for key, value in pairs}
+
+
+def load_metrics(file):
+    """metrics written by save_metrics, with int k keys as they were saved."""
+    with open(file, "r") as f:
+        return json.load(f, object_pairs_hook=_int_keys)
+
+
+def set_seed(seed=0):
     random.seed(seed)
     np.random.seed(seed)
 
 
-def iterate_algo(algo_ls, kfold, data, top_n, threshold, k_ls):
+def cv_job(algo, train, test, top_n, threshold, k_ls,
+           personalization_mode="exact", n_pairs=10000, seed=0,
+           profile=None, implicit=False):
+    """fit and evaluate one algorithm on one cross validation fold.
+
+    Runs in the calling process or in a worker of the process pool, timings
+    cover only this job's fit and test.
+
+    Parameters
+    ----------
+    profile : str, optional
+        memory mode of recsys.profiling, the job is then profiled where it
+        runs and its records returned.
+    implicit : bool
+        ratings are playtime: the test pairs with positive playtime are
+        held out and ranked against the whole catalog by a factor model,
+        threshold is unused and rmse is nan.
+
+    Returns
+    -------
+    type: dict
+        keys: rmse, precisions, recalls, personalization,
+              personalization_ci, fit_time, pred_time, profile (list of
+              stage records, empty unless profiled).
+
+    """
+    job_profiler = StageProfiler(profile)
+    with job_profiler.stage("fold"):
+        result = _cv_job(algo, train, test, top_n, threshold, k_ls,
+                         personalization_mode, n_pairs, seed, implicit)
+    result["profile"] = job_profiler.records
+    return result
+
+
+def _held_out(test):
+    # played games of each test user, owned but unplayed ones are negatives
+    held_out = defaultdict(set)
+    for uid, iid, r in test:
+        if r > 0:
+            held_out[uid].add(iid)
+    return held_out
+
+
+def _cv_job(algo, train, test, top_n, threshold, k_ls, personalization_mode,
+            n_pairs, seed, implicit=False):
+    set_seed(seed)
+
+    fit_start = time.time()
+    algo.fit(train)
+    fit_time = time.time() - fit_start
+
+    pred_start = time.time()
+    if implicit:
+        held_out = _held_out(test)
+        factors = get_factors(algo)
+        recommended = recommend(
+            factors, [uid for uid in held_out if uid in factors["uid_index"]],
+            max(max(k_ls), top_n))
+        # ranked lists as predictions, for personalization
+        pred = [(uid, iid, float(iid in held_out[uid]), est, {})
+                for uid, ratings in recommended.items()
+                for iid, est in ratings]
+    else:
+        pred = algo.test(test)
+    pred_time = time.time() - pred_start
+
+    # sort predictions once, then read every k from the same pass
+    ranked = rank_predictions(pred)
+    if implicit:
+        rmse = np.nan
+        precisions, recalls = held_out_precision_recall_at_ks(
+            recommended, held_out, k_ls)
+    else:
+        rmse = accuracy.rmse(pred)
+        precisions, recalls = precision_recall_at_ks(ranked, k_ls, threshold)
+
+    if personalization_mode == "sampled":
+        score, ci = sampled_personalization_from_ranked(
+            ranked, top_n, n_pairs=n_pairs, seed=seed)
+    else:
+        score, ci = personalization_from_ranked(ranked, top_n), None
+
+    return {"rmse": rmse,
+            "precisions": precisions,
+            "recalls": recalls,
+            "personalization": score,
+            "personalization_ci": ci,
+            "fit_time": fit_time,
+            "pred_time": pred_time}
+
+
+def iterate_algo(algo_ls, kfold, data, top_n, threshold, k_ls,
+                 personalization_mode="exact", n_pairs=10000, n_jobs=1,
+                 seed=0, implicit=False):
     """iterate different algortihms and compute their metrics.
 
     Parameters
@@ -67,17 +197,54 @@ def iterate_algo(algo_ls, kfold, data, top_n, threshold, k_ls):
     k_ls : list
         list of different # of top items recommended,find_best_model
         used in precision and recall at k.
+    personalization_mode : str
+        "exact" (default) or "sampled" personalization.
+    n_pairs : int
+        # of user pairs drawn in sampled mode.
+    n_jobs : int
+        # of worker processes, 1 runs sequentially, -1 uses every core.
+    seed : int
+        seed of the folds, job (algorithm i, fold j) is seeded with
+        seed + i * kfold + j in either mode.
+    implicit : bool
+        evaluate playtime ratings as implicit feedback, see cv_job.
 
     Returns
     -------
     type: dict
         keys: rmse, precision, recall, fit time, prediction time,
-                personalization, algorithm name.
+                personalization, personalization confidence interval
+                (None in exact mode), algorithm name.
         items: list of 5 fold cross validation measurement.
 
     """
 
-    kf = model_selection.KFold(n_splits=kfold)
+    # same folds for every algorithm, in sequential and parallel mode
+    kf = model_selection.KFold(n_splits=kfold, random_state=seed)
+    job_args = (top_n, threshold, k_ls, personalization_mode, n_pairs)
+    # folds of the pool are profiled in their worker
+    profile = profiler.memory
+
+    def job_seed(algo_i, fold_i):
+        return seed + algo_i * kfold + fold_i
+
+    if n_jobs == 1:
+        results = [[cv_job(algo, train, test, *job_args,
+                           seed=job_seed(algo_i, fold_i), profile=profile,
+                           implicit=implicit)
+                    for fold_i, (train, test) in enumerate(kf.split(data))]
+                   for algo_i, algo in enumerate(algo_ls)]
+    else:
+        folds = list(kf.split(data))
+        max_workers = os.cpu_count() if n_jobs == -1 else n_jobs
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [[executor.submit(cv_job, algo, train, test, *job_args,
+                                        seed=job_seed(algo_i, fold_i),
+                                        profile=profile, implicit=implicit)
+                        for fold_i, (train, test) in enumerate(folds)]
+                       for algo_i, algo in enumerate(algo_ls)]
+            results = [[future.result() for future in algo_futures]
+                       for algo_futures in futures]
 
     metrics = {"cv_rmse": [],
                "cv_precision": [],
@@ -85,58 +252,27 @@ def iterate_algo(algo_ls, kfold, data, top_n, threshold, k_ls):
                "cv_fit_time": [],
                "cv_pred_time": [],
                "cv_personalization": [],
+               "cv_personalization_ci": [],
                "algo_name": []}
 
-    for algo in algo_ls:
-        rmse_ls = []
-        precisions_dict = {}
-        recalls_dict = {}
-        fit_time_ls = []
-        pred_time_ls = []
-        personalization_ls = []
-
-        # perform cross vailidation
-        for train, test in kf.split(data):
-
-            fit_start = time.time()
-            algo.fit(train)
-            fit_time = time.time() - fit_start
-
-            pred_start = time.time()
-            pred = algo.test(test)
-            pred_time = time.time() - pred_start
-
-            rmse = accuracy.rmse(pred)
-            rmse_ls.append(rmse)
-
-            # iterate k_ls
-            for k in k_ls:
-
-                precisions, recalls = precision_recall_at_k(
-                    pred, k, threshold)
-
-                if k in precisions_dict:
-                    precisions_dict[k].append(precisions)
-                else:
-                    precisions_dict[k] = [precisions]
-
-                if k in recalls_dict:
-                    recalls_dict[k].append(recalls)
-                else:
-                    recalls_dict[k] = [recalls]
-
-            personalization_ls.append(personalization(pred, top_n))
-
-            fit_time_ls.append(fit_time)
-            pred_time_ls.append(pred_time)
-
-        metrics["cv_rmse"].append(rmse_ls)
-        metrics["cv_precision"].append(precisions_dict)
-        metrics["cv_recall"].append(recalls_dict)
-
-        metrics["cv_personalization"].append(personalization_ls)
-        metrics["cv_fit_time"].append(fit_time_ls)
-        metrics["cv_pred_time"].append(pred_time_ls)
+    for algo, algo_results in zip(algo_ls, results):
+        for fold_i, r in enumerate(algo_results):
+            profiler.add(r["profile"],
+                         name=f"iterate_algo {type(algo).__name__} "
+                              f"fold {fold_i}")
+        metrics["cv_rmse"].append([r["rmse"] for r in algo_results])
+        metrics["cv_precision"].append(
+            {k: [r["precisions"][k] for r in algo_results] for k in k_ls})
+        metrics["cv_recall"].append(
+            {k: [r["recalls"][k] for r in algo_results] for k in k_ls})
+
+        metrics["cv_personalization"].append(
+            [r["personalization"] for r in algo_results])
+        metrics["cv_personalization_ci"].append(
+            [r["personalization_ci"] for r in algo_results])
+        metrics["cv_fit_time"].append([r["fit_time"] for r in algo_results])
+        metrics["cv_pred_time"].append(
+            [r["pred_time"] for r in algo_results])
 
         regex = r"(\w+)\s"
         name = re.search(regex, str(algo))
@@ -188,7 +324,7 @@ def find_best_model(algo_dict, metrics, rank_by="precision", k=10):
     return best_algo_name
 
 
-def refit(data, best_algo):
+def refit(data, best_algo, max_n=MAX_N, keep_predictions=False):
     """refit the best algorithm with whoel dataset.
 
     Parameters
@@ -196,44 +332,114 @@ def refit(data, best_algo):
     data : surprise.Dataset.DatasetAutoFolds
     best_algo : surprise.prediction_algorithms
         avilable algorithms from suprise.prediction_algorithms package.
+    max_n : int
+        # of recommended items kept per user.
+    keep_predictions : bool
+        also return the predictions of every training pair, they are only
+        computed otherwise when the model has no factors to rank with.
 
     Returns
     -------
     type: dict
-        keys: predictions, algo
+        keys: predictions, algo, top_n
         items: list of predictions
-            [userid, itemid, true rating, estimates, details],
-        trained model
+            [userid, itemid, true rating, estimates, details] or empty,
+        trained model, recsys.topk.TopK of every user
     """
     # fit algorithm to the whole dataset
     trainset = data.build_full_trainset()
     best_algo.fit(trainset)
-    testset = trainset.build_testset()
-    predictions = best_algo.test(testset)
-    output = {"predictions": predictions, "algo": best_algo}
+    predictions = []
+    if keep_predictions or not is_factor_model(best_algo):
+        testset = trainset.build_testset()
+        predictions = best_algo.test(testset)
+    top_n = build_top_k(best_algo, predictions, max_n)
+    output = {"predictions": predictions if keep_predictions else [],
+              "algo": best_algo,
+              "top_n": top_n}
     return output
 
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_dir", default=DATA_DIR, type=str,
+                        help="directory of the tables written by "
+                             "recsys.steam_preprocess, the model, metrics "
+                             "and reports are saved next to them")
+    parser.add_argument("--profile", nargs="?", const="rss", default=None,
+                        choices=MEMORY_MODES,
+                        help="report time and memory of every stage, see "
+                             "recsys.profiling")
+    parser.add_argument("--search", action="store_true",
+                        help="tune every algorithm with successive halving "
+                             "before cross validation, see recsys.search")
+    parser.add_argument("--budget", default=60, type=float,
+                        help="search budget in fold fits on the whole data")
+    parser.add_argument("--implicit", action="store_true",
+                        help="train ImplicitALS on the playtime of every "
+                             "owned game instead of the review votes, saved "
+                             "apart from the served model")
+    args = parser.parse_args()
+    data_dir = args.data_dir
+    if args.profile:
+        profiler.enable(args.profile)
+    files = (IMPLICIT_TABLE_FILE, IMPLICIT_METRICS_FILE, IMPLICIT_SEARCH_FILE,
+             IMPLICIT_OUTPUT_DIR) if args.implicit \
+        else (TABLE_FILE, METRICS_FILE, SEARCH_FILE, OUTPUT_DIR)
+    table_file, metrics_file, search_file, output_dir = [
+        join(data_dir, basename(file)) for file in files]
+
     set_seed()
-    data = load_data(PKL_FILE)
-    data = Dataset.load_from_df(data, reader=Reader(rating_scale=(0, 1)))
+    with profiler.stage("load_data"):
+        if args.implicit:
+            # playtime minutes as ratings, estimates are preferences in
+            # [0, 1], evaluated on held out played games
+            df = load_table(table_file, columns=[
+                "user_id", "item_id", "playtime_forever"])
+        else:
+            df = load_data(table_file)
+        # steam_preprocess stores int32 codes and the encoders next to them,
+        # the implicit table keeps the raw ids
+        encoders = load_encoders(data_dir) \
+            if df["user_id"].dtype.kind == "i" else None
+        data = Dataset.load_from_df(df, reader=Reader(rating_scale=(0, 1)))
 
     kfold = 5
 
     algo_ls = [KNNWithMeans(), SVDpp(),
                SlopeOne(), CoClustering()]
+    if args.implicit:
+        algo_ls = [ImplicitALS()]
     top_n = 10
     threshold = 0.7
     k_ls = [3, 5, 7, 10]
-    metrics = iterate_algo(algo_ls, kfold, data, top_n, threshold, k_ls)
+    n_jobs = -1
+    if args.search:
+        # the tuned algorithms compete in the full cross validation below
+        with profiler.stage("search", budget=args.budget):
+            param_spaces = IMPLICIT_PARAM_SPACES if args.implicit \
+                else PARAM_SPACES
+            searched = search_algorithms(df, args.budget, param_spaces,
+                                         top_n=top_n, threshold=threshold,
+                                         k_ls=k_ls, n_jobs=n_jobs,
+                                         implicit=args.implicit)
+        algo_ls = [result["algo"] for result in searched.values()]
+        save_metrics({name: result["search"]
+                      for name, result in searched.items()}, search_file)
+    with profiler.stage("iterate_algo"):
+        metrics = iterate_algo(algo_ls, kfold, data, top_n, threshold, k_ls,
+                               n_jobs=n_jobs, implicit=args.implicit)
     algo_dict = dict(zip(metrics["algo_name"], algo_ls))
     best_algo_name = find_best_model(algo_dict, metrics)
     set_seed()
-    output = refit(data, algo_dict[best_algo_name])
-    save_output(output, OUTPUT_FILE)
-    save_output(metrics, METRICS_FILE)
+    with profiler.stage("refit", algo=best_algo_name.strip()):
+        output = refit(data, algo_dict[best_algo_name])
+    output["encoders"] = encoders
+    with profiler.stage("save_output"):
+        save_output(output, output_dir)
+    save_metrics(metrics, metrics_file)
     show_results(metrics)
+    profiler.write_report(join(data_dir, "profile_train"))
 
 
 if __name__ == "__main__":
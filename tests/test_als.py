@@ -0,0 +1,84 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from surprise import Dataset, Reader
+
+from recsys.als import ImplicitALS
+from recsys.train import cv_job
+
+
+def test_cg_solves_normal_equations():
+    rng = np.random.RandomState(0)
+    n_factors = 4
+    cui = sparse.random(6, 5, density=0.5, random_state=0, format="csr")
+    cui.data = 10 * cui.data
+    y = rng.normal(size=(5, n_factors))
+    x = rng.normal(size=(6, n_factors))
+    # conjugate gradient is exact after n_factors steps
+    algo = ImplicitALS(n_factors=n_factors, reg=0.1, cg_steps=n_factors,
+                       block_size=4)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        algo._solve(executor, cui, x, y)
+
+    dense = cui.toarray()
+    for u in range(6):
+        # (Y'Y + reg I + Y' (C_u - I) Y) x_u = Y' C_u p_u
+        a = y.T @ y + 0.1 * np.eye(n_factors) + y.T @ (dense[u][:, None] * y)
+        b = y.T @ ((1 + dense[u]) * (dense[u] > 0))
+        assert np.allclose(x[u], np.linalg.solve(a, b))
+
+
+def test_confidence_matrix():
+    df = pd.DataFrame({"user_id": ["a", "a", "b"], "item_id": ["x", "y", "x"],
+                       "playtime_forever": [0, 3, 9]})
+    trainset = Dataset.load_from_df(
+        df, Reader(rating_scale=(0, 1))).build_full_trainset()
+    cui = ImplicitALS(alpha=2., epsilon=1.).confidence_matrix(trainset)
+    u, x, y = (trainset.to_inner_uid("a"), trainset.to_inner_iid("x"),
+               trainset.to_inner_iid("y"))
+
+    # unplayed games carry no extra confidence
+    assert cui.nnz == 2
+    assert cui[u, x] == 0
+    assert np.isclose(cui[u, y], 2. * np.log1p(3.))
+    linear = ImplicitALS(alpha=2., confidence="linear")
+    assert linear.confidence_matrix(trainset)[
+        trainset.to_inner_uid("b"), x] == 18.
+
+
+def two_groups(seed=0):
+    # users 0-19 own games 0-9, users 20-39 games 10-19, and play all but
+    # two of them; two played games of every user are held out
+    rng = np.random.RandomState(seed)
+    train, test = [], []
+    for u in range(40):
+        games = rng.permutation(10) + (10 if u >= 20 else 0)
+        for n, i in enumerate(games):
+            playtime = float(rng.randint(1, 500)) if n < 8 else 0.
+            (test if n < 2 else train).append((str(u), str(i), playtime))
+    return train, test
+
+
+def test_held_out_ranked_above_unplayed():
+    train, test = two_groups()
+    trainset = Dataset.load_from_df(
+        pd.DataFrame(train, columns=["user_id", "item_id", "playtime"]),
+        Reader(rating_scale=(0, 1))).build_full_trainset()
+    # one factor per group of games
+    algo = ImplicitALS(n_factors=2, n_epochs=10, random_state=0).fit(trainset)
+
+    def score(uid, iid):
+        # predict clips to the rating scale
+        return algo.estimate(trainset.to_inner_uid(uid),
+                             trainset.to_inner_iid(iid))
+
+    for uid, iid, _ in test:
+        other = [str(i) for i in range(20) if (i >= 10) != (int(uid) >= 20)]
+        assert all(score(uid, iid) > score(uid, i) for i in other)
+
+    result = cv_job(algo, trainset, test, 10, 0.7, [2], implicit=True)
+    # the two held out games are the best unplayed games of every user
+    assert result["precisions"][2] > 0.9
+    assert np.isnan(result["rmse"])
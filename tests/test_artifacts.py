@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from recsys.artifacts import (
+    save_table, load_table, read_metadata, save_top_k, load_top_k)
+from recsys.topk import TopK
+from recsys.train import save_metrics, load_metrics
+
+
+def games():
+    # the shapes of the games table: list columns with missing games, price
+    # mixing floats and strings, booleans with missing values
+    return pd.DataFrame({
+        "item_id": ["10", "20", "30", "40"],
+        "n_review": [3, 1, 7, 2],
+        "app_name": ["Counter-Strike", np.nan, "Portal", "Dota 2"],
+        "genres": [["Action"], ["Action", "Adventure"], np.nan, []],
+        "tags": [["FPS", "Classic"], np.nan, ["Puzzle"], ["MOBA"]],
+        "price": [9.99, "Free to Play", np.nan, 0.0],
+        "early_access": [False, True, np.nan, False],
+    })
+
+
+def test_table_round_trip(tmp_path):
+    df = games()
+    file = str(tmp_path / "games.parquet")
+    save_table(df, file)
+    back = load_table(file)
+
+    assert list(back.columns) == list(df.columns)
+    for col in df.columns:
+        assert back[col].map(str).tolist() == df[col].map(str).tolist(), col
+        assert back[col].map(type).tolist() == df[col].map(type).tolist(), \
+            col
+    # the dashboard filters genres on their string form
+    assert str(back["genres"][1]) == "['Action', 'Adventure']"
+    assert read_metadata(file)["mixed_columns"] == ["price"]
+
+
+def test_table_columns(tmp_path):
+    file = str(tmp_path / "games.parquet")
+    save_table(games(), file)
+    back = load_table(file, columns=["item_id", "genres"])
+
+    assert list(back.columns) == ["item_id", "genres"]
+    assert back["genres"][0] == ["Action"]
+
+
+def test_mixed_types_round_trip(tmp_path):
+    df = pd.DataFrame({"price": ["Free", 4.99, 10, "007", np.nan, True],
+                       "n": range(6)})
+    file = str(tmp_path / "prices.parquet")
+    save_table(df, file)
+
+    for back in (load_table(file), load_table(file, columns=["price"])):
+        assert list(back.columns) == [c for c in df.columns
+                                      if c in back.columns]
+        assert back["price"][:4].tolist() == ["Free", 4.99, 10, "007"]
+        assert back["price"].map(type).tolist() == \
+            df["price"].map(type).tolist()
+        assert np.isnan(back["price"][4]) and back["price"][5] is True
+
+
+def test_metrics_round_trip(tmp_path):
+    metrics = {"cv_rmse": [[0.5, 0.6]],
+               "cv_precision": [{3: [0.8, 0.9], 10: [0.7, 0.75]}],
+               "algo_name": ["SVD "]}
+    file = str(tmp_path / "metrics.json")
+    save_metrics(metrics, file)
+
+    assert load_metrics(file) == metrics
+
+
+def test_top_k_round_trip(tmp_path):
+    top_k = TopK.from_ranked([("u1", [("b", 0.9), ("a", 0.5)]),
+                              ("u2", []),
+                              ("u3", [("c", 0.7)])])
+    save_top_k(top_k, str(tmp_path / "top_k"))
+    back = load_top_k(str(tmp_path / "top_k"))
+
+    assert back.items.dtype == np.int16
+    assert [back[uid] for uid in ["u1", "u2", "u3"]] == \
+        [["b", "a"], [], ["c"]]
+    # only the ranking is served
+    assert back.scores is None
+    save_top_k(top_k, str(tmp_path / "scored"), scores=True)
+    assert load_top_k(str(tmp_path / "scored")).ratings("u1") == \
+        [("b", pytest.approx(0.9)), ("a", 0.5)]
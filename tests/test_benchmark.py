@@ -0,0 +1,52 @@
+import importlib.util
+
+import pytest
+
+from recsys.benchmark import CASES, ScaleData, Skip, compare
+
+has_plugin = importlib.util.find_spec("pytest_benchmark") is not None
+
+
+def run(medians):
+    return {"results": {key: {"median": median}
+                        for key, median in medians.items()}}
+
+
+def test_compare_tolerance():
+    baseline = run({"a[small]": 1., "b[small]": 1., "c[small]": 1.,
+                    "gone[small]": 1.})
+    results = run({"a[small]": 1.2, "b[small]": 1.3, "c[small]": 0.5,
+                   "new[small]": 1.})
+    results["results"]["skipped[small]"] = {"skipped": "no dash"}
+    baseline["results"]["skipped[small]"] = {"median": 1.}
+    rows = {row["key"]: row for row in compare(results, baseline,
+                                               tolerance=0.25)}
+
+    # only cases timed in both runs are compared
+    assert sorted(rows) == ["a[small]", "b[small]", "c[small]"]
+    assert rows["b[small]"]["ratio"] == pytest.approx(1.3)
+    assert [rows[key]["regression"] for key in sorted(rows)] == \
+        [False, True, False]
+    assert compare(results, baseline, tolerance=0.1)[0]["regression"]
+
+
+def test_compare_zero_baseline():
+    rows = compare(run({"a[small]": 1e-3}), run({"a[small]": 0.}))
+    assert rows[0]["regression"]
+
+
+@pytest.fixture(scope="module")
+def data():
+    return ScaleData("small")
+
+
+@pytest.mark.skipif(not has_plugin, reason="pytest-benchmark not installed")
+@pytest.mark.parametrize("case", [case for case in CASES
+                                  if "small" in case.scales],
+                         ids=lambda case: case.name)
+def test_case(benchmark, data, case):
+    try:
+        run = case.setup(data)
+    except Skip as e:
+        pytest.skip(str(e))
+    benchmark.pedantic(run, rounds=case.repeat, warmup_rounds=1)
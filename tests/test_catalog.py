@@ -0,0 +1,36 @@
+import pandas as pd
+
+from recsys.artifacts import save_table
+from recsys.catalog import GameCatalog, get_catalog
+
+
+def details(tmp_path, name, names):
+    file = str(tmp_path / name)
+    save_table(pd.DataFrame({"id": ["10", "20", "30", "20"],
+                             "app_name": names,
+                             "price": [9.99, "Free", 0., 1.]}), file)
+    return file
+
+
+def test_lookup_in_ranked_order(tmp_path):
+    catalog = GameCatalog(details(tmp_path, "details.parquet",
+                                  ["Counter-Strike", "Portal", "Dota 2",
+                                   "Portal again"]))
+
+    df = catalog.lookup(["30", "missing", "10", "20"], ["app_name", "id"])
+    assert df["app_name"].tolist() == ["Dota 2", "Counter-Strike", "Portal"]
+    assert df["id"].tolist() == ["30", "10", "20"]
+    assert "20" in catalog and "missing" not in catalog
+
+
+def test_get_catalog_per_file(tmp_path):
+    first = details(tmp_path, "first.parquet", ["a", "b", "c", "d"])
+    second = details(tmp_path, "second.parquet", ["w", "x", "y", "z"])
+
+    catalog = get_catalog(first)
+    # loaded once per file, a second file is not served from the first
+    assert get_catalog(first) is catalog
+    assert get_catalog(str(tmp_path / "." / "first.parquet")) is catalog
+    assert get_catalog(second).lookup(["10"], ["app_name"])[
+        "app_name"].tolist() == ["w"]
+    assert catalog.lookup(["10"], ["app_name"])["app_name"].tolist() == ["a"]
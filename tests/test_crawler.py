@@ -0,0 +1,133 @@
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os.path import join
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import requests
+
+from recsys import crawler
+from recsys.crawler import (
+    TokenBucket, ResponseCache, make_session, fetch_json)
+from recsys.steamapi2 import get_appinfo
+
+
+class StubStore(BaseHTTPRequestHandler):
+    """store appdetails endpoint answering (status, Retry-After) from
+    failures[appid] before the details."""
+    failures = {}
+    hits = Counter()
+    lock = threading.Lock()
+
+    def do_GET(self):
+        appid = parse_qs(urlparse(self.path).query)["appids"][0]
+        with self.lock:
+            self.hits[appid] += 1
+            failures = self.failures.get(appid, [])
+            status, retry_after = failures.pop(0) if failures else (200, None)
+        self.send_response(status)
+        if retry_after is not None:
+            self.send_header("Retry-After", retry_after)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        if status == 200:
+            body = {appid: {"success": True,
+                            "data": {"name": f"app {appid}",
+                                     "steam_appid": int(appid)}}}
+            self.wfile.write(json.dumps(body).encode())
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def store():
+    StubStore.failures = {}
+    StubStore.hits = Counter()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubStore)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr(crawler.time, "sleep", delays.append)
+    return delays
+
+
+def test_fetch_json_retries_throttled(store, sleeps):
+    StubStore.failures = {"1": [(429, "3"), (503, None)]}
+    data = fetch_json(make_session(), f"{store}/api/appdetails?appids=1",
+                      backoff=0.01)
+
+    assert data["1"]["data"]["name"] == "app 1"
+    assert StubStore.hits["1"] == 3
+    # Retry-After is obeyed, then exponential backoff with jitter
+    assert sleeps[0] == 3.
+    assert 0.01 <= sleeps[1] <= 0.03
+
+
+def test_fetch_json_gives_up(store, sleeps):
+    StubStore.failures = {"1": [(503, None)] * 3}
+    with pytest.raises(requests.HTTPError):
+        fetch_json(make_session(), f"{store}/api/appdetails?appids=1",
+                   max_retries=2)
+    assert StubStore.hits["1"] == 3
+    assert len(sleeps) == 2
+
+
+def test_fetch_json_does_not_retry_client_errors(store, sleeps):
+    StubStore.failures = {"1": [(404, None)]}
+    with pytest.raises(requests.HTTPError):
+        fetch_json(make_session(), f"{store}/api/appdetails?appids=1")
+    assert StubStore.hits["1"] == 1
+    assert sleeps == []
+
+
+def test_token_bucket_rate():
+    bucket = TokenBucket(rate=100, capacity=1)
+    start = time.monotonic()
+    threads = [threading.Thread(
+        target=lambda: [bucket.acquire() for _ in range(5)])
+        for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # one token up front, the other 19 at 100 per second
+    assert time.monotonic() - start >= 0.18
+
+
+def test_resume_from_checkpoint(store, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    out_file = str(tmp_path / "apps.jsonl")
+    app_dict = {appid: [f"app {appid}"] for appid in range(1, 7)}
+    StubStore.failures = {"2": [(429, "0")],
+                          "5": [(404, None)], "6": [(404, None)]}
+    stats = get_appinfo(app_dict, out_file, concurrency=2, rate=1000,
+                        base_url=store, cache_dir=cache_dir)
+    assert (stats["done"], stats["failed"]) == (4, 2)
+    assert StubStore.hits["2"] == 2
+
+    # a crash can leave the last checkpoint line half written
+    with open(join(cache_dir, "checkpoint.tsv"), "a") as f:
+        f.write("5")
+    assert sorted(ResponseCache(cache_dir).completed) == ["1", "2", "3", "4"]
+
+    stats = get_appinfo(app_dict, out_file, concurrency=2, rate=1000,
+                        base_url=store, cache_dir=cache_dir)
+    assert (stats["done"], stats["hits"], stats["misses"]) == (6, 4, 2)
+    # completed apps are not requested again, the failed ones once more
+    assert StubStore.hits == Counter({"1": 1, "2": 2, "3": 1, "4": 1,
+                                      "5": 2, "6": 2})
+    assert len(ResponseCache(cache_dir).completed) == 6
+    records = sorted(crawler.read_jsonl(out_file),
+                     key=lambda r: r["steam_appid"])
+    assert [r["name"] for r in records] == [f"app {i}" for i in range(1, 7)]
@@ -0,0 +1,125 @@
+import numpy as np
+import pandas as pd
+
+from recsys.dashboard_data_validate import build_text_indexes
+from recsys.dashboard_filter import FilterEngine
+from recsys.dashboard_scatter import scatter_points
+
+
+def games():
+    return pd.DataFrame({
+        "app_name": ["Portal", "Dota 2", "Stardew Valley", "Rust"],
+        "n_review": [30, 120, 45, 8],
+        "n_recommend": [28, 90, 44, 3],
+        "price": [9.99, 0., 14.99, np.nan],
+        "release_year": [2007, 2013, 2016, 2018],
+        "genres": ["['Puzzle']", "['Action', 'Strategy']",
+                   "['Indie', 'RPG']", "['Action', 'Indie']"],
+        "publisher": ["Valve", "Valve", "ConcernedApe", "Facepunch"],
+        "developer": ["Valve", "Valve", "ConcernedApe", "Facepunch"],
+        "early_access": [False, False, False, True],
+    })
+
+
+NO_FILTER = (None,) * 9
+
+
+def test_select_same_axis_twice():
+    engine = FilterEngine(games())
+    # the X and Y dropdowns on the same variable
+    df = engine.select(*NO_FILTER, early_access=False,
+                       cols=["n_review", "n_review", "app_name"])
+
+    assert list(df.columns) == ["n_review", "app_name"]
+    points, = scatter_points([df], "n_review", "n_review")
+    assert list(points["x"]) == list(points["y"]) == [30, 120, 45]
+
+
+def reference_count(df, nb_reviews, nb_recommend, price_min, price_max,
+                    genre, more_genre, publisher, developer, years_released):
+    # the str.contains chain the dashboard callbacks ran before the engine
+    nb_reviews = nb_reviews or df.n_review.min()
+    year_start, year_end = years_released or (df.release_year.min(),
+                                              df.release_year.max())
+    nb_recommend = nb_recommend or df.n_recommend.min()
+    price_min = price_min or 0
+    price_max = price_max or df.price.max()
+    more_genre = (more_genre or "").strip() or None
+    publisher = (publisher or "").strip() or None
+    developer = (developer or "").strip() or None
+    return len(
+        df.pipe(lambda df: df[df['n_review'] >= nb_reviews])
+        .pipe(lambda df: df[(df['release_year'] >= year_start)
+                            & (df['release_year'] <= year_end)])
+        .pipe(lambda df: df[df['n_recommend'] >= nb_recommend])
+        .pipe(lambda df: df[(df['price'] >= price_min)
+                            & (df['price'] <= price_max)])
+        .pipe(lambda df: df[df['genres'].str.contains(
+            genre, case=False, na=False)] if genre else df)
+        .pipe(lambda df: df[df['genres'].str.contains(
+            more_genre, case=False, na=False)] if more_genre else df)
+        .pipe(lambda df: df[df['publisher'].str.contains(
+            publisher, case=False, na=False)] if publisher else df)
+        .pipe(lambda df: df[df['developer'].str.contains(
+            developer, case=False, na=False)] if developer else df))
+
+
+def random_games(n, seed=0):
+    rng = np.random.RandomState(seed)
+    genres = ["Action", "Adventure", "Free to Play", "Indie", "RPG",
+              "Early Access", "Massively Multiplayer"]
+    companies = ["Valve", "Ubisoft Montréal", "ConcernedApe", "Paradox",
+                 "SEGA", "Square Enix", "Bandai Namco", "unknown"]
+    n_review = rng.randint(1, 500, n)
+    return pd.DataFrame({
+        "app_name": [f"game {i}" for i in range(n)],
+        "n_review": n_review,
+        "n_recommend": n_review - rng.randint(0, 2, n),
+        "price": np.where(rng.rand(n) < 0.1, np.nan,
+                          rng.choice([0., 4.99, 9.99, 19.99, 59.99], n)),
+        "release_year": rng.randint(2000, 2019, n).astype(float),
+        "genres": [str(sorted(rng.choice(genres, rng.randint(0, 4),
+                                         replace=False).tolist()))
+                   for _ in range(n)],
+        "publisher": rng.choice(companies, n),
+        "developer": [f"{c} {s}" for c, s in zip(
+            rng.choice(companies, n), rng.choice(["Studio", "", "Ltd."], n))],
+        "early_access": rng.choice([True, False, "unknown"], n),
+    })
+
+
+def random_queries(n, seed=0):
+    rng = np.random.RandomState(seed)
+    patterns = [None, "", " ", "action", "RPG", "ree to", "Early Access",
+                "ind", "a", "valve", "SEGA", "montréal", "MONTRÉAL", "enix",
+                "studio", "ltd.", "v.lve", "^Para", "co|ub", "x", "'Indie'",
+                "Action', 'Indie", "nowhere"]
+    for _ in range(n):
+        yield (rng.choice([None, 50, 200]), rng.choice([None, 10, 300]),
+               rng.choice([None, 1, 5]), rng.choice([None, 10, 30]),
+               rng.choice(patterns), rng.choice(patterns),
+               rng.choice(patterns), rng.choice(patterns),
+               [None, (2005, 2012), (2010, 2018)][rng.randint(3)])
+
+
+def test_filters_match_str_contains():
+    df = random_games(500)
+    indexed = FilterEngine(df, build_text_indexes(df))
+    plain = FilterEngine(df)
+
+    for filters in random_queries(420):
+        expected = reference_count(df, *filters)
+        assert indexed.count(*filters) == expected, filters
+        assert plain.count(*filters) == expected, filters
+
+
+def test_text_indexes_match_str_contains():
+    df = random_games(500)
+    patterns = ["action", "to Pl", "'", "S", "e ", "Montr", "ÉAL",
+                "ubisoft montréal", "a.e", "(?:Valve|SEGA)", "$", "Studio$"]
+    for col, index in build_text_indexes(df).items():
+        for pattern in patterns:
+            expected = np.flatnonzero(df[col].str.contains(
+                pattern, case=False, na=False).values)
+            assert index.search(pattern).tolist() == expected.tolist(), \
+                (col, pattern)
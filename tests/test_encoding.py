@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from recsys.encoding import IdEncoder, encode_id, decode_ids
+
+
+@pytest.fixture
+def encoder():
+    return IdEncoder.fit(["76561197970982479", "pwnddumass", "0", "1",
+                          "pwnddumass"])
+
+
+def test_round_trip(encoder):
+    assert encoder.ids.tolist() == ["0", "1", "76561197970982479",
+                                    "pwnddumass"]
+    codes = encoder.encode(["pwnddumass", "0"])
+    assert codes.dtype == np.int32
+    assert decode_ids(encoder, codes) == ["pwnddumass", "0"]
+    assert encode_id(encoder, "1") == 1
+
+
+@pytest.mark.parametrize("raw_id", ["unknown", 1, 2, None, ["0"]])
+def test_unknown_ids(encoder, raw_id):
+    # 1 and 2 are codes of other ids, never the ids themselves
+    assert encode_id(encoder, raw_id) is None
+    assert raw_id not in encoder
+
+
+def test_encode_unknown_and_none(encoder):
+    assert encoder.encode(["1", "unknown", None, 0]).tolist() == \
+        [1, -1, -1, -1]
+
+
+def test_decode_padding(encoder):
+    # a -1 is never the last id
+    assert decode_ids(encoder, [3, -1, 0, -1]) == \
+        ["pwnddumass", None, "0", None]
+    assert decode_ids(encoder, np.array([], dtype=np.int32)) == []
+
+
+def test_without_encoder():
+    # models trained before the encoder work on raw ids
+    assert encode_id(None, "pwnddumass") == "pwnddumass"
+    assert decode_ids(None, (1, 2)) == [1, 2]
+
+
+def test_extend_keeps_codes(encoder):
+    extended = encoder.extend(["new", "0", "new"])
+    assert extended.ids.tolist()[:4] == encoder.ids.tolist()
+    assert extended.code("new") == 4
+    assert len(extended) == 5
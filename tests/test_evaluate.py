@@ -0,0 +1,119 @@
+from collections import defaultdict
+
+import numpy as np
+import pytest
+from sklearn.metrics.pairwise import cosine_similarity
+from surprise import Dataset, Reader, SVD, model_selection
+from surprise.prediction_algorithms.predictions import Prediction
+
+from recsys.benchmark import synthetic_ratings
+from recsys.evaluate import (
+    get_top_n, personalization, precision_recall_at_ks, rank_predictions,
+    sampled_personalization_from_ranked, top_n_from_ranked)
+
+
+def reference_top_n(predictions, n):
+    # get_top_n and the per-k loops before the single sorted pass
+    top_n = defaultdict(list)
+    for uid, iid, _, est, _ in predictions:
+        top_n[uid].append((iid, est))
+    for uid, user_ratings in top_n.items():
+        user_ratings.sort(key=lambda x: x[1], reverse=True)
+        top_n[uid] = user_ratings[:n]
+    return top_n
+
+
+def reference_precision_recall_at_k(predictions, k, threshold):
+    user_est_true = defaultdict(list)
+    for uid, _, true_r, est, _ in predictions:
+        user_est_true[uid].append((est, true_r))
+    precisions, recalls = {}, {}
+    for uid, user_ratings in user_est_true.items():
+        user_ratings.sort(key=lambda x: x[0], reverse=True)
+        n_rel = sum((true_r >= threshold) for (_, true_r) in user_ratings)
+        n_rec_k = sum((est >= threshold) for (est, _) in user_ratings[:k])
+        n_rel_and_rec_k = sum(((true_r >= threshold) and (est >= threshold))
+                              for (est, true_r) in user_ratings[:k])
+        precisions[uid] = n_rel_and_rec_k / n_rec_k if n_rec_k != 0 else 1
+        recalls[uid] = n_rel_and_rec_k / n_rel if n_rel != 0 else 1
+    return (sum(precisions.values()) / len(precisions),
+            sum(recalls.values()) / len(recalls))
+
+
+def reference_personalization(predictions, n):
+    # the dense users x users cosine similarity
+    top_n = reference_top_n(predictions, n)
+    users = np.unique([p[0] for p in predictions])
+    items = {iid: i for i, iid in
+             enumerate(np.unique([p[1] for p in predictions]))}
+    rec_matrix = np.zeros((len(users), len(items)))
+    for row, uid in enumerate(users):
+        for iid, _ in top_n[uid]:
+            rec_matrix[row, items[iid]] = 1
+    similarity = cosine_similarity(rec_matrix)
+    return 1 - np.mean(similarity[np.triu_indices(len(users), k=1)])
+
+
+@pytest.fixture(scope="module")
+def svd_fold():
+    # SVD predictions of one cross validation fold
+    data = Dataset.load_from_df(synthetic_ratings(300, 100, 5000, seed=0),
+                                Reader(rating_scale=(0, 1)))
+    folds = model_selection.KFold(n_splits=3, random_state=0).split(data)
+    _, (train, test) = list(zip(range(2), folds))[1]
+    return SVD(random_state=0).fit(train).test(test)
+
+
+@pytest.fixture(scope="module")
+def tied():
+    # coarse estimates, many ties the stable sort has to keep in order
+    rng = np.random.RandomState(0)
+    return [Prediction(str(u), str(i), float(rng.randint(2)),
+                       round(rng.rand(), 1), {})
+            for u in range(40) for i in rng.choice(30, 12, replace=False)]
+
+
+@pytest.mark.parametrize("name", ["svd_fold", "tied"])
+def test_precision_recall_matches_reference(request, name):
+    predictions = request.getfixturevalue(name)
+    k_ls = [1, 3, 5, 7, 10, 50]
+    precisions, recalls = precision_recall_at_ks(
+        rank_predictions(predictions), k_ls, 0.7)
+
+    for k in k_ls:
+        # identical, not only close
+        assert (precisions[k], recalls[k]) == \
+            reference_precision_recall_at_k(predictions, k, 0.7)
+
+
+@pytest.mark.parametrize("name", ["svd_fold", "tied"])
+def test_top_n_matches_reference(request, name):
+    predictions = request.getfixturevalue(name)
+    expected = reference_top_n(predictions, 5)
+
+    for top_n in (get_top_n(predictions, 5),
+                  top_n_from_ranked(rank_predictions(predictions), 5)):
+        assert list(top_n) == list(expected)
+        assert {uid: [(iid, est) for iid, est in ratings]
+                for uid, ratings in top_n.items()} == dict(expected)
+
+
+@pytest.mark.parametrize("name", ["svd_fold", "tied"])
+def test_personalization_matches_dense(request, name):
+    predictions = request.getfixturevalue(name)
+    for n in (1, 5, 10):
+        assert personalization(predictions, n) == pytest.approx(
+            reference_personalization(predictions, n), abs=1e-12)
+
+
+def test_sampled_personalization_covers_exact(svd_fold):
+    exact = reference_personalization(svd_fold, 10)
+    ranked = rank_predictions(svd_fold)
+    score, (lower, upper) = sampled_personalization_from_ranked(
+        ranked, 10, n_pairs=20000, seed=0)
+
+    assert lower <= exact <= upper
+    assert abs(score - exact) < 0.01
+    # the same seed draws the same pairs
+    assert sampled_personalization_from_ranked(
+        ranked, 10, n_pairs=20000, seed=0)[0] == score
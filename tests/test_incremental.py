@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import pytest
+from surprise import Dataset, Reader, SVD, SVDpp
+
+from recsys.benchmark import synthetic_ratings
+from recsys.incremental import sgd_update, update_model
+from recsys.topk import build_top_k
+
+
+@pytest.mark.parametrize("algo_class", [SVD, SVDpp])
+def test_update_patches_top_k(algo_class):
+    df = synthetic_ratings(300, 80, 3000, seed=0)
+    trainset = Dataset.load_from_df(
+        df, Reader(rating_scale=(0, 1))).build_full_trainset()
+    algo = algo_class(n_factors=5, n_epochs=5, random_state=0).fit(trainset)
+    output = {"algo": algo, "predictions": [], "encoders": None,
+              "top_n": build_top_k(algo, max_n=10)}
+    rng = np.random.RandomState(1)
+    ratings = pd.DataFrame({
+        "user_id": list(rng.choice(df["user_id"].unique(), 10)) + ["new"],
+        "item_id": list(rng.choice(df["item_id"].unique(), 10)) + ["new"],
+        "recommend": rng.randint(0, 2, 11)})
+
+    top_n = update_model(output, ratings, max_n=10)["top_n"]
+    # the same lists as ranking every user of the updated model again
+    full = build_top_k(algo, max_n=10)
+    assert len(top_n) == len(full)
+    for uid in full.users:
+        assert top_n[uid] == full[uid]
+
+
+def test_sgd_update_repeated_items():
+    df = pd.DataFrame({"user_id": ["a", "a", "b"], "item_id": ["x", "y", "x"],
+                       "recommend": [1, 0, 1]})
+    trainset = Dataset.load_from_df(
+        df, Reader(rating_scale=(0, 1))).build_full_trainset()
+    algo = SVDpp(n_factors=2, n_epochs=1, random_state=0).fit(trainset)
+    u = trainset.to_inner_uid("a")
+    x, y = trainset.to_inner_iid("x"), trainset.to_inner_iid("y")
+    # a rates x a second time, and qi of x is zero so only the
+    # regularization moves yj
+    trainset.ur[u].append((x, 1.))
+    algo.qi[x] = 0.
+    algo.lr_yj, algo.reg_yj = 0.1, 1.
+    yj = algo.yj.copy()
+    sgd_update(algo, [(u, x, 1.)], n_epochs=1)
+
+    assert np.allclose(algo.yj[x], yj[x] * (1 - 2 * 0.1))
+    assert np.allclose(algo.yj[y], yj[y] * (1 - 0.1))
+
+
+def test_update_refreshes_predictions():
+    df = synthetic_ratings(100, 30, 800, seed=0)
+    trainset = Dataset.load_from_df(
+        df, Reader(rating_scale=(0, 1))).build_full_trainset()
+    algo = SVD(n_factors=5, n_epochs=5, random_state=0).fit(trainset)
+    holdout = [("0", "1", 1.), ("2", "3", 0.), ("4", "5", 1.)]
+    predictions = [algo.predict(uid, iid, r) for uid, iid, r in holdout]
+    output = {"algo": algo, "predictions": predictions, "encoders": None,
+              "top_n": None}
+    ratings = pd.DataFrame({"user_id": ["0", "new"], "item_id": ["7", "5"],
+                            "recommend": [0, 1]})
+
+    updated = update_model(output, ratings)["predictions"]
+    # the holdout keeps its pairs and true ratings, training rows are not
+    # added
+    assert [(p.uid, p.iid, p.r_ui) for p in updated] == holdout
+    assert updated[1] is predictions[1]
+    assert updated[0].est == algo.predict("0", "1").est
+    assert updated[2].est == algo.predict("4", "5").est
@@ -0,0 +1,111 @@
+import re
+
+import pytest
+from flask import Flask, jsonify
+
+from recsys.metrics import Histogram, ServingMetrics, mark_error
+
+
+@pytest.fixture
+def served():
+    server = Flask(__name__)
+    metrics = ServingMetrics()
+
+    @server.route("/predict", methods=["POST"])
+    def predict():
+        return jsonify({"est": 0.5})
+
+    @server.route("/rec", methods=["POST"])
+    def rec():
+        # a failure answered with 200, as the routes of main.py do
+        mark_error()
+        return jsonify({"error": "User 1 is not part of the trainset."})
+
+    @server.route("/similar", methods=["POST"])
+    def similar():
+        raise RuntimeError("index missing")
+
+    @server.route("/untracked")
+    def untracked():
+        return jsonify({"error": "not counted"})
+
+    metrics.instrument(server, ["/predict", "/rec", "/similar"])
+    return server.test_client(), metrics
+
+
+def samples(text):
+    return dict(re.findall(r"^(\S+) (\S+)$", text, flags=re.M))
+
+
+def test_histogram_buckets():
+    histogram = Histogram("latency", "Latency.", ["endpoint"],
+                          buckets=(0.1, 1.))
+    for value in (0.05, 0.1, 0.5, 2.):
+        histogram.observe(value, "/rec")
+    lines = samples("\n".join(histogram.render()))
+
+    # cumulative, an observation on a bound falls in its bucket
+    assert lines['latency_bucket{endpoint="/rec",le="0.1"}'] == "2"
+    assert lines['latency_bucket{endpoint="/rec",le="1.0"}'] == "3"
+    assert lines['latency_bucket{endpoint="/rec",le="+Inf"}'] == "4"
+    assert float(lines['latency_sum{endpoint="/rec"}']) == \
+        pytest.approx(2.65)
+    assert lines['latency_count{endpoint="/rec"}'] == "4"
+
+
+def test_requests_and_errors(served):
+    client, metrics = served
+    for _ in range(3):
+        assert client.post("/predict", json={}).status_code == 200
+    assert client.post("/rec", json={}).status_code == 200
+    assert client.post("/similar", json={}).status_code == 500
+    client.get("/untracked")
+    lines = samples(metrics.render())
+
+    assert lines['recsys_http_requests_total{endpoint="/predict"}'] == "3"
+    assert 'recsys_http_errors_total{endpoint="/predict"}' not in lines
+    # the 200 with an error, and the exception as a 500
+    assert lines['recsys_http_errors_total{endpoint="/rec"}'] == "1"
+    assert lines['recsys_http_errors_total{endpoint="/similar"}'] == "1"
+    assert lines['recsys_http_request_duration_seconds_count'
+                 '{endpoint="/predict"}'] == "3"
+    assert float(lines['recsys_http_request_duration_seconds_sum'
+                       '{endpoint="/predict"}']) > 0
+    assert not any("/untracked" in name for name in lines)
+
+
+def test_track_callback():
+    metrics = ServingMetrics()
+
+    @metrics.track_callback
+    def update_scatter_plot(fail):
+        if fail:
+            raise ValueError("bad axis")
+        return "figure"
+
+    assert update_scatter_plot(False) == "figure"
+    with pytest.raises(ValueError):
+        update_scatter_plot(True)
+    lines = samples(metrics.render())
+
+    assert lines['recsys_dash_callbacks_total'
+                 '{callback="update_scatter_plot"}'] == "2"
+    assert lines['recsys_dash_callback_errors_total'
+                 '{callback="update_scatter_plot"}'] == "1"
+    assert lines['recsys_dash_callback_duration_seconds_count'
+                 '{callback="update_scatter_plot"}'] == "2"
+
+
+def test_main_routes():
+    pytest.importorskip("dash")
+    import main
+
+    client = main.server.test_client()
+    response = client.get("/ping")
+    assert response.status_code == 200
+    assert response.get_json() == {"status": "OK"}
+
+    response = client.post("/rec", json={"uid": "missing key"})
+    assert "error" in response.get_json()
+    lines = samples(client.get("/metrics").get_data(as_text=True))
+    assert int(lines['recsys_http_errors_total{endpoint="/rec"}']) >= 1
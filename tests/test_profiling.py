@@ -0,0 +1,101 @@
+import json
+import sys
+
+import numpy as np
+import pytest
+
+from recsys import steam_preprocess
+from recsys.profiling import PROFILE_ENV, StageProfiler
+from recsys.synthetic import generate
+
+# above glibc's largest mmap threshold, so freeing returns the memory
+BLOCK = 64 * 1024 ** 2 // 8
+
+
+def test_nested_stage_reports(tmp_path, capsys):
+    profiler = StageProfiler("rss")
+    with profiler.stage("load", file="games.json"):
+        with profiler.stage("parse"):
+            block = np.ones(BLOCK)
+        del block
+        with profiler.stage("summary"):
+            pass
+    profiler.write_report(str(tmp_path / "profile"))
+
+    with open(tmp_path / "profile.json") as f:
+        report = json.load(f)
+    stages = report["stages"]
+    assert report["memory"] == "rss"
+    assert [(r["name"], r["depth"]) for r in stages] == \
+        [("load", 0), ("parse", 1), ("summary", 1)]
+    assert stages[0]["file"] == "games.json"
+    # every stage reports its own peak, the enclosing one the highest
+    assert stages[1]["peak_rss_growth_mb"] >= 60
+    assert stages[0]["peak_rss_mb"] == pytest.approx(
+        stages[1]["peak_rss_mb"], abs=1)
+    assert stages[2]["peak_rss_mb"] < stages[1]["peak_rss_mb"] - 60
+    assert all(r["peak_rss_growth_mb"] >= 0 for r in stages)
+
+    text = (tmp_path / "profile.txt").read_text()
+    assert text == capsys.readouterr().out.split("profile written")[0]
+    lines = text.splitlines()
+    assert lines[2].startswith("load ")
+    assert lines[3].startswith("  parse ")
+    assert "-0.0" not in text
+
+
+def test_repeated_stages_report_their_own_peak():
+    # as a reused pool worker running one fold after another
+    profiler = StageProfiler("rss")
+    for _ in range(3):
+        with profiler.stage("fold"):
+            block = np.ones(BLOCK)
+            del block
+    assert all(r["peak_rss_growth_mb"] >= 60 for r in profiler.records)
+
+
+def test_tracemalloc_report():
+    profiler = StageProfiler("tracemalloc")
+    with profiler.stage("outer"):
+        with profiler.stage("inner"):
+            block = [0] * 1024 ** 2
+        del block
+
+    outer, inner = profiler.records
+    assert inner["traced_peak_mb"] >= 7
+    assert outer["traced_peak_mb"] >= inner["traced_peak_mb"]
+    assert "traced MB" in profiler.report()
+
+
+def test_disabled(tmp_path):
+    profiler = StageProfiler()
+    with profiler.stage("load"):
+        pass
+    profiler.write_report(str(tmp_path / "profile"))
+
+    assert profiler.records == []
+    assert not (tmp_path / "profile.json").exists()
+
+
+@pytest.mark.parametrize("value, memory", [
+    ("", None), ("0", None), ("off", None), ("1", "rss"), ("rss", "rss"),
+    ("TraceMalloc", "tracemalloc")])
+def test_env_switch(monkeypatch, value, memory):
+    monkeypatch.setenv(PROFILE_ENV, value)
+    assert StageProfiler.from_env().memory == memory
+
+
+def test_profile_flag(tmp_path, monkeypatch):
+    generate(str(tmp_path), 200, 30, seed=0)
+    monkeypatch.setattr(steam_preprocess, "profiler", StageProfiler())
+    monkeypatch.setattr(sys, "argv", ["steam_preprocess.py", "--data_dir",
+                                      str(tmp_path), "--profile"])
+    steam_preprocess.main()
+
+    with open(tmp_path / "profile_preprocess.json") as f:
+        report = json.load(f)
+    names = [r["name"] for r in report["stages"]]
+    assert report["memory"] == "rss"
+    assert "load_data steam_games.json" in names
+    assert "encode_ids" in names
+    assert (tmp_path / "profile_preprocess.txt").exists()
@@ -0,0 +1,87 @@
+import pickle
+import time
+
+import pytest
+from surprise import Dataset, Reader, SVD
+
+from recsys import artifacts
+from recsys.artifacts import save_model_output
+from recsys.benchmark import synthetic_ratings
+from recsys.registry import ModelRegistry, artifact_stamp
+from recsys.topk import build_top_k
+
+
+@pytest.fixture(scope="module")
+def models():
+    trainset = Dataset.load_from_df(
+        synthetic_ratings(100, 40, 1000, seed=0),
+        Reader(rating_scale=(0, 1))).build_full_trainset()
+    return [SVD(n_factors=n_factors, n_epochs=2, random_state=0).fit(trainset)
+            for n_factors in (2, 3, 4)]
+
+
+def write(algo, directory):
+    save_model_output({"algo": algo, "top_n": build_top_k(algo, max_n=5)},
+                      directory)
+
+
+def n_factors(registry):
+    return registry.current().algo.n_factors
+
+
+def test_reload_swaps_new_model(tmp_path, models):
+    directory = str(tmp_path / "model")
+    write(models[0], directory)
+    registry = ModelRegistry(directory, max_n=5)
+    old = registry.current()
+
+    write(models[1], directory)
+    assert registry.reload()
+    assert n_factors(registry) == 3
+    # a snapshot taken before the swap stays whole
+    assert old.algo.n_factors == 2
+    assert old.top_n_index.items.shape[0] == \
+        registry.current().top_n_index.items.shape[0]
+
+
+def test_current_model_kept_while_swapping(tmp_path, monkeypatch, models):
+    directory = str(tmp_path / "model")
+    write(models[0], directory)
+    registry = ModelRegistry(directory, max_n=5)
+    # a legacy pickle left next to the artifact must not be served
+    with open(directory + ".pkl", "wb") as f:
+        pickle.dump({"algo": models[2], "predictions": []}, f)
+
+    rename = artifacts.rename
+    seen = []
+
+    def checked_rename(src, dst):
+        rename(src, dst)
+        # between and right after the renames of save_model_output
+        seen.append((artifact_stamp(directory), registry.reload()))
+        assert n_factors(registry) == 2
+
+    monkeypatch.setattr(artifacts, "rename", checked_rename)
+    write(models[1], directory)
+
+    assert seen == [(None, False), (None, False)]
+    assert registry.reload()
+    assert n_factors(registry) == 3
+
+
+def test_watcher_picks_up_new_model(tmp_path, models):
+    directory = str(tmp_path / "model")
+    write(models[0], directory)
+    registry = ModelRegistry(directory, poll_interval=0.01, max_n=5).start()
+    try:
+        for model in models[1:] * 3:
+            write(model, directory)
+            # every read in between sees one complete model
+            assert n_factors(registry) in (2, 3, 4)
+        deadline = time.time() + 10
+        while n_factors(registry) != 4 and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        registry.stop()
+
+    assert n_factors(registry) == 4
@@ -0,0 +1,53 @@
+import pytest
+
+from recsys.benchmark import synthetic_ratings
+from recsys.search import search_algorithms
+
+SPACES = {"CoClustering": {"n_cltr_u": [2, 3, 5, 8],
+                           "n_cltr_i": [2, 3, 5, 8],
+                           "n_epochs": [5, 10]},
+          "SlopeOne": {}}
+
+
+@pytest.fixture(scope="module")
+def ratings():
+    return synthetic_ratings(300, 60, 3000, seed=0)
+
+
+@pytest.mark.parametrize("budget", [2., 5., 12.])
+def test_search_within_budget(ratings, budget):
+    results = search_algorithms(ratings, budget, SPACES, kfold=3)
+    search = results["CoClustering"]["search"]
+
+    # SlopeOne has nothing to tune, CoClustering gets the whole budget
+    assert results["SlopeOne"]["search"] is None
+    assert search["budget"] == budget
+    assert search["cost"] <= budget
+    # the budget pays for more than one configuration
+    assert len([t for t in search["trials"] if t["rung"] == 0]) > 1
+
+
+def test_search_budget_too_small(ratings, caplog):
+    results = search_algorithms(ratings, 0.2, SPACES, kfold=3)
+
+    assert results["CoClustering"]["search"] is None
+    assert "defaults are kept" in caplog.text
+
+
+def test_unspent_budget_passed_on(ratings):
+    spaces = {"KNNWithMeans": {"k": [10, 20]}, **SPACES}
+    results = search_algorithms(ratings, 12., spaces, kfold=3)
+    knn = results["KNNWithMeans"]["search"]
+    search = results["CoClustering"]["search"]
+
+    # the whole grid of KNNWithMeans costs less than half the budget
+    assert knn["budget"] == 6.
+    assert knn["cost"] < knn["budget"]
+    assert search["budget"] == pytest.approx(12. - knn["cost"])
+    assert knn["cost"] + search["cost"] <= 12.
+
+
+def test_empty_space_rejected(ratings):
+    spaces = {"CoClustering": {"n_cltr_u": [], "n_epochs": [5]}}
+    with pytest.raises(ValueError, match="n_cltr_u"):
+        search_algorithms(ratings, 5., spaces, kfold=3)
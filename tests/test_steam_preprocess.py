@@ -0,0 +1,37 @@
+from recsys.steam_preprocess import stream_data
+
+
+def write_records(path, n, size):
+    with open(path, "w") as f:
+        for i in range(n):
+            f.write(repr({"user_id": str(i), "items": list(range(size))})
+                    + "\n")
+    return str(path)
+
+
+def test_stream_stats_per_file(tmp_path):
+    big = write_records(tmp_path / "big.json", 300, 100)
+    small = write_records(tmp_path / "small.json", 10, 1)
+    for file in (big, small):
+        for n_jobs in (1, 2):
+            stats = {}
+            records = list(stream_data(file, chunksize=100, n_jobs=n_jobs,
+                                       stats=stats))
+
+            assert stats["records"] == len(records)
+            # the peak of each file, not the growth over an earlier one
+            assert stats["peak_rss_mb"] > 0
+            if n_jobs == 1:
+                assert stats["worker_peak_rss_mb"] == 0
+            else:
+                assert stats["worker_peak_rss_mb"] > 0
+
+
+def test_stream_stats_empty_file(tmp_path):
+    empty = tmp_path / "empty.json"
+    empty.write_text("")
+    stats = {}
+
+    assert list(stream_data(str(empty), stats=stats)) == []
+    assert (stats["records"], stats["records_per_s"], stats["mb_per_s"]) == \
+        (0, 0., 0.)
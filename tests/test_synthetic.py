@@ -0,0 +1,52 @@
+import sys
+from os.path import join
+
+import pytest
+
+from recsys import synthetic
+from recsys.steam_preprocess import load_data
+from recsys.synthetic import GAME_FILE, ITEM_FILE, REVIEW_FILE, generate
+
+FILES = (GAME_FILE, REVIEW_FILE, ITEM_FILE)
+
+
+def read(directory):
+    contents = []
+    for name in FILES:
+        with open(join(directory, name), "rb") as f:
+            contents.append(f.read())
+    return contents
+
+
+def test_same_seed_same_files(tmp_path):
+    stats = generate(str(tmp_path / "a"), 300, 40, chunksize=7, seed=3)
+    generate(str(tmp_path / "b"), 300, 40, chunksize=1000, seed=3)
+    generate(str(tmp_path / "c"), 300, 40, chunksize=1000, seed=4)
+
+    # the chunk size only decides when users are written
+    assert read(tmp_path / "a") == read(tmp_path / "b")
+    assert read(tmp_path / "a") != read(tmp_path / "c")
+
+    games = load_data(join(tmp_path / "a", GAME_FILE))
+    reviews = load_data(join(tmp_path / "a", REVIEW_FILE))
+    items = load_data(join(tmp_path / "a", ITEM_FILE))
+    assert len(games) == stats["games"] == 40
+    assert len(items) == stats["users"] == 300
+    assert sum(len(user["reviews"]) for user in reviews) == stats["reviews"]
+    assert sum(user["items_count"] for user in items) == stats["items"]
+    # every review is of an owned game
+    owned = {user["user_id"]: {item["item_id"] for item in user["items"]}
+             for user in items}
+    assert all(review["item_id"] in owned[user["user_id"]]
+               for user in reviews for review in user["reviews"])
+
+
+@pytest.mark.parametrize("vanity_ratio, vanity", [("0", False), ("1", True)])
+def test_vanity_ratio_flag(tmp_path, monkeypatch, vanity_ratio, vanity):
+    monkeypatch.setattr(sys, "argv", [
+        "synthetic.py", "--directory", str(tmp_path), "--n_users", "50",
+        "--n_items", "20", "--vanity_ratio", vanity_ratio])
+    synthetic.main()
+
+    items = load_data(join(tmp_path, ITEM_FILE))
+    assert all((not user["user_id"].isdigit()) == vanity for user in items)